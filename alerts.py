@@ -0,0 +1,103 @@
+"""
+Expiry alerts for /api/expiry_alerts.
+
+The endpoint answers "expired, or expiring within ?days=" (30 by default).
+Each worker keeps that default window in memory: every drug that is expired
+or expires within EXPIRY_ALERT_WINDOW_DAYS, loaded in one indexed range query
+and sorted by (expiry_date, id). A request inside the window is then a bisect
+and a slice. Longer horizons are rare and go to the database as one keyset
+page over the same range (expiring_within()), so no worker holds a year of
+the catalog.
+
+The copy is rebuilt when the drug table's version (see httpcache.py) or the
+date changes, which also makes it follow writes made by other workers. The
+endpoint derives its ETag from the same version, so an unchanged poll is
+answered with 304 before any drug is read. Databases without table versions
+fall back to rebuilding every EXPIRY_ALERTS_TTL seconds and send no ETag.
+"""
+import bisect
+import threading
+import time
+from datetime import timedelta
+
+from flask import current_app
+
+import httpcache
+from models import db, Drug, current_date
+from pagination import keyset_condition
+
+DEFAULT_WINDOW_DAYS = 30
+# Longest ?days= served
+MAX_DAYS = 3650
+DEFAULT_TTL = 60
+
+COLUMNS = (Drug.expiry_date, Drug.id, Drug.name, Drug.batch_number)
+
+
+def expiring_within(today, days, after=None, limit=50):
+    """One page of (expiry_date, id, name, batch_number) rows up to today + days, and whether more follow."""
+    query = db.session.query(*COLUMNS).filter(Drug.expiry_date <= today + timedelta(days=days))
+    if after:
+        query = query.filter(keyset_condition([Drug.expiry_date, Drug.id], after))
+    rows = query.order_by(Drug.expiry_date, Drug.id).limit(limit + 1).all()
+    return [tuple(r) for r in rows[:limit]], len(rows) > limit
+
+
+class ExpirySnapshot:
+    """Immutable view of the alert window for one day and drug table version."""
+
+    def __init__(self, today, window_days, version, rows):
+        self.today = today
+        self.window_days = window_days
+        self.version = version
+        # rows: (expiry_date, id, name, batch_number), sorted by (expiry_date, id)
+        self.rows = rows
+        self.keys = [(r[0], r[1]) for r in rows]
+
+    def window(self, days, after=None, limit=None):
+        """Rows expiring on or before today + days, starting after the (date, id) key."""
+        end = bisect.bisect_right(self.keys, (self.today + timedelta(days=days), float('inf')))
+        start = bisect.bisect_right(self.keys, tuple(after)) if after else 0
+        stop = end if limit is None else min(end, start + limit)
+        return self.rows[start:stop], stop < end
+
+
+class ExpiryBuckets:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._stored_at = 0.0
+        self._generation = 0
+
+    def snapshot(self, today=None):
+        today = today or current_date()
+        window_days = current_app.config.get('EXPIRY_ALERT_WINDOW_DAYS', DEFAULT_WINDOW_DAYS)
+        ttl = current_app.config.get('EXPIRY_ALERTS_TTL', DEFAULT_TTL)
+        version, _ = httpcache.stamp(('drug',))
+
+        with self._lock:
+            current = self._snapshot
+            if (current is not None and current.today == today and current.window_days == window_days
+                    and (current.version == version if version is not None
+                         else time.monotonic() - self._stored_at < ttl)):
+                return current
+            generation = self._generation
+
+        rows = db.session.query(*COLUMNS) \
+            .filter(Drug.expiry_date <= today + timedelta(days=window_days)) \
+            .order_by(Drug.expiry_date, Drug.id).all()
+        snapshot = ExpirySnapshot(today, window_days, version, [tuple(r) for r in rows])
+
+        with self._lock:
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self._stored_at = time.monotonic()
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._generation += 1
+
+
+expiry_buckets = ExpiryBuckets()
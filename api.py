@@ -0,0 +1,218 @@
+"""
+Versioned JSON API (/api/v1) over drugs, messages and users.
+
+List endpoints page by keyset cursor (see pagination.py), accept
+``?fields=a,b`` to select a subset of columns and resource-specific filters.
+Queries select only the columns being returned and serialize the result
+tuples directly; no ORM objects are built. Encoding uses orjson when it is
+installed and the standard library otherwise.
+
+API clients authenticate with ``Authorization: Bearer <token>``. Tokens are
+created with ``flask --app app create-api-token USERNAME``; only their
+SHA-256 is stored. Token requests are resolved by Flask-Login's
+request_loader, so they never create or update a session cookie. Browser
+sessions keep working for the same endpoints.
+"""
+import hashlib
+import json
+import secrets
+from datetime import date, datetime
+from functools import wraps
+
+from flask import current_app, request, url_for
+from flask_login import current_user
+
+from models import db, ApiToken, Drug, Message, User
+from pagination import keyset_paginate, parse_per_page
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+VERSION = 'v1'
+PREFIX = f'/api/{VERSION}'
+
+
+class ApiError(ValueError):
+    """A bad API request; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def auth_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting to the login page."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            response = json_response({'error': 'Authentication required'}, 401)
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    return current_app.response_class(dumps(payload), status=status, mimetype='application/json')
+
+
+class Resource:
+    """
+    The columns a resource exposes, in output order.
+
+    ``columns`` maps field name -> SQL column expression; ``sort`` lists the
+    keyset sort columns (ending with a unique one). ``joins`` are
+    (target, condition) pairs for fields taken from other tables.
+    """
+
+    def __init__(self, name, model, columns, sort, descending=False, default_fields=None, joins=()):
+        self.name = name
+        self.model = model
+        self.columns = columns
+        self.sort = sort
+        self.descending = descending
+        self.default_fields = default_fields or list(columns)
+        self.joins = joins
+
+    def parse_fields(self, raw):
+        if not raw:
+            return self.default_fields
+        fields = [f.strip() for f in raw.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in self.columns]
+        if unknown:
+            raise ApiError(f"Unknown field(s) for {self.name}: {', '.join(unknown)}; "
+                           f"choose from {', '.join(self.columns)}")
+        return list(dict.fromkeys(fields)) or self.default_fields
+
+    def query(self, fields):
+        """Select ``fields`` followed by the sort key columns."""
+        query = db.session.query(*[self.columns[f].label(f) for f in fields], *self.sort)
+        for target, condition in self.joins:
+            query = query.join(target, condition)
+        return query
+
+    def rows(self, fields, query, cursor, per_page):
+        """One keyset page of ``query``: ([{field: value}], next_cursor)."""
+        width = len(fields)
+        page = keyset_paginate(query, self.sort, cursor=cursor, per_page=per_page,
+                               descending=self.descending, key=lambda row: row[width:])
+        return [dict(zip(fields, row[:width])) for row in page.items], page.next_cursor
+
+    def one(self, fields, ident):
+        row = self.query(fields).filter(self.model.id == ident).first()
+        if row is None:
+            raise ApiError(f'{self.name[:-1].capitalize()} {ident} not found', 404)
+        return dict(zip(fields, row[:len(fields)]))
+
+
+def drug_resource(today):
+    # Status depends on today's date, so the resource is built per request
+    return Resource('drugs', Drug, {
+        'id': Drug.id,
+        'name': Drug.name,
+        'description': Drug.description,
+        'quantity': Drug.quantity,
+        'price': Drug.price,
+        'expiry_date': Drug.expiry_date,
+        'batch_number': Drug.batch_number,
+        'supplier': Drug.supplier,
+        'status': Drug.status_expression(today),
+        'version': Drug.version,
+        'updated_at': Drug.updated_at,
+    }, [Drug.name, Drug.id])
+
+
+MESSAGES = Resource('messages', Message, {
+    'id': Message.id,
+    'title': Message.title,
+    'content': Message.content,
+    'timestamp': Message.timestamp,
+    'is_urgent': Message.is_urgent,
+    'sender_id': Message.sender_id,
+    'sender': User.username,
+    'sender_role': User.role,
+}, [Message.timestamp, Message.id], descending=True, joins=[(User, Message.sender_id == User.id)])
+
+USERS = Resource('users', User, {
+    'id': User.id,
+    'username': User.username,
+    'role': User.role,
+    'created_at': User.created_at,
+}, [User.id])
+
+
+def parse_bool(value, name):
+    if value is None or value == '':
+        return None
+    lowered = value.lower()
+    if lowered in ('1', 'true', 'yes'):
+        return True
+    if lowered in ('0', 'false', 'no'):
+        return False
+    raise ApiError(f'{name} must be true or false')
+
+
+def parse_int(value, name):
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError(f'{name} must be an integer')
+
+
+def parse_datetime(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f'{name} must be an ISO 8601 date or date and time')
+
+
+def page_args(args):
+    return args.get('after'), parse_per_page(args.get('per_page'))
+
+
+def page_payload(data, next_cursor):
+    """The list envelope: data plus the cursor and URL of the next page."""
+    links = {}
+    if next_cursor:
+        args = request.args.to_dict()
+        args['after'] = next_cursor
+        links['next'] = url_for(request.endpoint, **args)
+    return {'data': data, 'next_cursor': next_cursor, 'links': links}
+
+
+def token_hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def create_token(user, name=None):
+    """Store a new token for ``user`` and return it; it cannot be recovered later."""
+    token = secrets.token_urlsafe(32)
+    db.session.add(ApiToken(user_id=user.id, name=name, token_hash=token_hash(token)))
+    return token
+
+
+def token_user_id(header):
+    """The user id for an ``Authorization: Bearer`` header value, or None."""
+    scheme, _, token = (header or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return db.session.query(ApiToken.user_id) \
+        .filter(ApiToken.token_hash == token_hash(token.strip())).scalar()
@@ -0,0 +1,89 @@
+"""
+Message retention: moving old notices out of the live table.
+
+Non-urgent messages older than MESSAGE_RETENTION_DAYS are copied to
+archived_message and deleted from message, ARCHIVE_BATCH_SIZE rows at a
+time. Each batch is its own short transaction: the oldest ids are found with
+a range scan of ix_message_timestamp_id, then one INSERT ... SELECT and one
+DELETE by primary key move them. Locks are held for one batch only, and an
+interrupted run simply resumes from the oldest remaining message next time.
+Urgent messages are never archived; stock alerts stop being urgent once
+closed (see stock_alerts.py).
+
+The live timeline (messages page, dashboard, exports, the API) therefore
+only ever reads the retention window. Old messages stay searchable through
+search() and the /messages/archive page.
+"""
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, literal, select
+
+from models import db, ArchivedMessage, Message, User
+from pagination import keyset_paginate
+
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_BATCH_SIZE = 1000
+
+ARCHIVE_COLUMNS = ('message_id', 'title', 'content', 'timestamp', 'is_urgent', 'sender_id')
+
+
+def archive_batch(cutoff, batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """Move up to ``batch_size`` of the oldest archivable messages; returns how many moved."""
+    ids = [row[0] for row in db.session.query(Message.id)
+           .filter(Message.timestamp < cutoff, Message.is_urgent.isnot(True))
+           .order_by(Message.timestamp, Message.id).limit(batch_size)]
+    if not ids:
+        return 0
+    copied = select(Message.id, Message.title, Message.content, Message.timestamp,
+                    Message.is_urgent, Message.sender_id,
+                    literal(now or datetime.utcnow(), ArchivedMessage.archived_at.type)) \
+        .where(Message.id.in_(ids))
+    db.session.execute(insert(ArchivedMessage).from_select(ARCHIVE_COLUMNS + ('archived_at',), copied))
+    db.session.execute(delete(Message).where(Message.id.in_(ids))
+                       .execution_options(synchronize_session=False))
+    return len(ids)
+
+
+def archive_messages(retention_days=DEFAULT_RETENTION_DAYS, batch_size=DEFAULT_BATCH_SIZE,
+                     max_batches=None, pause=0.0, now=None):
+    """Archive everything past the retention window, committing after each batch."""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=retention_days)
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        try:
+            moved = archive_batch(cutoff, batch_size, now)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        total += moved
+        batches += 1
+        if moved < batch_size:
+            break
+        if pause:
+            # Leaves room for other writers between batches
+            time.sleep(pause)
+    return total
+
+
+def search(q=None, sender=None, date_from=None, date_to=None, cursor=None, per_page=50):
+    """One page of archived messages, newest first, matching the given filters."""
+    query = db.session.query(
+        ArchivedMessage.id, ArchivedMessage.title, ArchivedMessage.content,
+        ArchivedMessage.timestamp, ArchivedMessage.is_urgent,
+        User.username.label('sender'), User.role.label('sender_role')
+    ).join(User, ArchivedMessage.sender_id == User.id)
+    if q:
+        needle = q.lower()
+        query = query.filter(func.lower(ArchivedMessage.title).contains(needle, autoescape=True)
+                             | func.lower(ArchivedMessage.content).contains(needle, autoescape=True))
+    if sender:
+        query = query.filter(User.username == sender)
+    if date_from:
+        query = query.filter(ArchivedMessage.timestamp >= date_from)
+    if date_to:
+        query = query.filter(ArchivedMessage.timestamp < date_to + timedelta(days=1))
+    return keyset_paginate(query, [ArchivedMessage.timestamp, ArchivedMessage.id], cursor=cursor,
+                           per_page=per_page, descending=True)
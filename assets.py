@@ -0,0 +1,160 @@
+"""
+Fingerprinted, precompressed static assets.
+
+build() copies every file under static/ to ASSETS_FOLDER under a name that
+carries a hash of its content (style.css -> style.3f2a9c1b7d4e.css), writes
+.gz and, when the ``brotli`` package is installed, .br variants of text
+files, and records the mapping in manifest.json. It runs as a build step
+(``flask --app app build-assets``, see the Dockerfile) and again at startup,
+which only writes what is missing, so a checkout without a build still works.
+
+url_for('static', filename=...) returns the fingerprinted URL for any file in
+the manifest. Those URLs are answered by AssetMiddleware, which wraps the WSGI
+app and serves the in-memory bytes before Flask builds a request context: no
+session, no database, no request hooks. A changed file gets a new name, so
+responses are cached for a year as immutable. Unknown paths fall through to
+Flask's regular static route.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+def fingerprint(name, data):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def _compressible(name):
+    mimetype = mimetypes.guess_type(name)[0] or ''
+    return mimetype.startswith(COMPRESSIBLE)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _write(path, data, overwrite=False):
+    if overwrite or not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a concurrent reader never sees half a file
+        partial = f'{path}.{os.getpid()}.tmp'
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+
+
+def build(source, target):
+    """Fingerprint and precompress everything under ``source`` into ``target``; returns the manifest."""
+    manifest = {}
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, source).replace(os.sep, '/')
+            data = _read(path)
+            hashed = fingerprint(name, data)
+            manifest[name] = hashed
+            output = os.path.join(target, hashed)
+            _write(output, data)
+            if _compressible(name):
+                _write(output + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write(output + '.br', brotli.compress(data, quality=11))
+
+    encoded = json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8')
+    path = os.path.join(target, MANIFEST)
+    if not os.path.exists(path) or _read(path) != encoded:
+        _write(path, encoded, overwrite=True)
+    return manifest
+
+
+class Asset:
+    """One fingerprinted file: its bytes per Content-Encoding (None = identity)."""
+
+    def __init__(self, path):
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.mimetype.startswith('text/'):
+            self.mimetype += '; charset=utf-8'
+        self.variants = {}
+        for encoding, suffix in ((None, ''), ('gzip', '.gz'), ('br', '.br')):
+            if os.path.exists(path + suffix):
+                self.variants[encoding] = _read(path + suffix)
+        # The name already identifies the content
+        self.etag = os.path.basename(path)
+
+    def choose(self, accept_encoding):
+        accepted = parse_accept_header(accept_encoding, Accept)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted[encoding]:
+                return encoding
+        return None
+
+
+class AssetMiddleware:
+    """Serves fingerprinted assets ahead of the Flask app."""
+
+    def __init__(self, wsgi_app, assets):
+        self.wsgi_app = wsgi_app
+        # URL path -> Asset
+        self.assets = assets
+
+    def __call__(self, environ, start_response):
+        asset = self.assets.get(environ.get('PATH_INFO'))
+        if asset is None or environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            return self.wsgi_app(environ, start_response)
+
+        headers = [('Cache-Control', CACHE_CONTROL), ('Vary', 'Accept-Encoding'),
+                   ('ETag', quote_etag(asset.etag))]
+        if parse_etags(environ.get('HTTP_IF_NONE_MATCH')).contains_weak(asset.etag):
+            start_response('304 Not Modified', headers)
+            return []
+
+        encoding = asset.choose(environ.get('HTTP_ACCEPT_ENCODING'))
+        body = asset.variants[encoding]
+        headers += [('Content-Type', asset.mimetype), ('Content-Length', str(len(body)))]
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        start_response('200 OK', headers)
+        return [] if environ['REQUEST_METHOD'] == 'HEAD' else [body]
+
+
+def folder(app):
+    return app.config.get('ASSETS_FOLDER') or os.path.join(app.root_path, 'build', 'static')
+
+
+def init_app(app):
+    """Build missing assets, rewrite url_for('static') and install the middleware."""
+    target = folder(app)
+    try:
+        manifest = build(app.static_folder, target)
+    except OSError as e:
+        # A read-only checkout without a build: serve the plain files
+        app.logger.warning('Static assets not fingerprinted: %s', e)
+        return
+
+    static_path = app.static_url_path.rstrip('/')
+    app.wsgi_app = AssetMiddleware(app.wsgi_app, {
+        f'{static_path}/{hashed}': Asset(os.path.join(target, hashed)) for hashed in manifest.values()
+    })
+
+    @app.url_defaults
+    def fingerprinted_static(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
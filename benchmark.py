@@ -0,0 +1,611 @@
+"""
+Benchmark harness: seed synthetic data, time every route, compare runs.
+
+    python benchmark.py seed --database-url sqlite:///bench.db \\
+        --users 5000 --drugs 100000 --messages 1000000
+    python benchmark.py run --database-url sqlite:///bench.db --output baseline.json
+    python benchmark.py run --database-url sqlite:///bench.db --output current.json \\
+        --compare baseline.json
+    python benchmark.py check baseline.json current.json
+
+``seed`` migrates an empty database and bulk-inserts deterministic random
+users, drugs and messages; every user's password is BENCH_PASSWORD. ``run``
+logs in as BENCH_USER and drives each SCENARIOS entry through the Flask test
+client (latency percentiles and SQL statements per request), then runs a
+concurrent HTTP load against the read-only pages on an in-process threaded
+server (or --target, an already running server). Rows the scenarios create
+are removed and the stock they moved is put back afterwards, so repeated
+runs see the same volumes and quantities. ``check`` exits non-zero when the
+current result regressed against the baseline: more queries on any route,
+or latency, throughput or peak RSS worse than --tolerance.
+"""
+import argparse
+import io
+import json
+import platform
+import random
+import resource
+import secrets
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.cookiejar import CookieJar
+
+from flask import current_app, url_for
+from sqlalchemy import create_engine, event, func, select, update
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import database
+import migrations
+from models import db, User, Drug, Message, StockMovement
+from pagination import encode_cursor
+from passwords import DEFAULT_METHOD
+
+BENCH_USER = 'bench'
+BENCH_PASSWORD = 'Bench123!'
+# Marks rows created by scenarios so cleanup() can remove them
+BENCH_TAG = 'BENCH-RUN'
+ACCEPT_ENCODING = {'Accept-Encoding': 'br, gzip'}
+
+SEED_BATCH_SIZE = 10000
+ROLES = ('doctor', 'nurse', 'pharmacist')
+SYLLABLES = ('amo', 'xi', 'cil', 'lin', 'para', 'ceta', 'mol', 'ibu', 'pro', 'fen',
+             'met', 'for', 'min', 'ator', 'va', 'sta', 'tin', 'lo', 'sar', 'tan',
+             'ome', 'pra', 'zole', 'cet', 'iri', 'zine', 'do', 'xy', 'cy', 'cline')
+SUPPLIERS = [f'{a} {b}' for a in ('Pharma', 'Medi', 'Health', 'Cura', 'Vita')
+             for b in ('Corp', 'Supplies', 'Plus', 'Labs', 'Direct', 'Partners')]
+TOPICS = ('stock check', 'delivery', 'recall notice', 'shift change', 'audit',
+          'temperature alarm', 'meeting', 'order request', 'expiry review')
+
+
+def drug_names(rng, count=400):
+    """A vocabulary of plausible drug names for seeding and search queries."""
+    names = set()
+    while len(names) < count:
+        parts = rng.sample(SYLLABLES, rng.randint(2, 4))
+        names.add(''.join(parts).capitalize())
+    return sorted(names)
+
+
+def _insert(conn, table, rows):
+    if rows:
+        conn.execute(table.insert(), rows)
+
+
+def seed(engine, users, drugs, messages, seed=0, log=print, password_method=DEFAULT_METHOD):
+    """Migrate ``engine``'s database and fill it with synthetic rows."""
+    migrations.upgrade(engine, log=lambda msg: None)
+    rng = random.Random(seed)
+    # One hash for everyone: seeding 5k users should not take 5k hash rounds
+    password_hash = generate_password_hash(BENCH_PASSWORD, method=password_method)
+    now = datetime.utcnow()
+    today = now.date()
+    names = drug_names(rng)
+
+    with engine.begin() as conn:
+        rows = []
+        for i in range(users):
+            username = BENCH_USER if i == 0 else f'user{i:06d}'
+            rows.append({'username': username, 'email': f'{username}@bench.test',
+                         'role': 'pharmacist' if i == 0 else ROLES[i % len(ROLES)],
+                         'password_hash': password_hash, 'created_at': now})
+            if len(rows) == SEED_BATCH_SIZE:
+                _insert(conn, User.__table__, rows)
+                rows = []
+        _insert(conn, User.__table__, rows)
+        user_ids = list(conn.execute(select(User.id)).scalars())
+    log(f'Seeded {users} users')
+
+    written = 0
+    while written < drugs:
+        count = min(SEED_BATCH_SIZE, drugs - written)
+        rows = [{
+            'name': rng.choice(names),
+            'description': f'{rng.choice(names)} based {rng.choice(("tablet", "syrup", "injection", "cream"))}',
+            'quantity': rng.choice((rng.randint(0, 9), rng.randint(10, 500), rng.randint(10, 500))),
+            'price': round(rng.uniform(0.5, 250), 2),
+            'expiry_date': today + timedelta(days=rng.randint(-90, 730)),
+            'batch_number': f'B{written + i:08d}',
+            'supplier': rng.choice(SUPPLIERS),
+            'created_at': now,
+            'updated_at': now,
+            'added_by_id': rng.choice(user_ids),
+        } for i in range(count)]
+        with engine.begin() as conn:
+            _insert(conn, Drug.__table__, rows)
+        written += count
+        log(f'Seeded {written}/{drugs} drugs')
+
+    written = 0
+    while written < messages:
+        count = min(SEED_BATCH_SIZE, messages - written)
+        rows = []
+        for _ in range(count):
+            topic = rng.choice(TOPICS)
+            rows.append({
+                'title': f'{topic.capitalize()}: {rng.choice(names)}',
+                'content': f'Please review the {topic} for {rng.choice(names)} '
+                           f'from {rng.choice(SUPPLIERS)}.\nThanks.',
+                'timestamp': now - timedelta(seconds=rng.randint(0, 365 * 86400)),
+                'is_urgent': rng.random() < 0.05,
+                'sender_id': rng.choice(user_ids),
+            })
+        with engine.begin() as conn:
+            _insert(conn, Message.__table__, rows)
+        written += count
+        log(f'Seeded {written}/{messages} messages')
+
+
+def volumes():
+    """Row counts of the seeded tables, from the current app's primary."""
+    return {
+        'users': db.session.query(func.count(User.id)).scalar(),
+        'drugs': db.session.query(func.count(Drug.id)).scalar(),
+        'messages': db.session.query(func.count(Message.id)).scalar(),
+    }
+
+
+def cleanup():
+    """Delete rows created by scenarios and put back the stock they moved."""
+    # Reverse the net change of every benchmark movement before dropping it from the ledger
+    moved = db.session.query(StockMovement.drug_id, func.sum(StockMovement.change)) \
+        .filter(StockMovement.reason == BENCH_TAG).group_by(StockMovement.drug_id).all()
+    for drug_id, change in moved:
+        db.session.execute(update(Drug).where(Drug.id == drug_id)
+                           .values(quantity=Drug.quantity - change, version=Drug.version + 1))
+    db.session.query(Message).filter(Message.title.like(f'{BENCH_TAG}%')).delete(synchronize_session=False)
+    db.session.query(Drug).filter(Drug.batch_number.like(f'{BENCH_TAG}%')).delete(synchronize_session=False)
+    db.session.query(User).filter(User.username.like('bench_signup_%')).delete(synchronize_session=False)
+    db.session.query(StockMovement).filter(StockMovement.reason == BENCH_TAG).delete(synchronize_session=False)
+    db.session.commit()
+
+
+class Context:
+    """Values scenarios build their requests from, looked up once per run."""
+
+    def __init__(self):
+        self.today = datetime.now().date()
+        drug = Drug.query.order_by(Drug.name, Drug.id).offset(50).first() \
+            or Drug.query.order_by(Drug.name, Drug.id).first()
+        message = Message.query.order_by(Message.timestamp.desc(), Message.id.desc()).offset(50).first() \
+            or Message.query.order_by(Message.timestamp.desc(), Message.id.desc()).first()
+        self.drug_id = drug.id if drug else 0
+        self.drug_name = drug.name if drug else ''
+        self.drug_cursor = encode_cursor([drug.name, drug.id]) if drug else ''
+        self.message_cursor = encode_cursor([message.timestamp, message.id]) if message else ''
+        self.message_id = message.id if message else 0
+        self.user_id = message.sender_id if message else 0
+        self.search_word = (drug.name[:5] if drug else 'amox').lower()
+        supplier = db.session.query(Drug.supplier).filter(Drug.supplier.isnot(None)).first()
+        self.supplier = supplier[0] if supplier else ''
+        self.run_id = f'{int(time.time() * 1000) % 10 ** 9}'
+        self.metrics_token = current_app.config.get('METRICS_TOKEN') or ''
+        with current_app.test_request_context():
+            self.stylesheet_url = url_for('static', filename='style.css')
+
+    def created(self, model, column, prefix):
+        """Ids of rows a previous scenario created, newest first."""
+        return [row[0] for row in db.session.query(model.id)
+                .filter(column.like(f'{prefix}%')).order_by(model.id.desc())]
+
+    def drug_form(self, i):
+        return {
+            'name': f'Benchmarkol {i}', 'description': 'Benchmark row', 'quantity': '40',
+            'price': '3.50', 'expiry_date': (self.today + timedelta(days=200)).isoformat(),
+            'batch_number': f'{BENCH_TAG}-{self.run_id}-{i}', 'supplier': 'Bench Labs',
+        }
+
+    def import_file(self, i, rows=100):
+        lines = ['name,description,quantity,price,expiry_date,batch_number,supplier']
+        expiry = (self.today + timedelta(days=300)).isoformat()
+        for n in range(rows):
+            lines.append(f'Importamol {n},Imported,25,1.25,{expiry},{BENCH_TAG}-{self.run_id}-imp-{i}-{n},Bench Labs')
+        return (io.BytesIO('\n'.join(lines).encode()), 'bench.csv')
+
+
+class Scenario:
+    """One kind of request: ``path(ctx, i)``, optional ``data(ctx, i)`` and ``headers(ctx)`` for iteration i."""
+
+    def __init__(self, name, endpoint, path, method='GET', data=None, weight=1.0,
+                 anonymous=False, relogin=False, prepare=None, headers=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.path = path
+        self.method = method
+        self.data = data
+        self.weight = weight
+        self.anonymous = anonymous
+        self.relogin = relogin
+        # Called once before the iterations, e.g. to collect ids to delete
+        self.prepare = prepare
+        self.headers = headers
+
+    def iterations(self, base):
+        return max(1, int(base * self.weight))
+
+
+def _take(attr):
+    return lambda ctx, i: getattr(ctx, attr)[i % len(getattr(ctx, attr))] if getattr(ctx, attr) else 0
+
+
+def _collect(attr, model, column, prefix):
+    def prepare(ctx):
+        setattr(ctx, attr, ctx.created(model, column, prefix))
+    return prepare
+
+
+SCENARIOS = [
+    Scenario('index', 'main.index', lambda ctx, i: '/'),
+    Scenario('login_page', 'main.login', lambda ctx, i: '/login', anonymous=True),
+    Scenario('login', 'main.login', lambda ctx, i: '/login', method='POST', weight=0.25, anonymous=True,
+             data=lambda ctx, i: {'username': BENCH_USER, 'password': BENCH_PASSWORD}),
+    Scenario('signup_page', 'main.signup', lambda ctx, i: '/signup', anonymous=True),
+    Scenario('signup', 'main.signup', lambda ctx, i: '/signup', method='POST', weight=0.25, anonymous=True,
+             data=lambda ctx, i: {'username': f'bench_signup_{ctx.run_id}_{i}',
+                                  'email': f'bench_signup_{ctx.run_id}_{i}@bench.test',
+                                  'password': BENCH_PASSWORD, 'confirm_password': BENCH_PASSWORD,
+                                  'role': 'nurse'}),
+    Scenario('dashboard', 'main.dashboard', lambda ctx, i: '/dashboard'),
+    Scenario('drugs', 'main.drugs', lambda ctx, i: '/drugs'),
+    Scenario('drugs_next_page', 'main.drugs', lambda ctx, i: f'/drugs?after={ctx.drug_cursor}'),
+    Scenario('drugs_expired', 'main.drugs', lambda ctx, i: '/drugs?status=expired'),
+    Scenario('drugs_low_stock', 'main.drugs', lambda ctx, i: '/drugs?status=low_stock'),
+    Scenario('drugs_supplier', 'main.drugs',
+             lambda ctx, i: '/drugs?' + urllib.parse.urlencode({'supplier': ctx.supplier})),
+    Scenario('drugs_search', 'main.search_drugs', lambda ctx, i: f'/drugs/search?q={ctx.search_word}'),
+    Scenario('api_drugs_search', 'main.api_search_drugs',
+             lambda ctx, i: f'/api/drugs/search?q={ctx.search_word}'),
+    # Short prefixes match the most rows; ranking them must stay bounded
+    Scenario('api_drugs_search_prefix', 'main.api_search_drugs',
+             lambda ctx, i: f'/api/drugs/search?q={ctx.search_word[:2]}'),
+    Scenario('api_drugs_search_typo', 'main.api_search_drugs',
+             lambda ctx, i: f'/api/drugs/search?q={ctx.search_word[0]}x{ctx.search_word[2:]}'),
+    Scenario('export_drugs', 'main.export_drugs', lambda ctx, i: '/export/drugs?format=csv', weight=0.1),
+    Scenario('export_messages', 'main.export_messages',
+             lambda ctx, i: '/export/messages?format=ndjson', weight=0.1),
+    Scenario('add_drug_page', 'main.add_drug', lambda ctx, i: '/add_drug'),
+    Scenario('add_drug', 'main.add_drug', lambda ctx, i: '/add_drug', method='POST',
+             data=lambda ctx, i: ctx.drug_form(i)),
+    Scenario('edit_drug_page', 'main.edit_drug', lambda ctx, i: f'/edit_drug/{ctx.drug_id}'),
+    Scenario('edit_drug', 'main.edit_drug', lambda ctx, i: f'/edit_drug/{_take("bench_drugs")(ctx, i)}',
+             method='POST', data=lambda ctx, i: ctx.drug_form(i),
+             prepare=_collect('bench_drugs', Drug, Drug.batch_number, BENCH_TAG)),
+    Scenario('bulk_update_drugs', 'main.bulk_drugs', lambda ctx, i: '/drugs/bulk', method='POST',
+             weight=0.25, data=lambda ctx, i: {'action': 'update', 'ids': ctx.bench_drugs[:50] or ['0'],
+                                               'price': f'{3 + i % 5}.25'},
+             prepare=_collect('bench_drugs', Drug, Drug.batch_number, BENCH_TAG)),
+    Scenario('delete_drug', 'main.delete_drug', lambda ctx, i: f'/delete_drug/{_take("bench_drugs")(ctx, i)}',
+             prepare=_collect('bench_drugs', Drug, Drug.batch_number, BENCH_TAG)),
+    Scenario('bulk_delete_drugs', 'main.bulk_drugs', lambda ctx, i: '/drugs/bulk', method='POST',
+             weight=0.25, data=lambda ctx, i: {'action': 'delete', 'ids': ctx.bench_drugs[i::4][:50] or ['0']},
+             prepare=_collect('bench_drugs', Drug, Drug.batch_number, BENCH_TAG)),
+    Scenario('stock_page', 'main.drug_stock', lambda ctx, i: f'/drugs/{ctx.drug_id}/stock'),
+    Scenario('stock_receive', 'main.drug_stock', lambda ctx, i: f'/drugs/{ctx.drug_id}/stock', method='POST',
+             data=lambda ctx, i: {'action': 'receive', 'amount': '1', 'reason': BENCH_TAG}),
+    Scenario('stock_dispense', 'main.drug_stock', lambda ctx, i: f'/drugs/{ctx.drug_id}/stock', method='POST',
+             data=lambda ctx, i: {'action': 'dispense', 'amount': '1', 'reason': BENCH_TAG}),
+    Scenario('api_drug_quantity', 'main.api_drug_quantity',
+             lambda ctx, i: f'/api/drugs/{ctx.drug_id}/quantity?at={ctx.today.isoformat()}T00:00:00'),
+    Scenario('dispense_page', 'main.dispense', lambda ctx, i: '/dispense'),
+    Scenario('dispense', 'main.dispense', lambda ctx, i: '/dispense', method='POST',
+             data=lambda ctx, i: {'name': ctx.drug_name, 'amount': '1', 'reason': BENCH_TAG}),
+    Scenario('import_drugs_page', 'main.import_drugs', lambda ctx, i: '/import_drugs'),
+    Scenario('import_drugs', 'main.import_drugs', lambda ctx, i: '/import_drugs', method='POST', weight=0.25,
+             data=lambda ctx, i: {'file': ctx.import_file(i)}),
+    Scenario('messages', 'main.messages', lambda ctx, i: '/messages'),
+    Scenario('messages_next_page', 'main.messages', lambda ctx, i: f'/messages?after={ctx.message_cursor}'),
+    Scenario('message_body', 'main.message_body', lambda ctx, i: f'/messages/{ctx.message_id}/body'),
+    Scenario('message_archive', 'main.message_archive', lambda ctx, i: '/messages/archive'),
+    Scenario('message_archive_search', 'main.message_archive',
+             lambda ctx, i: f'/messages/archive?q={ctx.search_word}'),
+    Scenario('message_events_poll', 'main.message_events_poll',
+             lambda ctx, i: f'/events/messages/poll?after={ctx.message_id}'),
+    Scenario('add_message_page', 'main.add_message', lambda ctx, i: '/add_message'),
+    Scenario('add_message', 'main.add_message', lambda ctx, i: '/add_message', method='POST',
+             data=lambda ctx, i: {'title': f'{BENCH_TAG} {i}', 'content': 'Benchmark message\nsecond line'}),
+    Scenario('delete_message', 'main.delete_message',
+             lambda ctx, i: f'/delete_message/{_take("bench_messages")(ctx, i)}',
+             prepare=_collect('bench_messages', Message, Message.title, BENCH_TAG)),
+    Scenario('bulk_delete_messages', 'main.bulk_delete_messages', lambda ctx, i: '/messages/bulk_delete',
+             method='POST', weight=0.25, data=lambda ctx, i: {'ids': ctx.bench_messages[i::4][:50] or ['0']},
+             prepare=_collect('bench_messages', Message, Message.title, BENCH_TAG)),
+    Scenario('expiry_alerts', 'main.expiry_alerts', lambda ctx, i: '/api/expiry_alerts?days=30'),
+    Scenario('api_v1_drugs', 'main.api_drugs', lambda ctx, i: '/api/v1/drugs'),
+    Scenario('api_v1_drugs_sparse', 'main.api_drugs',
+             lambda ctx, i: f'/api/v1/drugs?fields=id,name,quantity&after={ctx.drug_cursor}'),
+    Scenario('api_v1_drug', 'main.api_drug', lambda ctx, i: f'/api/v1/drugs/{ctx.drug_id}'),
+    Scenario('api_v1_messages', 'main.api_messages', lambda ctx, i: '/api/v1/messages'),
+    Scenario('api_v1_message', 'main.api_message', lambda ctx, i: f'/api/v1/messages/{ctx.message_id}'),
+    Scenario('api_v1_users', 'main.api_users', lambda ctx, i: '/api/v1/users'),
+    Scenario('api_v1_user', 'main.api_user', lambda ctx, i: f'/api/v1/users/{ctx.user_id}'),
+    Scenario('static', 'static', lambda ctx, i: '/static/style.css'),
+    Scenario('static_fingerprinted', 'static', lambda ctx, i: ctx.stylesheet_url),
+    Scenario('metrics', 'metrics', lambda ctx, i: '/metrics',
+             headers=lambda ctx: {'Authorization': f'Bearer {ctx.metrics_token}'}),
+    Scenario('logout', 'main.logout', lambda ctx, i: '/logout', relogin=True),
+]
+
+# Endpoints the test-client pass cannot time, with the reason
+SKIPPED_ENDPOINTS = {
+    'main.message_events': 'long-lived SSE stream; it has no response time to measure',
+}
+
+# Pages hit by the concurrent load generator
+LOAD_PATHS = ('/dashboard', '/drugs', '/drugs?status=low_stock', '/messages',
+              '/api/expiry_alerts?days=30', '/api/drugs/search?q=para')
+
+
+def uncovered_endpoints(app):
+    """Endpoints with neither a scenario nor an entry in SKIPPED_ENDPOINTS."""
+    covered = {s.endpoint for s in SCENARIOS} | set(SKIPPED_ENDPOINTS)
+    return {rule.endpoint for rule in app.url_map.iter_rules()} - covered
+
+
+def percentiles(samples):
+    """p50/p95/p99 and mean of ``samples`` (seconds) in milliseconds."""
+    if len(samples) == 1:
+        cuts = samples * 99
+    else:
+        cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p95_ms': round(cuts[94] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+def login(client):
+    response = client.post('/login', data={'username': BENCH_USER, 'password': BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f'Could not log in as {BENCH_USER!r}; was the database seeded?')
+
+
+def measure_routes(app, iterations=20, scenarios=SCENARIOS, log=print):
+    """Drive each scenario through the test client; per-scenario latency and query stats."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # /metrics is only served with a token outside debug and testing
+    if not app.config.get('METRICS_TOKEN'):
+        app.config['METRICS_TOKEN'] = secrets.token_urlsafe()
+    with app.app_context():
+        engines = database.all_engines(db)
+        ctx = Context()
+        db.session.remove()
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', record)
+
+    client = app.test_client()
+    login(client)
+    results = {}
+    try:
+        for scenario in scenarios:
+            if scenario.prepare:
+                with app.app_context():
+                    scenario.prepare(ctx)
+                    db.session.remove()
+            timings, queries, sizes, errors = [], [], [], 0
+            for i in range(scenario.iterations(iterations)):
+                user = app.test_client() if scenario.anonymous else client
+                path = scenario.path(ctx, i)
+                data = scenario.data(ctx, i) if scenario.data else None
+                headers = dict(ACCEPT_ENCODING, **(scenario.headers(ctx) if scenario.headers else {}))
+                del statements[:]
+                started = time.perf_counter()
+                # Ask for compressed bodies as browsers do, so sizes are bytes on the wire
+                response = user.open(path, method=scenario.method, data=data, headers=headers)
+                sizes.append(len(response.get_data()))
+                timings.append(time.perf_counter() - started)
+                queries.append(len(statements))
+                if response.status_code >= 400:
+                    errors += 1
+                if scenario.relogin:
+                    login(client)
+            results[scenario.name] = dict(
+                percentiles(timings), method=scenario.method, endpoint=scenario.endpoint,
+                requests=len(timings), errors=errors,
+                queries_per_request=round(statistics.fmean(queries), 2), max_queries=max(queries),
+                bytes_per_response=round(statistics.fmean(sizes)),
+            )
+            log(f"{scenario.name:24} p95 {results[scenario.name]['p95_ms']:9.2f} ms  "
+                f"{results[scenario.name]['queries_per_request']:6.2f} queries  "
+                f"{results[scenario.name]['bytes_per_response']:8d} bytes")
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', record)
+    return results
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def load_test(app=None, target=None, concurrency=8, requests_per_worker=50, paths=LOAD_PATHS):
+    """Logged-in clients hitting ``paths`` concurrently over real HTTP."""
+    server = None
+    if target is None:
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        target = f'http://127.0.0.1:{server.server_port}'
+
+    def worker(n):
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+        form = urllib.parse.urlencode({'username': BENCH_USER, 'password': BENCH_PASSWORD}).encode()
+        opener.open(target + '/login', data=form).read()
+        # Logins hash passwords; keep them out of the measured window
+        ready.wait()
+        window_start = time.perf_counter()
+        timings, errors = [], 0
+        for i in range(requests_per_worker):
+            started = time.perf_counter()
+            try:
+                opener.open(target + paths[(n + i) % len(paths)]).read()
+            except OSError:
+                errors += 1
+            timings.append(time.perf_counter() - started)
+        return timings, errors, window_start, time.perf_counter()
+
+    ready = threading.Barrier(concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(worker, range(concurrency)))
+    finally:
+        if server is not None:
+            server.shutdown()
+    elapsed = max(o[3] for o in outcomes) - min(o[2] for o in outcomes)
+
+    timings = [t for o in outcomes for t in o[0]]
+    return dict(
+        percentiles(timings), concurrency=concurrency, requests=len(timings),
+        errors=sum(o[1] for o in outcomes), rps=round(len(timings) / elapsed, 1),
+    )
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its finished children."""
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(usage / scale, 1)
+
+
+def run(app, iterations=20, concurrency=8, requests_per_worker=50, target=None, log=print):
+    """Full benchmark of ``app``; the result is what ``check`` compares."""
+    with app.app_context():
+        cleanup()
+        counts = volumes()
+        dialect = db.engine.dialect.name
+    try:
+        routes = measure_routes(app, iterations, log=log)
+        load = None
+        if concurrency:
+            load = load_test(app, target, concurrency, requests_per_worker)
+            log(f"load: {load['rps']} req/s, p95 {load['p95_ms']} ms, {load['errors']} errors")
+    finally:
+        with app.app_context():
+            cleanup()
+    return {
+        'meta': {
+            'database': dialect, 'volumes': counts, 'iterations': iterations,
+            'python': platform.python_version(), 'recorded_at': datetime.utcnow().isoformat(),
+        },
+        'routes': routes,
+        'load': load,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _slower(current, baseline, tolerance, slack_ms):
+    return current > baseline * (1 + tolerance) + slack_ms
+
+
+def compare(baseline, current, tolerance=0.25, slack_ms=2.0):
+    """Regressions of ``current`` against ``baseline``, as readable lines."""
+    problems = []
+    if baseline['meta']['volumes'] != current['meta']['volumes']:
+        problems.append(f"volumes differ: baseline {baseline['meta']['volumes']}, "
+                        f"current {current['meta']['volumes']}")
+    for name, before in baseline['routes'].items():
+        after = current['routes'].get(name)
+        if after is None:
+            problems.append(f'{name}: missing from current run')
+            continue
+        if after['max_queries'] > before['max_queries']:
+            problems.append(f"{name}: {after['max_queries']} queries per request, was {before['max_queries']}")
+        if after['errors'] > before['errors']:
+            problems.append(f"{name}: {after['errors']} errors, was {before['errors']}")
+        if 'bytes_per_response' in before and \
+                after['bytes_per_response'] > before['bytes_per_response'] * (1 + tolerance) + 512:
+            problems.append(f"{name}: {after['bytes_per_response']} bytes per response, "
+                            f"was {before['bytes_per_response']}")
+        for key in ('p95_ms', 'p99_ms'):
+            if _slower(after[key], before[key], tolerance, slack_ms):
+                problems.append(f'{name}: {key} {after[key]:.2f}, was {before[key]:.2f}')
+
+    before, after = baseline.get('load'), current.get('load')
+    if before and after:
+        if _slower(after['p95_ms'], before['p95_ms'], tolerance, slack_ms):
+            problems.append(f"load: p95_ms {after['p95_ms']:.2f}, was {before['p95_ms']:.2f}")
+        if after['rps'] < before['rps'] * (1 - tolerance):
+            problems.append(f"load: {after['rps']} req/s, was {before['rps']}")
+        if after['errors'] > before['errors']:
+            problems.append(f"load: {after['errors']} errors, was {before['errors']}")
+
+    if current['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance):
+        problems.append(f"peak RSS {current['peak_rss_mb']} MB, was {baseline['peak_rss_mb']} MB")
+    return problems
+
+
+def _report(problems):
+    for line in problems:
+        print(f'REGRESSION {line}')
+    if not problems:
+        print('No regressions against the baseline.')
+    return 1 if problems else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='Migrate and fill an empty database.')
+    seed_parser.add_argument('--database-url', required=True)
+    seed_parser.add_argument('--users', type=int, default=5000)
+    seed_parser.add_argument('--drugs', type=int, default=100000)
+    seed_parser.add_argument('--messages', type=int, default=1000000)
+    seed_parser.add_argument('--seed', type=int, default=0)
+
+    run_parser = commands.add_parser('run', help='Time every route and write a JSON result.')
+    run_parser.add_argument('--database-url', required=True)
+    run_parser.add_argument('--output', required=True)
+    run_parser.add_argument('--iterations', type=int, default=20)
+    run_parser.add_argument('--concurrency', type=int, default=8, help='0 skips the load test.')
+    run_parser.add_argument('--requests', type=int, default=50, help='Per load-test client.')
+    run_parser.add_argument('--target', help='Base URL of a running server for the load test.')
+    run_parser.add_argument('--compare', metavar='BASELINE')
+    run_parser.add_argument('--tolerance', type=float, default=0.25)
+
+    check_parser = commands.add_parser('check', help='Compare a result with a baseline.')
+    check_parser.add_argument('baseline')
+    check_parser.add_argument('current')
+    check_parser.add_argument('--tolerance', type=float, default=0.25)
+
+    args = parser.parse_args(argv)
+    if args.command == 'seed':
+        engine = create_engine(args.database_url)
+        try:
+            seed(engine, args.users, args.drugs, args.messages, seed=args.seed)
+        finally:
+            engine.dispose()
+        return 0
+
+    if args.command == 'run':
+        from app import create_app
+        app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url})
+        result = run(app, args.iterations, args.concurrency, args.requests, args.target)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        if not args.compare:
+            return 0
+        with open(args.compare) as f:
+            return _report(compare(json.load(f), result, args.tolerance))
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    return _report(compare(baseline, current, args.tolerance))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Set-based bulk edits and deletes of drugs and messages.
+
+Each operation is one UPDATE or DELETE whose WHERE clause carries the whole
+selection, so clearing a month of expired stock is a single statement rather
+than a get_or_404/delete/commit round trip per row. Message deletes put the
+Message.can_delete rule into the same WHERE clause (Message.deletable_by),
+so rows the user may not delete are skipped without being loaded.
+
+Bulk drug updates bump ``version`` themselves, as Core updates bypass the
+mapper's version counter. The caller commits and calls drugs_changed().
+"""
+from datetime import datetime
+
+from sqlalchemy import delete, or_, update
+
+from models import db, Drug, Message
+
+MAX_IDS = 1000
+
+
+class BulkError(ValueError):
+    """A bulk request that cannot be applied."""
+
+
+def parse_ids(values, form=False):
+    """Selected row ids, de-duplicated: digit strings from a form, else a JSON list of integers."""
+    # A JSON string would otherwise be read one character at a time
+    if not isinstance(values, list):
+        raise BulkError('Selected ids must be a list of integers')
+    try:
+        if form:
+            ids = sorted({int(v) for v in values})
+        elif all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            ids = sorted(set(values))
+        else:
+            raise ValueError
+    except ValueError:
+        raise BulkError('Selected ids must be integers')
+    if not ids:
+        raise BulkError('Nothing selected')
+    if len(ids) > MAX_IDS:
+        raise BulkError(f'At most {MAX_IDS} rows can be changed at once')
+    return ids
+
+
+def parse_drug_update(data):
+    """Column values for a bulk drug update; blank fields are left unchanged."""
+    values = {}
+    price = data.get('price')
+    if price not in (None, ''):
+        if isinstance(price, bool) or not isinstance(price, (int, float, str)):
+            raise BulkError(f'Invalid price: {price!r}')
+        try:
+            values['price'] = Drug.parse_price(price)
+        except ValueError as e:
+            raise BulkError(str(e))
+    supplier = data.get('supplier')
+    if supplier is not None and not isinstance(supplier, str):
+        raise BulkError('Supplier must be a string')
+    supplier = (supplier or '').strip()
+    if supplier:
+        values['supplier'] = supplier
+    if not values:
+        raise BulkError('Enter a price or supplier to update')
+    return values
+
+
+def _execute(stmt):
+    # Objects already in the session are not refreshed; callers redirect or return counts
+    return db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount
+
+
+def delete_expired_drugs(today):
+    return _execute(delete(Drug).where(Drug.expiry_date < today))
+
+
+def delete_drugs(ids):
+    return _execute(delete(Drug).where(Drug.id.in_(ids)))
+
+
+def update_drugs(ids, values):
+    return _execute(update(Drug).where(Drug.id.in_(ids)).values(
+        version=Drug.version + 1, updated_at=datetime.utcnow(), **values
+    ))
+
+
+def delete_messages(user, ids=None, before=None):
+    """Delete the messages in ``ids`` or sent before ``before`` that ``user`` may delete."""
+    selection = []
+    if ids is not None:
+        selection.append(Message.id.in_(ids))
+    if before is not None:
+        selection.append(Message.timestamp < before)
+    if not selection:
+        raise BulkError('Nothing selected')
+    return _execute(delete(Message).where(Message.deletable_by(user), or_(*selection)))
@@ -0,0 +1,67 @@
+"""
+Response compression for HTML, JSON and other text responses.
+
+Responses at least COMPRESS_MIN_SIZE bytes long are encoded with brotli when
+the client accepts it and the ``brotli`` package is installed, and with gzip
+otherwise. Small bodies are sent as they are: below about a kilobyte the
+encoding overhead outweighs the saving. Streamed responses (exports, server-
+sent events) and file responses are left alone; static files are served
+precompressed instead.
+
+A compressed body is a different representation, so its ETag is made weak.
+If-None-Match uses weak comparison (see httpcache.py), so conditional GETs
+keep answering 304 whichever encoding the client received.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 5
+COMPRESSIBLE = ('text/html', 'text/plain', 'text/css', 'text/csv', 'application/json',
+                'application/javascript', 'application/x-ndjson', 'image/svg+xml')
+
+
+def choose_encoding(accept_encoding):
+    """The best encoding the client accepts: 'br', 'gzip' or None."""
+    if brotli is not None and accept_encoding['br']:
+        return 'br'
+    if accept_encoding['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config.get('BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY))
+    return gzip.compress(data, compresslevel=config.get('GZIP_LEVEL', DEFAULT_GZIP_LEVEL), mtime=0)
+
+
+def init_app(app):
+    """Compress eligible responses; register before other after_request hooks so this runs last."""
+    min_size = app.config.get('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE)
+
+    @app.after_request
+    def compress_response(response):
+        if (not min_size or response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None or (response.content_length or 0) < min_size:
+            return response
+
+        response.set_data(compress(response.get_data(), encoding, app.config))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
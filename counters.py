@@ -0,0 +1,76 @@
+"""
+Dashboard inventory counters.
+
+All three drug statistics come from one aggregate query with conditional
+counts. The result is kept per worker until a drug is added, edited or
+deleted, the calendar date rolls over (which changes what counts as
+expired), or DASHBOARD_STATS_TTL seconds pass. The TTL bounds how stale
+another worker's copy can get, since invalidation is only local.
+"""
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import case, func
+
+from models import db, Drug, LOW_STOCK_THRESHOLD, current_date
+
+DEFAULT_TTL = 60
+
+
+def compute_drug_stats(today):
+    """Total, expired and low-stock drug counts in a single round trip."""
+    total, expired, low_stock = db.session.query(
+        func.count(Drug.id),
+        func.sum(case((Drug.expiry_date < today, 1), else_=0)),
+        func.sum(case((Drug.quantity < LOW_STOCK_THRESHOLD, 1), else_=0))
+    ).one()
+    return {
+        'total_drugs': total,
+        'expired_drugs': int(expired or 0),
+        'low_stock': int(low_stock or 0),
+    }
+
+
+class DrugStatsCache:
+    """Per-worker cache of compute_drug_stats(), keyed on today's date."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = None
+        self._stats = None
+        self._stored_at = 0.0
+        self._generation = 0
+
+    def get(self, today=None):
+        today = today or current_date()
+        ttl = current_app.config.get('DASHBOARD_STATS_TTL', DEFAULT_TTL)
+        if not ttl:
+            return compute_drug_stats(today)
+
+        with self._lock:
+            fresh = (
+                self._stats is not None
+                and self._day == today
+                and time.monotonic() - self._stored_at < ttl
+            )
+            if fresh:
+                return dict(self._stats)
+            generation = self._generation
+
+        stats = compute_drug_stats(today)
+        with self._lock:
+            # Don't store a result that an invalidation overtook mid-query
+            if generation == self._generation:
+                self._day = today
+                self._stats = stats
+                self._stored_at = time.monotonic()
+        return dict(stats)
+
+    def invalidate(self):
+        with self._lock:
+            self._stats = None
+            self._generation += 1
+
+
+drug_stats = DrugStatsCache()
@@ -0,0 +1,172 @@
+"""
+Engine tuning and read-replica routing.
+
+Pool sizing, recycling, pre-ping and a per-statement timeout come from the
+DB_* settings (see default_config() in app.py) and are turned into
+SQLALCHEMY_ENGINE_OPTIONS by configure(). The timeout is enforced by the
+server on PostgreSQL (statement_timeout) and MySQL (max_execution_time,
+SELECTs only); on SQLite a progress handler interrupts a statement that has
+not produced its first row in time.
+
+When SQLALCHEMY_REPLICA_URI is set, views wrapped in @replica_reads send
+their queries to a second engine built with the same options. It is kept
+out of SQLALCHEMY_BINDS because it mirrors the primary's tables rather than
+holding models of its own. The first write in such a request
+(a flush, any INSERT/UPDATE/DELETE, or raw SQL that may be one) pins the
+rest of the request to the primary, and REPLICA_READ_AFTER_WRITE keeps the same browser session on the
+primary for a few seconds afterwards so a redirect after a POST shows the
+new data. Everything else, including CLI commands and background threads,
+always uses the primary.
+
+Raw SQL cannot be told apart from a write, so a text() statement or a bare
+session.connection() goes to the primary unless marked as a read: a text()
+with .execution_options(read_only=True), or connection(bind_arguments=
+{'read_only': True}).
+"""
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.elements import TextClause
+
+from metrics import TimedQueuePool
+
+PRIMARY_UNTIL = '_primary_until'
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 1800
+DEFAULT_STATEMENT_TIMEOUT = 30000
+DEFAULT_READ_AFTER_WRITE = 5
+
+# SQLite checks the deadline every this many virtual machine instructions
+SQLITE_PROGRESS_STEPS = 10000
+
+
+def engine_options(url, config):
+    """SQLAlchemy engine options for ``url`` from the DB_* settings."""
+    backend = make_url(url).get_backend_name()
+    options = {
+        # Records checkout waits for /metrics; in-memory SQLite still gets a StaticPool
+        'poolclass': TimedQueuePool,
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', DEFAULT_POOL_RECYCLE),
+    }
+    if backend != 'sqlite':
+        # SQLite's in-memory StaticPool rejects sizing arguments
+        options.update(
+            pool_size=config.get('DB_POOL_SIZE', DEFAULT_POOL_SIZE),
+            max_overflow=config.get('DB_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW),
+            pool_timeout=config.get('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT),
+        )
+
+    timeout = int(config.get('DB_STATEMENT_TIMEOUT', DEFAULT_STATEMENT_TIMEOUT))
+    if timeout and backend == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+    elif timeout and backend == 'mysql':
+        options['connect_args'] = {'init_command': f'SET SESSION max_execution_time={timeout}'}
+    return options
+
+
+def configure(app):
+    """Fill in SQLALCHEMY_ENGINE_OPTIONS; explicit entries in the config win."""
+    options = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def init_app(app, db):
+    """Create the replica engine, if any, and install statement timeouts on every engine."""
+    url = app.config.get('SQLALCHEMY_REPLICA_URI')
+    if url:
+        app.extensions['replica_engine'] = create_engine(url, **app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    with app.app_context():
+        for engine in all_engines(db):
+            install_sqlite_timeout(engine, app.config.get('DB_STATEMENT_TIMEOUT', DEFAULT_STATEMENT_TIMEOUT))
+
+
+def replica_engine():
+    """The current app's replica engine, or None."""
+    return current_app.extensions.get('replica_engine')
+
+
+def all_engines(db):
+    """Every engine of the current app, replica included."""
+    engines = list(db.engines.values())
+    if replica_engine() is not None:
+        engines.append(replica_engine())
+    return engines
+
+
+def install_sqlite_timeout(engine, timeout_ms):
+    """Interrupt SQLite statements that run longer than ``timeout_ms`` before their first row."""
+    if not timeout_ms or engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_progress_handler(dbapi_connection, connection_record):
+        deadline = connection_record.info['statement_deadline'] = [None]
+
+        def check():
+            # A non-zero return aborts the statement with "interrupted"
+            return deadline[0] is not None and time.monotonic() > deadline[0]
+
+        dbapi_connection.set_progress_handler(check, SQLITE_PROGRESS_STEPS)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_clock(conn, cursor, statement, parameters, context, executemany):
+        deadline = conn.info.get('statement_deadline')
+        if deadline is not None:
+            deadline[0] = time.monotonic() + timeout_ms / 1000
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_clock(conn, cursor, statement, parameters, context, executemany):
+        deadline = conn.info.get('statement_deadline')
+        if deadline is not None:
+            # Rows streamed later (e.g. exports) are not on the clock
+            deadline[0] = None
+
+
+def pin_primary():
+    """Send the rest of this request, and this browser briefly, to the primary."""
+    g.primary_pinned = True
+    if has_request_context():
+        window = current_app.config.get('REPLICA_READ_AFTER_WRITE', DEFAULT_READ_AFTER_WRITE)
+        if window:
+            session[PRIMARY_UNTIL] = time.time() + window
+
+
+def replica_reads(view):
+    """Let ``view`` read from the replica until it writes."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.replica_reads = session.get(PRIMARY_UNTIL, 0) < time.time()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends read-only requests to the replica.
+
+    Any write, in any request, pins the caller to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, read_only=False, raw=False, **kwargs):
+        replica = replica_engine() if bind is None else None
+        if replica is not None:
+            if isinstance(clause, TextClause):
+                raw = not clause.get_execution_options().get('read_only', False)
+            if self._flushing or getattr(clause, 'is_dml', False) or (raw and not read_only):
+                pin_primary()
+            elif g.get('replica_reads') and not g.get('primary_pinned'):
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def connection(self, bind_arguments=None, execution_options=None):
+        # Whatever the caller runs on it may write
+        bind_arguments = dict(bind_arguments or {}, raw=True)
+        return super().connection(bind_arguments=bind_arguments, execution_options=execution_options)
@@ -0,0 +1,225 @@
+"""
+Push notifications for new messages.
+
+Each worker runs one MessageHub. A single listener thread per worker learns
+about new messages from the database and hands each one to the hub once; the
+hub copies it into a small queue per connected client. Because the listener
+watches the database rather than the local process, a message posted through
+any worker reaches clients connected to every worker.
+
+Listeners:
+  * NotifyListener  - PostgreSQL LISTEN/NOTIFY; add_message calls notify()
+                      inside its transaction, so the event fires on commit.
+  * PollingListener - any other database; one indexed "id > last seen" query
+                      every MESSAGE_POLL_INTERVAL seconds per worker.
+
+Clients only cost a queue each, not a database connection, but under
+gunicorn's gthread workers each open stream still occupies a worker thread:
+a handful of open tabs would take every thread. Pages therefore only open the
+stream when MESSAGE_EVENTS is 'stream', which gunicorn.conf.py sets when it
+runs an async worker class (GUNICORN_WORKER_CLASS=gevent), where each stream
+is a greenlet. Otherwise they poll /events/messages/poll, which reads
+messages_after() and answers 304 while the message table is unchanged.
+"""
+import json
+import logging
+import os
+import queue
+import select
+import threading
+
+from sqlalchemy import text
+
+from models import db, Message, User
+
+CHANNEL = 'new_message'
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_QUEUE_SIZE = 100
+
+log = logging.getLogger(__name__)
+
+
+def message_event(message_id, title, is_urgent, timestamp, sender, sender_role):
+    return {
+        'id': message_id,
+        'title': title,
+        'is_urgent': bool(is_urgent),
+        'timestamp': timestamp.strftime('%Y-%m-%d %H:%M') if timestamp else None,
+        'sender': sender,
+        'sender_role': sender_role,
+    }
+
+
+def messages_after(last_id, limit=100):
+    """Events for messages with id > last_id, oldest first (uses the primary key)."""
+    rows = db.session.query(
+        Message.id, Message.title, Message.is_urgent, Message.timestamp,
+        User.username, User.role
+    ).join(User, Message.sender_id == User.id) \
+        .filter(Message.id > last_id).order_by(Message.id).limit(limit).all()
+    return [message_event(*row) for row in rows]
+
+
+class Subscriber:
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A client this far behind reconnects and replays via Last-Event-ID
+            self.overflowed = True
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+class MessageHub:
+    """Fan-out of message events to every subscriber in this worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._listener = None
+        self._pid = None
+
+    def subscribe(self, app):
+        self._ensure_listener(app)
+        subscriber = Subscriber(app.config.get('SSE_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _ensure_listener(self, app):
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                return
+            backend = app.config.get('MESSAGE_EVENTS_BACKEND', 'auto')
+            if backend == 'auto':
+                with app.app_context():
+                    backend = 'notify' if db.engine.dialect.name == 'postgresql' else 'poll'
+            listener_class = NotifyListener if backend == 'notify' else PollingListener
+            self._listener = listener_class(app, self)
+            self._pid = os.getpid()
+            self._listener.start()
+
+    def stop(self):
+        with self._lock:
+            listener, self._listener = self._listener, None
+            self._subscribers.clear()
+        if listener is not None:
+            listener.stop()
+
+
+class _Listener(threading.Thread):
+    def __init__(self, app, hub):
+        super().__init__(name=self.__class__.__name__, daemon=True)
+        self.app = app
+        self.hub = hub
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+        self.join(timeout=5)
+
+
+class PollingListener(_Listener):
+    """Polls for new message ids; one query per interval regardless of client count."""
+
+    def run(self):
+        interval = self.app.config.get('MESSAGE_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+        with self.app.app_context():
+            last_id = db.session.query(db.func.max(Message.id)).scalar() or 0
+            db.session.remove()
+        while not self._stopped.wait(interval):
+            try:
+                with self.app.app_context():
+                    new_events = messages_after(last_id)
+                    db.session.remove()
+            except Exception:
+                log.exception('Polling for new messages failed')
+                continue
+            for event in new_events:
+                self.hub.publish(event)
+                last_id = event['id']
+
+
+class NotifyListener(_Listener):
+    """Blocks on a dedicated PostgreSQL connection with LISTEN new_message."""
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception:
+                log.exception('LISTEN connection lost; reconnecting')
+                self._stopped.wait(1)
+
+    def _listen(self):
+        with self.app.app_context():
+            raw = db.engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            while not self._stopped.is_set():
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self.hub.publish(json.loads(conn.notifies.pop(0).payload))
+        finally:
+            raw.invalidate()
+
+
+def notify(event):
+    """Announce a new message to every worker; call before the message is committed."""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                           {'channel': CHANNEL, 'payload': json.dumps(event)})
+
+
+def sse_format(event):
+    kind = 'urgent' if event['is_urgent'] else 'message'
+    return f"id: {event['id']}\nevent: {kind}\ndata: {json.dumps(event)}\n\n"
+
+
+def stream(subscriber, hub, backlog, heartbeat):
+    """SSE generator: replayed backlog, then live events, with comment heartbeats."""
+    try:
+        yield 'retry: 5000\n\n'
+        for event in backlog:
+            yield sse_format(event)
+        last_sent = backlog[-1]['id'] if backlog else 0
+        while not subscriber.overflowed:
+            try:
+                event = subscriber.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            if event['id'] > last_sent:
+                last_sent = event['id']
+                yield sse_format(event)
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+hub = MessageHub()
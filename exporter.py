@@ -0,0 +1,69 @@
+"""
+Streaming CSV / NDJSON export.
+
+Queries select plain column tuples and are executed with yield_per, which
+uses a server-side cursor on PostgreSQL, so only one chunk of rows is held in
+memory at a time. Rows are encoded as they arrive and handed to the response
+in chunks.
+"""
+import csv
+import json
+from datetime import date, datetime
+
+from models import db, Drug, Message, User
+
+FORMATS = ('csv', 'ndjson')
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+CHUNK_ROWS = 1000
+
+DRUG_COLUMNS = (Drug.id, Drug.name, Drug.description, Drug.quantity, Drug.price,
+                Drug.expiry_date, Drug.batch_number, Drug.supplier, Drug.updated_at)
+MESSAGE_COLUMNS = (Message.id, Message.title, Message.content, Message.timestamp,
+                   Message.is_urgent, User.username.label('sender'), User.role.label('sender_role'))
+
+
+class _Echo:
+    """File-like object whose write() just returns what csv.writer hands it."""
+
+    def write(self, value):
+        return value
+
+
+def _json_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def drug_export_query(status_expression=None):
+    columns = DRUG_COLUMNS
+    if status_expression is not None:
+        columns = columns + (status_expression.label('status'),)
+    return db.session.query(*columns)
+
+
+def message_export_query():
+    return db.session.query(*MESSAGE_COLUMNS).join(User, Message.sender_id == User.id)
+
+
+def stream_rows(query, fmt, chunk_rows=CHUNK_ROWS):
+    """Yield the encoded export of ``query`` in chunks of ``chunk_rows`` rows."""
+    rows = query.execution_options(yield_per=chunk_rows)
+    header = [c['name'] for c in query.column_descriptions]
+
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        encode = writer.writerow
+        yield encode(header)
+    else:
+        def encode(row):
+            return json.dumps(dict(zip(header, map(_json_value, row))), separators=(',', ':')) + '\n'
+
+    chunk = []
+    for row in rows:
+        chunk.append(encode(row))
+        if len(chunk) >= chunk_rows:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for the inventory app.
+
+The app is built once in the master (preload_app) so workers fork with the
+code already imported and start serving straight away. Nothing connects to
+the database while the app is built, but post_fork still drops any pooled
+connections a worker might have inherited so no socket is shared.
+"""
+import os
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Threaded workers keep serving other requests while a login waits on the
+# password hashing pool
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+# An open message stream holds a gthread thread for as long as the page is
+# open, so pages only stream under an async worker class, where it is a
+# greenlet; gthread deployments poll instead (see events.py). The app is
+# preloaded after this file runs, so it sees the setting.
+if worker_class in ('gevent', 'eventlet'):
+    os.environ.setdefault('MESSAGE_EVENTS', 'stream')
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+preload_app = True
+
+
+def post_fork(server, worker):
+    from app import dispose_engines
+    dispose_engines(server.app.wsgi())
@@ -0,0 +1,263 @@
+"""
+Conditional GET and rendered-fragment caching for the HTML pages.
+
+Every write to the user, drug or message table advances a per-table version
+from a database trigger, so bulk imports and writes made by other workers
+are seen too.
+
+  * SQLite runs one writer at a time, so its triggers simply bump a counter
+    row in table_versions.
+  * On PostgreSQL a shared counter row would serialize every writer of a
+    table until commit, and transactions touching several tables could lock
+    those rows in different orders and deadlock. Its statement-level
+    triggers instead append a row to table_changes, and appends never wait
+    on each other. A table's version is its base counter in table_versions
+    plus the number of its rows in table_changes. Changes only become
+    visible at commit and are never removed except by compact(), so the
+    version grows with every commit in commit order, whichever transaction
+    started first. compact() folds the log into the base counters in one
+    transaction, which readers see either entirely or not at all.
+    ``run-scheduler`` runs it every minute, and a request that finds more
+    than TABLE_CHANGES_COMPACT_THRESHOLD rows in the log runs it too, so the
+    log stays short in deployments without the scheduler.
+
+Reading every version is one small query either way.
+
+@conditional_get(*tables) derives an ETag from those counters, the current
+user, the query string and today's date, and answers a matching
+If-None-Match with 304 before the view runs. FragmentCache keeps rendered
+HTML per worker under keys that include the same counters, so any write
+makes the old entries unreachable and they age out of the LRU.
+
+Databases without the triggers (install() only supports SQLite and
+PostgreSQL) simply skip both caches.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+from sqlalchemy.exc import DBAPIError
+
+from models import db, current_date
+
+TRACKED_TABLES = ('user', 'drug', 'message')
+DEFAULT_FRAGMENT_CACHE_SIZE = 256
+
+
+def _sqlite_setup():
+    statements = [
+        "CREATE TABLE IF NOT EXISTS table_versions ("
+        "name VARCHAR(50) PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0, "
+        "changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)",
+    ]
+    for table in TRACKED_TABLES:
+        statements.append(f"INSERT OR IGNORE INTO table_versions (name) VALUES ('{table}')")
+        for op in ('INSERT', 'UPDATE', 'DELETE'):
+            statements.append(
+                f'CREATE TRIGGER IF NOT EXISTS {table}_version_{op.lower()} AFTER {op} ON "{table}" '
+                f"BEGIN UPDATE table_versions SET version = version + 1, "
+                f"changed_at = CURRENT_TIMESTAMP WHERE name = '{table}'; END"
+            )
+    return statements
+
+
+def _postgres_setup():
+    statements = [
+        "CREATE TABLE IF NOT EXISTS table_versions ("
+        "name VARCHAR(50) PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0, "
+        "changed_at TIMESTAMP NOT NULL DEFAULT now())",
+        "CREATE TABLE IF NOT EXISTS table_changes ("
+        "id BIGSERIAL PRIMARY KEY, name VARCHAR(50) NOT NULL, "
+        "changed_at TIMESTAMP NOT NULL DEFAULT now())",
+        "CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$ "
+        "BEGIN INSERT INTO table_changes (name) VALUES (TG_TABLE_NAME); RETURN NULL; END $$ "
+        "LANGUAGE plpgsql",
+    ]
+    for table in TRACKED_TABLES:
+        statements += [
+            f"INSERT INTO table_versions (name) VALUES ('{table}') ON CONFLICT DO NOTHING",
+            f'DROP TRIGGER IF EXISTS {table}_version ON "{table}"',
+            # Statement-level, so a bulk import bumps the counter once
+            f'CREATE TRIGGER {table}_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE '
+            f'ON "{table}" FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()',
+        ]
+    return statements
+
+
+# Base counter plus the changes not yet compacted, read in one snapshot
+POSTGRES_VERSIONS = (
+    "SELECT v.name, v.version + coalesce(c.changes, 0), greatest(v.changed_at, c.changed_at), "
+    "coalesce(c.changes, 0) "
+    "FROM table_versions v LEFT JOIN ("
+    "SELECT name, count(*) AS changes, max(changed_at) AS changed_at FROM table_changes GROUP BY name"
+    ") c ON c.name = v.name"
+)
+
+# Only rows committed before it started are deleted and counted; later ones stay for next time
+POSTGRES_COMPACT = (
+    "WITH moved AS (DELETE FROM table_changes RETURNING name, changed_at), "
+    "totals AS (SELECT name, count(*) AS changes, max(changed_at) AS changed_at "
+    "FROM moved GROUP BY name) "
+    "UPDATE table_versions v SET version = v.version + t.changes, "
+    "changed_at = greatest(v.changed_at, t.changed_at) FROM totals t WHERE v.name = t.name"
+)
+
+# Any constant shared by every worker; compactions are serialized on it
+COMPACT_LOCK_KEY = 0x7461626c
+
+DEFAULT_COMPACT_INTERVAL = 60
+DEFAULT_COMPACT_THRESHOLD = 1000
+
+
+def install(conn):
+    """Create table_versions and its triggers where supported."""
+    if conn.dialect.name == 'postgresql':
+        statements = _postgres_setup()
+    elif conn.dialect.name == 'sqlite':
+        statements = _sqlite_setup()
+    else:
+        return
+    for statement in statements:
+        conn.exec_driver_sql(statement)
+
+
+def table_versions():
+    """{table: (version, changed_at)} for this request, or None if untracked."""
+    if 'table_versions' not in g:
+        try:
+            if db.session.get_bind().dialect.name == 'postgresql':
+                query = POSTGRES_VERSIONS
+            else:
+                query = 'SELECT name, version, changed_at, 0 FROM table_versions'
+            rows = db.session.execute(db.text(query).execution_options(read_only=True)).all()
+            g.table_versions = {name: (version, changed_at) for name, version, changed_at, _ in rows}
+        except DBAPIError:
+            # Not installed on this database; nothing else has run yet in this request
+            db.session.rollback()
+            g.table_versions = None
+        else:
+            threshold = current_app.config.get('TABLE_CHANGES_COMPACT_THRESHOLD', DEFAULT_COMPACT_THRESHOLD)
+            if threshold and sum(row[3] for row in rows) > threshold:
+                compact()
+    return g.table_versions
+
+
+def compact():
+    """
+    Fold PostgreSQL's table_changes log into table_versions; returns the tables updated.
+
+    Runs in a transaction of its own on the primary, so it can be called in
+    the middle of a request. If another process is already compacting, it
+    returns 0 at once rather than waiting.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return 0
+    with db.engine.begin() as conn:
+        if not conn.execute(db.text('SELECT pg_try_advisory_xact_lock(:key)'),
+                            {'key': COMPACT_LOCK_KEY}).scalar():
+            return 0
+        return conn.execute(db.text(POSTGRES_COMPACT)).rowcount
+
+
+def stamp(tables):
+    """Version tuple for ``tables`` plus the latest change time, or (None, None)."""
+    versions = table_versions()
+    if not versions or any(t not in versions for t in tables):
+        return None, None
+    changed = [versions[t][1] for t in tables]
+    if changed and isinstance(changed[0], str):
+        changed = [datetime.fromisoformat(c) for c in changed]
+    return tuple(versions[t][0] for t in tables), max(changed)
+
+
+def _user_key():
+    if current_user.is_authenticated:
+        return f'{current_user.id}:{current_user.username}:{current_user.role}'
+    return 'anonymous'
+
+
+def conditional_get(*tables, key=None):
+    """
+    Answer If-None-Match with 304 while ``tables`` and the viewer are unchanged.
+
+    ``key`` is an optional callable returning a string for any other state
+    the page depends on.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pending flash messages are part of the page; never 304 over them
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+            versions, changed_at = stamp(tables)
+            if versions is None:
+                return view(*args, **kwargs)
+
+            etag = hashlib.sha1('|'.join([
+                request.endpoint, repr(versions), _user_key(),
+                request.query_string.decode('latin-1'), current_date().isoformat(),
+                key() if key else ''
+            ]).encode()).hexdigest()
+
+            # Weak comparison, as RFC 9110 specifies: compress.py weakens the tag of encoded bodies
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = changed_at
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+class FragmentCache:
+    """Per-worker LRU of rendered HTML fragments."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        """Return the cached fragment for ``key`` (None disables caching) or render and store it."""
+        if key is None:
+            return render()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        fragment = render()
+        size = current_app.config.get('FRAGMENT_CACHE_SIZE', DEFAULT_FRAGMENT_CACHE_SIZE)
+        if size:
+            with self._lock:
+                self._entries[key] = fragment
+                while len(self._entries) > size:
+                    self._entries.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fragments = FragmentCache()
+
+
+def fragment_key(name, tables, *parts):
+    """Cache key for a fragment depending on ``tables``, or None when untracked."""
+    versions, _ = stamp(tables)
+    if versions is None:
+        return None
+    return (name, versions, current_date()) + parts
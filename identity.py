@@ -0,0 +1,107 @@
+"""
+Per-worker cache of authenticated user identities.
+
+Flask-Login calls load_user on every authenticated request. Instead of
+loading the full User row each time, the id, username and role are kept in a
+bounded LRU cache with a TTL. Entries are dropped once this worker commits
+an update or delete of the user; dropping them at flush would let a request
+reload the uncommitted, old row and cache it again. A load that overlaps an
+invalidation is not cached either. USER_CACHE_TTL bounds how long another
+worker can keep serving a stale username or role.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import db, User
+
+DEFAULT_SIZE = 1024
+DEFAULT_TTL = 60
+
+
+class CachedUser(UserMixin):
+    """Read-only stand-in for User carrying just what current_user needs."""
+
+    def __init__(self, id, username, role):
+        self.id = id
+        self.username = username
+        self.role = role
+
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+
+class UserIdentityCache:
+    """Thread-safe LRU of user id -> (CachedUser, stored_at)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Bumped by every invalidation, so a load that overlapped one is not stored
+        self._generation = 0
+
+    def get(self, user_id):
+        size = current_app.config.get('USER_CACHE_SIZE', DEFAULT_SIZE)
+        ttl = current_app.config.get('USER_CACHE_TTL', DEFAULT_TTL)
+        if not size or not ttl:
+            return self._load(user_id)
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now - entry[1] < ttl:
+                self._entries.move_to_end(user_id)
+                return entry[0]
+            generation = self._generation
+
+        user = self._load(user_id)
+        if user is not None:
+            with self._lock:
+                if generation != self._generation:
+                    return user
+                self._entries[user_id] = (user, now)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > size:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def _load(self, user_id):
+        row = db.session.query(User.id, User.username, User.role) \
+            .filter(User.id == user_id).first()
+        return CachedUser(*row) if row else None
+
+
+user_identities = UserIdentityCache()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    # Evicted in _evict_committed once the change is visible to other requests
+    object_session(target).info.setdefault('changed_user_ids', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_committed(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        user_identities.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('changed_user_ids', None)
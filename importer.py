@@ -0,0 +1,154 @@
+"""
+Bulk drug import from CSV or NDJSON.
+
+The file is read one row at a time and each row is validated with
+Drug.parse_fields, the same rules add_drug applies. Valid rows are inserted in
+batches: COPY on PostgreSQL, a single executemany INSERT elsewhere. Each batch
+is committed on its own, so a bad row (or a batch the database rejects) is
+reported without undoing the rest of the load.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from models import db, Drug
+
+DEFAULT_BATCH_SIZE = 1000
+FORMATS = ('csv', 'ndjson')
+
+COPY_COLUMNS = ('name', 'description', 'quantity', 'price', 'expiry_date',
+                'batch_number', 'supplier', 'added_by_id', 'created_at', 'updated_at')
+
+
+class ImportReport:
+    """Outcome of an import: rows inserted plus (line, error) for each rejected row."""
+
+    def __init__(self):
+        self.inserted = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self):
+        return {'inserted': self.inserted, 'failed': len(self.errors), 'errors': self.errors}
+
+
+def detect_format(filename, default='csv'):
+    name = (filename or '').lower()
+    if name.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def iter_csv_rows(stream):
+    """Yield (line_number, row_dict) from a binary CSV stream with a header row."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def iter_ndjson_rows(stream):
+    """Yield (line_number, row_dict) from a binary newline-delimited JSON stream."""
+    for line_number, raw in enumerate(stream, start=1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            row = json.loads(raw)
+        except ValueError as e:
+            yield line_number, e
+            continue
+        if not isinstance(row, dict):
+            yield line_number, ValueError('Expected a JSON object')
+            continue
+        # JSON numbers arrive as int/float; parse_fields expects form-like values
+        yield line_number, {k: (str(v) if isinstance(v, (int, float)) else v) for k, v in row.items()}
+
+
+def iter_rows(stream, fmt):
+    if fmt == 'ndjson':
+        return iter_ndjson_rows(stream)
+    return iter_csv_rows(stream)
+
+
+def _copy_batch(rows):
+    """Stream a batch into PostgreSQL with COPY ... FROM STDIN."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[c] is None else row[c] for c in COPY_COLUMNS])
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    try:
+        # Unquoted empty fields load as NULL in CSV mode
+        cursor.copy_expert(
+            f"COPY drug ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def _insert_batch(rows):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        _copy_batch(rows)
+    else:
+        db.session.execute(insert(Drug.__table__), rows)
+
+
+def _flush(batch, report):
+    """Insert and commit one batch; on failure retry row by row to pinpoint errors."""
+    if not batch:
+        return
+    rows = [row for _, row in batch]
+    try:
+        _insert_batch(rows)
+        db.session.commit()
+        report.inserted += len(rows)
+        return
+    except Exception:
+        db.session.rollback()
+
+    for line, row in batch:
+        try:
+            db.session.execute(insert(Drug.__table__), [row])
+            db.session.commit()
+            report.inserted += 1
+        except Exception as e:
+            db.session.rollback()
+            report.add_error(line, str(getattr(e, 'orig', e)))
+
+
+def import_drugs(stream, fmt, added_by_id, batch_size=DEFAULT_BATCH_SIZE):
+    """Import drugs from a binary stream in ``fmt`` ('csv' or 'ndjson')."""
+    report = ImportReport()
+    batch = []
+    now = datetime.utcnow()
+
+    for line, row in iter_rows(stream, fmt):
+        if isinstance(row, Exception):
+            report.add_error(line, f'Invalid JSON: {row}')
+            continue
+        try:
+            fields = Drug.parse_fields(row)
+        except ValueError as e:
+            report.add_error(line, str(e))
+            continue
+        fields.update(added_by_id=added_by_id, created_at=now, updated_at=now)
+        batch.append((line, fields))
+
+        if len(batch) >= batch_size:
+            _flush(batch, report)
+            batch = []
+
+    _flush(batch, report)
+    report.errors.sort(key=lambda e: e['line'])
+    return report
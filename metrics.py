@@ -0,0 +1,231 @@
+"""
+Per-request instrumentation and the Prometheus /metrics endpoint.
+
+Recorded per worker process:
+  * http_request_duration_seconds{endpoint,method}     latency histogram
+  * http_requests_total{endpoint,method,status}
+  * db_statements_per_request{endpoint}                SQL statements per request
+  * db_seconds_per_request{endpoint}                   SQL time per request
+  * template_render_seconds{template}
+  * db_pool_checkout_wait_seconds                      time spent waiting for a pooled connection
+
+SQL timing comes from before/after_cursor_execute engine events, and
+statements slower than SLOW_QUERY_THRESHOLD seconds are logged to the
+"slow_query" logger with the endpoint that ran them. Pool waits come from
+TimedQueuePool, which database.engine_options() installs as the pool class.
+
+The metric types are a small in-house subset of the Prometheus client: each
+observation is a bisect and a few additions under a lock. Counters live in
+the worker that served the request, so with several gunicorn workers each
+scrape sees one worker; aggregate with rate()/sum() or scrape a single-worker
+deployment. Requests are recorded at teardown, so ones that end in an
+unhandled exception are counted as 500s too.
+
+/metrics names every route and times the database, so outside debug and
+testing it is only served with METRICS_TOKEN set, and answers 404 without it.
+"""
+import bisect
+import logging
+import threading
+import time
+
+from flask import (Response, abort, before_render_template, current_app, g, has_request_context,
+                   request, template_rendered)
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+DEFAULT_SLOW_QUERY_THRESHOLD = 0.5
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+slow_query_log = logging.getLogger('slow_query')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._series = {}
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def sum(self, *labels):
+        series = self._series.get(labels)
+        return series[1] if series else 0.0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = _labels(self.labelnames + ('le',), labels + (bound,))
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            suffix = _labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{suffix} {total}')
+            lines.append(f'{self.name}_count{suffix} {count}')
+        return lines
+
+
+request_latency = Histogram('http_request_duration_seconds', 'Request latency.', ('endpoint', 'method'))
+requests_total = Counter('http_requests_total', 'Requests served.', ('endpoint', 'method', 'status'))
+statements_per_request = Histogram('db_statements_per_request', 'SQL statements per request.',
+                                   ('endpoint',), COUNT_BUCKETS)
+sql_seconds_per_request = Histogram('db_seconds_per_request', 'Time spent in SQL per request.', ('endpoint',))
+template_seconds = Histogram('template_render_seconds', 'Template render time.', ('template',))
+pool_wait = Histogram('db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.')
+slow_queries = Counter('db_slow_queries_total', 'Statements slower than SLOW_QUERY_THRESHOLD.', ('endpoint',))
+
+REGISTRY = [request_latency, requests_total, statements_per_request, sql_seconds_per_request,
+            template_seconds, pool_wait, slow_queries]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait.observe(time.perf_counter() - started)
+
+
+def _endpoint():
+    return (request.endpoint or 'unmatched') if has_request_context() else 'background'
+
+
+def install_engine_events(engine, app):
+    """Count and time statements on ``engine``; log the slow ones."""
+    threshold = app.config.get('SLOW_QUERY_THRESHOLD', DEFAULT_SLOW_QUERY_THRESHOLD)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_started'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop('query_started')
+        if has_request_context() and 'sql_statements' in g:
+            g.sql_statements += 1
+            g.sql_seconds += elapsed
+        if threshold and elapsed >= threshold:
+            slow_queries.inc(_endpoint())
+            slow_query_log.warning('%.1f ms in %s: %s', elapsed * 1000, _endpoint(),
+                                   ' '.join(statement.split())[:1000])
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+
+
+def _finish_request(response):
+    g.response_status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    # Runs even when the view raised, which skips after_request handlers
+    started = g.pop('request_started', None)
+    if started is None or request.endpoint == 'metrics':
+        return
+    endpoint = request.endpoint or 'unmatched'
+    status = 500 if exc is not None else g.pop('response_status', 500)
+    request_latency.observe(time.perf_counter() - started, endpoint, request.method)
+    requests_total.inc(endpoint, request.method, status)
+    statements_per_request.observe(g.pop('sql_statements', 0), endpoint)
+    sql_seconds_per_request.observe(g.pop('sql_seconds', 0.0), endpoint)
+
+
+def _template_started(sender, template, context, **extra):
+    g.setdefault('template_started', []).append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    stack = g.get('template_started')
+    if stack:
+        template_seconds.observe(time.perf_counter() - stack.pop(), template.name or 'string')
+
+
+def metrics_view():
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        if not (current_app.debug or current_app.testing):
+            abort(404)
+    elif request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(render(), content_type=CONTENT_TYPE)
+
+
+def init_app(app, engines):
+    """Hook request timing, SQL events and template signals into ``app``; add /metrics."""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    for engine in engines:
+        install_engine_events(engine, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,186 @@
+"""
+Versioned schema migrations.
+
+Each migration is a function registered with @migration(version, description)
+and is applied at most once, in version order, inside its own transaction.
+Applied versions are recorded in the schema_migrations table. Migrations use
+checkfirst-style DDL so they are safe to run against databases that were
+originally built with db.create_all().
+
+Run pending migrations with:
+
+    flask --app app migrate-db
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, Index, Integer, MetaData, String,
+                        Table, inspect)
+
+from models import db
+import httpcache
+import search
+
+Migration = namedtuple('Migration', 'version description upgrade')
+
+MIGRATIONS = []
+
+# Kept out of db.metadata so create_all() never touches it
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def migration(version, description):
+    """Register ``fn(connection)`` as schema migration ``version``."""
+    def register(fn):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f'Duplicate migration version {version}')
+        MIGRATIONS.append(Migration(version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+    return register
+
+
+def create_index(conn, name, table, *columns, unique=False):
+    """
+    CREATE INDEX unless an index with this name already exists.
+
+    Builds the index against a throwaway Table so the migration does not
+    depend on how the model is declared today.
+    """
+    stub = Table(table, MetaData(), *[Column(c) for c in columns])
+    Index(name, *[stub.c[c] for c in columns], unique=unique).create(conn, checkfirst=True)
+
+
+def add_column(conn, table, name, ddl):
+    """ALTER TABLE ... ADD COLUMN unless ``table`` already has ``name``."""
+    if name not in {c['name'] for c in inspect(conn).get_columns(table)}:
+        quoted = conn.dialect.identifier_preparer.quote(table)
+        conn.exec_driver_sql(f'ALTER TABLE {quoted} ADD COLUMN {name} {ddl}')
+
+
+def applied_versions(conn):
+    schema_migrations.create(conn, checkfirst=True)
+    return {row.version for row in conn.execute(schema_migrations.select())}
+
+
+def pending_migrations(engine):
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    return [m for m in MIGRATIONS if m.version not in done]
+
+
+def upgrade(engine, log=print):
+    """Apply every pending migration; returns the list that was applied."""
+    applied = []
+    for m in pending_migrations(engine):
+        with engine.begin() as conn:
+            m.upgrade(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=m.version,
+                description=m.description,
+                applied_at=datetime.utcnow()
+            ))
+        log(f'Applied migration {m.version}: {m.description}')
+        applied.append(m)
+    return applied
+
+
+# Migrations
+
+@migration(1, 'Initial schema: user, drug and message tables')
+def initial_schema(conn):
+    existing = set(inspect(conn).get_table_names())
+    for name in ('user', 'drug', 'message'):
+        if name not in existing:
+            db.metadata.tables[name].create(conn)
+
+
+@migration(2, 'Indexes for drug listing, status filters and message timeline')
+def hot_path_indexes(conn):
+    create_index(conn, 'ix_drug_name_id', 'drug', 'name', 'id')
+    create_index(conn, 'ix_drug_expiry_date_quantity', 'drug', 'expiry_date', 'quantity')
+    create_index(conn, 'ix_drug_quantity', 'drug', 'quantity')
+    create_index(conn, 'ix_drug_batch_number', 'drug', 'batch_number')
+    create_index(conn, 'ix_drug_supplier_name_id', 'drug', 'supplier', 'name', 'id')
+    create_index(conn, 'ix_message_timestamp_id', 'message', 'timestamp', 'id')
+    create_index(conn, 'ix_message_sender_id', 'message', 'sender_id')
+
+
+@migration(3, 'Widen user.password_hash to 255 characters for scrypt hashes')
+def widen_password_hash(conn):
+    # SQLite does not enforce VARCHAR lengths
+    if conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql('ALTER TABLE "user" ALTER COLUMN password_hash TYPE VARCHAR(255)')
+    elif conn.dialect.name == 'mysql':
+        conn.exec_driver_sql('ALTER TABLE user MODIFY password_hash VARCHAR(255)')
+
+
+@migration(4, 'Full-text search index over drug name, description, supplier and batch')
+def drug_search_index(conn):
+    search.install(conn)
+
+
+@migration(5, 'Per-table change counters for conditional GET')
+def table_version_counters(conn):
+    httpcache.install(conn)
+
+
+@migration(6, 'Drug version column, stock movement ledger and stock snapshots')
+def stock_ledger(conn):
+    add_column(conn, 'drug', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    existing = set(inspect(conn).get_table_names())
+    for name in ('stock_movement', 'stock_snapshot'):
+        if name not in existing:
+            db.metadata.tables[name].create(conn)
+    create_index(conn, 'ix_stock_movement_drug_id_created_at_id', 'stock_movement',
+                 'drug_id', 'created_at', 'id')
+    create_index(conn, 'ix_stock_snapshot_drug_id_taken_at_id', 'stock_snapshot',
+                 'drug_id', 'taken_at', 'id')
+
+
+@migration(7, 'Index for first-expiry-first-out batch allocation by drug name')
+def fefo_index(conn):
+    create_index(conn, 'ix_drug_name_expiry_date_id', 'drug', 'name', 'expiry_date', 'id')
+
+
+@migration(8, 'API tokens')
+def api_tokens(conn):
+    if 'api_token' not in inspect(conn).get_table_names():
+        db.metadata.tables['api_token'].create(conn)
+
+
+@migration(9, 'Archive table for messages past the retention period')
+def message_archive(conn):
+    if 'archived_message' not in inspect(conn).get_table_names():
+        db.metadata.tables['archived_message'].create(conn)
+
+
+@migration(10, 'Per-user high-water mark of seen messages')
+def message_read_marks(conn):
+    if 'message_read_mark' not in inspect(conn).get_table_names():
+        db.metadata.tables['message_read_mark'].create(conn)
+
+
+@migration(11, 'Alert scanner state, open drug alerts, job leases and the drug change index')
+def stock_alert_scheduler(conn):
+    existing = set(inspect(conn).get_table_names())
+    for table in ('drug_alert', 'alert_scan_state', 'job_lease'):
+        if table not in existing:
+            db.metadata.tables[table].create(conn)
+    create_index(conn, 'ix_drug_updated_at_id', 'drug', 'updated_at', 'id')
+
+
+@migration(12, 'Stored search vector on PostgreSQL; re-index SQLite search only on searched columns')
+def search_document_column(conn):
+    search.upgrade(conn)
+
+
+@migration(13, 'Append-only table change log instead of locked counter rows on PostgreSQL')
+def table_change_log(conn):
+    httpcache.install(conn)
@@ -1,16 +1,26 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import hash_password, verify_password, needs_rehash
+from database import RoutingSession
+from sqlalchemy import case, true
+import math
 import re
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Drugs with fewer units than this are flagged as low stock
+LOW_STOCK_THRESHOLD = 10
+
+def current_date():
+    """Today in server local time: the one calendar every expiry and stock status is judged by."""
+    return datetime.now().date()
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(255))
     role = db.Column(db.String(20), nullable=False)  # doctor, nurse, pharmacist
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -19,10 +29,17 @@ class User(UserMixin, db.Model):
     drugs_added = db.relationship('Drug', backref='added_by', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+    
+    def rehash_password_if_needed(self, password):
+        """Re-hash with the configured method after a successful login if it changed."""
+        if needs_rehash(self.password_hash):
+            self.set_password(password)
+            return True
+        return False
     
     @staticmethod
     def validate_password_strength(password):
@@ -65,16 +82,187 @@ class Drug(db.Model):
     supplier = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Bumped by every update; ORM flushes check it (optimistic locking), see stock.py
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     
     # Foreign keys
     added_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
+    __mapper_args__ = {'version_id_col': version}
+    
+    # Indexes for the listing sort, status filters and dashboard counters.
+    # Keep in sync with migrations.py.
+    __table_args__ = (
+        db.Index('ix_drug_name_id', 'name', 'id'),
+        db.Index('ix_drug_expiry_date_quantity', 'expiry_date', 'quantity'),
+        db.Index('ix_drug_quantity', 'quantity'),
+        db.Index('ix_drug_batch_number', 'batch_number'),
+        db.Index('ix_drug_supplier_name_id', 'supplier', 'name', 'id'),
+        db.Index('ix_drug_name_expiry_date_id', 'name', 'expiry_date', 'id'),
+        db.Index('ix_drug_updated_at_id', 'updated_at', 'id'),
+    )
+    
+    @staticmethod
+    def parse_fields(data):
+        """
+        Validate and convert submitted drug fields (form data or an import row).
+        
+        Returns a dict of column values; raises ValueError describing the
+        first problem found.
+        """
+        # Import rows are parsed JSON, so a field may be a list or an object
+        for field in ('name', 'description', 'batch_number', 'supplier'):
+            if data.get(field) is not None and not isinstance(data.get(field), str):
+                raise ValueError(f'Invalid {field.replace("_", " ")}: {data.get(field)!r}')
+        
+        name = (data.get('name') or '').strip()
+        if not name:
+            raise ValueError('Name is required')
+        
+        try:
+            quantity = int(data.get('quantity'))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid quantity: {data.get('quantity')!r}")
+        if quantity < 0:
+            raise ValueError('Quantity cannot be negative')
+        
+        price = data.get('price')
+        price = Drug.parse_price(price) if price not in (None, '') else None
+        
+        try:
+            expiry_date = datetime.strptime(data.get('expiry_date') or '', '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid expiry date (expected YYYY-MM-DD): {data.get('expiry_date')!r}")
+        
+        return {
+            'name': name,
+            'description': data.get('description') or None,
+            'quantity': quantity,
+            'price': price,
+            'expiry_date': expiry_date,
+            'batch_number': data.get('batch_number') or None,
+            'supplier': data.get('supplier') or None,
+        }
+    
+    @staticmethod
+    def parse_price(raw):
+        """A finite, non-negative price; float() alone accepts 'nan' and 'inf'."""
+        try:
+            price = float(raw)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid price: {raw!r}')
+        if not math.isfinite(price):
+            raise ValueError(f'Invalid price: {raw!r}')
+        if price < 0:
+            raise ValueError('Price cannot be negative')
+        return price
+    
     def is_expired(self):
-        return self.expiry_date < datetime.now().date()
+        return self.expiry_date < current_date()
+    
+    @classmethod
+    def status_expression(cls, today):
+        """SQL expression yielding 'expired', 'low_stock' or 'ok' for each row."""
+        return case(
+            (cls.expiry_date < today, 'expired'),
+            (cls.quantity < LOW_STOCK_THRESHOLD, 'low_stock'),
+            else_='ok'
+        )
     
     def __repr__(self):
         return f'<Drug {self.name}>'
 
+class StockMovement(db.Model):
+    """Append-only record of a change to a drug's quantity; see stock.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: the history outlives a deleted drug
+    drug_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # dispense, receive, adjust
+    change = db.Column(db.Integer, nullable=False)
+    quantity_after = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    
+    user = db.relationship('User', lazy='joined')
+    
+    # Per-drug history, newest first, and point-in-time lookups.
+    # Keep in sync with migrations.py.
+    __table_args__ = (
+        db.Index('ix_stock_movement_drug_id_created_at_id', 'drug_id', 'created_at', 'id'),
+    )
+
+class StockSnapshot(db.Model):
+    """A drug's quantity at ``taken_at``, recorded periodically; see stock.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    drug_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    taken_at = db.Column(db.DateTime, nullable=False)
+    
+    # Keep in sync with migrations.py.
+    __table_args__ = (
+        db.Index('ix_stock_snapshot_drug_id_taken_at_id', 'drug_id', 'taken_at', 'id'),
+    )
+
+class ArchivedMessage(db.Model):
+    """A message moved out of the live table by the retention job; see archive.py."""
+    __tablename__ = 'archived_message'
+    id = db.Column(db.Integer, primary_key=True)
+    # SQLite may reuse the ids of deleted rows, so the original id is not the key
+    message_id = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    is_urgent = db.Column(db.Boolean, default=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Same timeline and per-sender indexes as Message. Keep in sync with migrations.py.
+    __table_args__ = (
+        db.Index('ix_archived_message_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_archived_message_sender_id', 'sender_id'),
+    )
+
+class MessageReadMark(db.Model):
+    """The newest message id a user has seen; everything above it is unread. See unread.py."""
+    __tablename__ = 'message_read_mark'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    last_seen_message_id = db.Column(db.Integer, nullable=False, default=0)
+    seen_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class DrugAlert(db.Model):
+    """An open expiry or low-stock alert; at most one per drug and kind. See stock_alerts.py."""
+    __tablename__ = 'drug_alert'
+    # No foreign key: like the ledger, alerts are bookkeeping that outlives a drug
+    drug_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    kind = db.Column(db.String(20), primary_key=True)  # expired, low_stock
+    message_id = db.Column(db.Integer)
+    raised_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class AlertScanState(db.Model):
+    """How far the alert scanner has got; see stock_alerts.py."""
+    __tablename__ = 'alert_scan_state'
+    name = db.Column(db.String(50), primary_key=True)
+    # Drugs updated before this (less a safety lag) have been checked
+    changed_through = db.Column(db.DateTime)
+    # Drugs expiring before this date have been checked for expiry
+    expired_before = db.Column(db.Date)
+
+class JobLease(db.Model):
+    """Which scheduler process may run a job, until when; see scheduler.py."""
+    __tablename__ = 'job_lease'
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class ApiToken(db.Model):
+    """A bearer token for the JSON API; only its SHA-256 is stored. See api.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(100))
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -85,8 +273,22 @@ class Message(db.Model):
     # Foreign keys
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
+    # Indexes for the newest-first timeline and per-sender lookups.
+    # Keep in sync with migrations.py.
+    __table_args__ = (
+        db.Index('ix_message_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_message_sender_id', 'sender_id'),
+    )
+    
     def can_delete(self, user):
         return user.id == self.sender_id or user.role == 'pharmacist'
     
+    @classmethod
+    def deletable_by(cls, user):
+        """can_delete() as a SQL condition, for set-based deletes. Keep the two in sync."""
+        if user.role == 'pharmacist':
+            return true()
+        return cls.sender_id == user.id
+    
     def __repr__(self):
         return f'<Message {self.title}>'
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+Keyset (cursor) pagination helpers.
+
+Pages are addressed by the sort key of the last row already shown rather than
+by an OFFSET, so fetching page 1000 costs the same as fetching page 1.
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+
+def encode_cursor(values):
+    """Turn the sort-key values of a row into an opaque URL-safe token."""
+    payload = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, columns):
+    """
+    Decode a token produced by encode_cursor back into typed values.
+
+    Returns None for a missing or malformed token so a bad link simply
+    starts from the first page.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(payload, list) or len(payload) != len(columns):
+        return None
+
+    values = []
+    for column, value in zip(columns, payload):
+        python_type = column.type.python_type
+        try:
+            if value is None:
+                values.append(None)
+            elif python_type is datetime:
+                values.append(datetime.fromisoformat(value))
+            elif python_type is date:
+                values.append(date.fromisoformat(value))
+            else:
+                values.append(python_type(value))
+        except (ValueError, TypeError):
+            return None
+    return values
+
+
+def keyset_condition(columns, values, descending=False):
+    """
+    Build the "rows after this cursor" predicate for a multi-column sort key.
+
+    Expanded as (a > x) OR (a = x AND b > y) ... so it works on every backend
+    we deploy to and can still use a composite index on the sort columns.
+    """
+    clauses = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        step = column < value if descending else column > value
+        prefix = [c == v for c, v in zip(columns[:i], values[:i])]
+        clauses.append(and_(*prefix, step) if prefix else step)
+    return or_(*clauses)
+
+
+def parse_per_page(raw, default=DEFAULT_PER_PAGE):
+    """Clamp a ?per_page= query argument to a sane range."""
+    try:
+        per_page = int(raw)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+class KeysetPage:
+    """One page of results plus the cursor for the page that follows it."""
+
+    def __init__(self, items, next_cursor, per_page):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=DEFAULT_PER_PAGE,
+                    descending=False, key=None):
+    """
+    Fetch one page of ``query`` ordered by ``columns``.
+
+    ``columns`` must end with a unique column (normally the primary key) so
+    the ordering is total. One extra row is fetched to learn whether a next
+    page exists. ``key`` extracts the sort-key values from a result row and
+    defaults to reading the column attributes off the row itself.
+    """
+    values = decode_cursor(cursor, columns)
+    if values is not None:
+        query = query.filter(keyset_condition(columns, values, descending))
+
+    order = [c.desc() if descending else c.asc() for c in columns]
+    rows = query.order_by(*order).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        if key is None:
+            key_values = [getattr(last, c.key) for c in columns]
+        else:
+            key_values = key(last)
+        next_cursor = encode_cursor(key_values)
+    return KeysetPage(rows, next_cursor, per_page)
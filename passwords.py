@@ -0,0 +1,137 @@
+"""
+Password hashing.
+
+Hashes are produced and checked with Werkzeug, using the algorithm and cost
+in PASSWORD_HASH_METHOD (any Werkzeug method string, e.g.
+'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'). When PASSWORD_HASH_WORKERS
+is above zero the work runs in a small per-worker process pool, so a burst
+of logins cannot take more than that many CPUs away from other requests.
+At most PASSWORD_HASH_WORKERS * 4 hashes may be queued or running, counting
+ones whose request already gave up; a request that cannot get a slot within
+PASSWORD_HASH_TIMEOUT seconds gets HashingUnavailable.
+
+Each call records how long the hash itself took and how long it waited for
+the pool in g.server_timing, which the app sends as a Server-Timing header.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from flask import current_app, g
+from werkzeug.security import (DEFAULT_PBKDF2_ITERATIONS, check_password_hash,
+                               generate_password_hash)
+
+DEFAULT_METHOD = f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}'
+QUEUE_FACTOR = 4
+
+
+class HashingUnavailable(Exception):
+    """Raised when the hashing pool is saturated for longer than the timeout."""
+
+
+def canonical_method(method):
+    """Expand a Werkzeug method string to the form stored in the hash prefix."""
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return 'scrypt:32768:8:1'
+    if name == 'pbkdf2':
+        if not args:
+            return DEFAULT_METHOD
+        if len(args) == 1:
+            return f'pbkdf2:{args[0]}:{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
+
+
+def needs_rehash(password_hash, method=None):
+    """True if ``password_hash`` was not made with the configured method."""
+    method = canonical_method(method or current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD))
+    return not password_hash or password_hash.split('$', 1)[0] != method
+
+
+# Run inside the pool processes; they report their own CPU time back
+
+def _timed_generate(password, method):
+    start = time.perf_counter()
+    return generate_password_hash(password, method=method), time.perf_counter() - start
+
+
+def _timed_check(password_hash, password):
+    start = time.perf_counter()
+    return check_password_hash(password_hash, password), time.perf_counter() - start
+
+
+class HashingPool:
+    """Lazily started process pool, recreated after a fork."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._pid = None
+
+    def _get(self, workers):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # spawn, not fork: the parent is usually a threaded gunicorn worker
+                self._executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._slots = threading.BoundedSemaphore(workers * QUEUE_FACTOR)
+                self._pid = os.getpid()
+            return self._executor, self._slots
+
+    def run(self, fn, *args):
+        workers = current_app.config.get('PASSWORD_HASH_WORKERS', 0)
+        timeout = current_app.config.get('PASSWORD_HASH_TIMEOUT', 10)
+        started = time.perf_counter()
+        if not workers:
+            result, elapsed = fn(*args)
+        else:
+            executor, slots = self._get(workers)
+            if not slots.acquire(timeout=timeout):
+                raise HashingUnavailable('Password hashing is busy, please try again')
+            try:
+                future = executor.submit(fn, *args)
+            except BaseException:
+                slots.release()
+                raise
+            # The slot is held until the job leaves the pool, not until we stop
+            # waiting, so timed-out jobs still count against the queue limit
+            future.add_done_callback(lambda _: slots.release())
+            try:
+                result, elapsed = future.result(timeout=timeout)
+            except TimeoutError:
+                # Frees the slot at once if the job has not started yet
+                future.cancel()
+                raise HashingUnavailable('Password hashing timed out, please try again')
+        _record_timing(elapsed, time.perf_counter() - started - elapsed)
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+pool = HashingPool()
+
+
+def _record_timing(hash_seconds, wait_seconds):
+    timings = g.setdefault('server_timing', {})
+    timings['pwhash'] = timings.get('pwhash', 0.0) + hash_seconds * 1000
+    timings['pwwait'] = timings.get('pwwait', 0.0) + wait_seconds * 1000
+
+
+def hash_password(password):
+    method = current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+    return pool.run(_timed_generate, password, method)
+
+
+def verify_password(password_hash, password):
+    if not password_hash:
+        return False
+    return pool.run(_timed_check, password_hash, password)
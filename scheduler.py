@@ -0,0 +1,102 @@
+"""
+Leader-elected background jobs.
+
+``flask --app app run-scheduler`` runs the periodic jobs (the stock alert
+scan in stock_alerts.py, and compacting the PostgreSQL table change log in
+httpcache.py) in a worker process of its own. Several of these may run,
+e.g. one beside each app replica: a job only runs in the process holding its
+lease, a job_lease row naming the holder and expiring SCHEDULER_LEASE_TTL
+seconds after it was last renewed. The holder renews it
+on every run and between the batches of a long run; if the holder dies,
+another process takes over once the lease has expired. Leases are written in
+short transactions on their own connection, so they behave the same on
+PostgreSQL, MySQL and SQLite.
+
+A lease is not a hard guarantee: a holder stalled past its expiry may
+overlap with its successor for a batch. Jobs must therefore be idempotent;
+see stock_alerts.py for how the alert scan is.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, JobLease
+
+DEFAULT_LEASE_TTL = 120
+
+log = logging.getLogger(__name__)
+
+# run(keep_alive) does one pass; keep_alive() renews the lease and returns False once it is lost
+Job = namedtuple('Job', 'name interval run')
+
+
+def holder_id():
+    """A name for this process that is unique across hosts and restarts."""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def acquire(name, holder, ttl=DEFAULT_LEASE_TTL, now=None):
+    """Take or renew the lease on job ``name`` for ``ttl`` seconds; True if ``holder`` now has it."""
+    now = now or datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl)
+    # Only the holder, or anyone once it has expired. A concurrent taker
+    # re-checks the condition after the winner commits and updates nothing.
+    take = update(JobLease) \
+        .where(JobLease.name == name, or_(JobLease.holder == holder, JobLease.expires_at < now)) \
+        .values(holder=holder, expires_at=expires_at)
+    with db.engine.begin() as conn:
+        if conn.execute(take).rowcount:
+            return True
+        if conn.execute(select(JobLease.name).where(JobLease.name == name)).first():
+            return False
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(JobLease).values(name=name, holder=holder, expires_at=expires_at))
+        except IntegrityError:
+            # Another process created the lease first
+            return False
+    return True
+
+
+def release(name, holder):
+    """Give up the lease so another process can take over without waiting for it to expire."""
+    with db.engine.begin() as conn:
+        conn.execute(delete(JobLease).where(JobLease.name == name, JobLease.holder == holder))
+
+
+def run_once(job, holder, ttl=DEFAULT_LEASE_TTL):
+    """Run ``job`` if this process holds (or can take) its lease; returns the job's result or None."""
+    if not acquire(job.name, holder, ttl):
+        return None
+    try:
+        return job.run(lambda: acquire(job.name, holder, ttl))
+    except Exception:
+        db.session.rollback()
+        log.exception('Scheduled job %s failed', job.name)
+        return None
+    finally:
+        db.session.remove()
+
+
+def run_forever(jobs, holder, ttl=DEFAULT_LEASE_TTL, stop=None):
+    """Run each job every ``job.interval`` seconds until ``stop`` is set; leases are released on exit."""
+    stop = stop or threading.Event()
+    due = {job.name: 0.0 for job in jobs}
+    try:
+        while not stop.is_set():
+            for job in jobs:
+                if time.monotonic() >= due[job.name]:
+                    run_once(job, holder, ttl)
+                    due[job.name] = time.monotonic() + job.interval
+            stop.wait(max(0.0, min(due.values()) - time.monotonic()))
+    finally:
+        for job in jobs:
+            release(job.name, holder)
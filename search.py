@@ -0,0 +1,180 @@
+"""
+Full-text drug search over name, description, supplier and batch number.
+
+PostgreSQL keeps the tsvector in a stored generated column (search_document)
+with a GIN index for prefix matching, and a pg_trgm GIN index on the name for
+typo tolerance. Every match is ranked before the limit is applied, so the
+best match is never cut off; ranking reads the stored vector instead of
+rebuilding it per row, which keeps that affordable even for a one- or
+two-letter prefix on a large catalog.
+SQLite uses an FTS5 table kept in sync with the drug table by triggers;
+typos are handled by looking up close spellings in the FTS5 vocabulary when
+a query finds nothing. Other databases fall back to LIKE.
+
+install() creates whichever of these the database supports and is run by
+migration 4; upgrade() (migration 12) brings older installs up to date.
+Because the index lives in the database (a generated column or a
+trigger-maintained table), every insert, update and delete keeps it
+current, including bulk imports. Updates that leave the searched columns
+alone, such as stock movements, do not touch the SQLite index.
+"""
+import difflib
+import re
+import weakref
+
+from sqlalchemy import or_, text
+
+from models import db, Drug
+
+DEFAULT_LIMIT = 50
+
+PG_DOCUMENT = (
+    "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, '') || ' ' "
+    "|| coalesce(supplier, '') || ' ' || coalesce(batch_number, ''))"
+)
+
+# Only changes to the indexed columns re-index a row
+SQLITE_UPDATE_TRIGGER = [
+    "DROP TRIGGER IF EXISTS drug_fts_update",
+    "CREATE TRIGGER drug_fts_update "
+    "AFTER UPDATE OF name, description, supplier, batch_number ON drug BEGIN "
+    "INSERT INTO drug_fts(drug_fts, rowid, name, description, supplier, batch_number) "
+    "VALUES ('delete', old.id, old.name, old.description, old.supplier, old.batch_number); "
+    "INSERT INTO drug_fts(rowid, name, description, supplier, batch_number) "
+    "VALUES (new.id, new.name, new.description, new.supplier, new.batch_number); END",
+]
+
+SQLITE_SETUP = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS drug_fts USING fts5("
+    "name, description, supplier, batch_number, content='drug', content_rowid='id')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS drug_fts_vocab USING fts5vocab(drug_fts, 'row')",
+    "CREATE TRIGGER IF NOT EXISTS drug_fts_insert AFTER INSERT ON drug BEGIN "
+    "INSERT INTO drug_fts(rowid, name, description, supplier, batch_number) "
+    "VALUES (new.id, new.name, new.description, new.supplier, new.batch_number); END",
+    "CREATE TRIGGER IF NOT EXISTS drug_fts_delete AFTER DELETE ON drug BEGIN "
+    "INSERT INTO drug_fts(drug_fts, rowid, name, description, supplier, batch_number) "
+    "VALUES ('delete', old.id, old.name, old.description, old.supplier, old.batch_number); END",
+    *SQLITE_UPDATE_TRIGGER,
+    # Index whatever rows already exist
+    "INSERT INTO drug_fts(drug_fts) VALUES ('rebuild')",
+]
+
+PG_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"ALTER TABLE drug ADD COLUMN IF NOT EXISTS search_document tsvector "
+    f"GENERATED ALWAYS AS ({PG_DOCUMENT}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_drug_search_vector ON drug USING gin (search_document)",
+    # The expression index used before the column existed
+    "DROP INDEX IF EXISTS ix_drug_search_document",
+    "CREATE INDEX IF NOT EXISTS ix_drug_name_trgm ON drug USING gin (name gin_trgm_ops)",
+]
+
+# Engines known to have (True) or lack (False) the SQLite FTS5 table
+_fts_available = weakref.WeakKeyDictionary()
+
+
+def install(conn):
+    """Create the search index objects supported by ``conn``'s database."""
+    if conn.dialect.name == 'postgresql':
+        for statement in PG_SETUP:
+            conn.exec_driver_sql(statement)
+    elif conn.dialect.name == 'sqlite':
+        for statement in SQLITE_SETUP:
+            conn.exec_driver_sql(statement)
+        _fts_available[conn.engine] = True
+
+
+def upgrade(conn):
+    """Move an existing install to the stored search column and the narrower update trigger."""
+    if conn.dialect.name == 'postgresql':
+        for statement in PG_SETUP:
+            conn.exec_driver_sql(statement)
+    elif conn.dialect.name == 'sqlite' and _has_fts(conn):
+        for statement in SQLITE_UPDATE_TRIGGER:
+            conn.exec_driver_sql(statement)
+
+
+def tokenize(query):
+    return re.findall(r'\w+', (query or '').lower())
+
+
+def _has_fts(conn):
+    engine = conn.engine
+    if engine not in _fts_available:
+        found = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE name = 'drug_fts'"
+        ).first()
+        _fts_available[engine] = found is not None
+    return _fts_available[engine]
+
+
+def _postgres_ids(conn, terms, limit):
+    tsquery = ' & '.join(f'{t}:*' for t in terms)
+    phrase = ' '.join(terms)
+    rows = conn.execute(text(
+        "SELECT id FROM drug "
+        "WHERE search_document @@ to_tsquery('simple', :tsquery) OR name % :phrase "
+        "ORDER BY ts_rank(search_document, to_tsquery('simple', :tsquery)) DESC, "
+        "similarity(name, :phrase) DESC, id "
+        "LIMIT :limit"
+    ), {'tsquery': tsquery, 'phrase': phrase, 'limit': limit})
+    return [row[0] for row in rows]
+
+
+def _close_terms(conn, term, limit=3):
+    """Indexed words spelled like ``term``, drawn from words sharing its first letter."""
+    candidates = [row[0] for row in conn.exec_driver_sql(
+        "SELECT term FROM drug_fts_vocab WHERE term >= ? AND term < ?",
+        (term[0], term[0] + '\U0010ffff')
+    )]
+    return difflib.get_close_matches(term, candidates, n=limit, cutoff=0.75)
+
+
+def _sqlite_ids(conn, terms, limit):
+    def run(groups):
+        match = ' AND '.join('(' + ' OR '.join(group) + ')' for group in groups)
+        rows = conn.exec_driver_sql(
+            "SELECT rowid FROM drug_fts WHERE drug_fts MATCH ? ORDER BY rank LIMIT ?",
+            (match, limit)
+        )
+        return [row[0] for row in rows]
+
+    ids = run([[f'"{t}"*'] for t in terms])
+    if ids:
+        return ids
+
+    # Nothing matched as typed; retry with close spellings of each word
+    groups = [[f'"{t}"*'] + [f'"{c}"' for c in _close_terms(conn, t)] for t in terms]
+    if all(len(group) == 1 for group in groups):
+        return []
+    return run(groups)
+
+
+def search_drug_ids(query, limit=DEFAULT_LIMIT):
+    """Ids of drugs matching ``query``, best match first."""
+    terms = tokenize(query)
+    if not terms:
+        return []
+    conn = db.session.connection(bind_arguments={'read_only': True})
+    if conn.dialect.name == 'postgresql':
+        return _postgres_ids(conn, terms, limit)
+    if conn.dialect.name == 'sqlite' and _has_fts(conn):
+        return _sqlite_ids(conn, terms, limit)
+
+    # No search index available: every term must appear in some field
+    fields = (Drug.name, Drug.description, Drug.supplier, Drug.batch_number)
+    matches = db.session.query(Drug.id)
+    for term in terms:
+        matches = matches.filter(or_(*[f.ilike(f'%{term}%') for f in fields]))
+    return [row[0] for row in matches.order_by(Drug.name, Drug.id).limit(limit)]
+
+
+def search_drugs(query, today, limit=DEFAULT_LIMIT):
+    """(Drug, status) rows matching ``query`` in relevance order."""
+    ids = search_drug_ids(query, limit)
+    if not ids:
+        return []
+    rows = Drug.query.add_columns(Drug.status_expression(today).label('status')) \
+        .filter(Drug.id.in_(ids)).all()
+    position = {drug_id: i for i, drug_id in enumerate(ids)}
+    return sorted(rows, key=lambda row: position[row[0].id])
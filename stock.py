@@ -0,0 +1,312 @@
+"""
+Atomic stock movements, the stock ledger and point-in-time quantities.
+
+Dispensing, receiving and adjusting never write a quantity read earlier.
+Each movement is a single
+
+    UPDATE drug SET quantity = quantity + :change, version = version + 1
+    WHERE id = :id [AND quantity >= :needed] [AND version = :expected]
+
+so concurrent movements cannot lose each other's updates, and a dispense
+can never take the quantity below zero. ``expected_version`` adds an
+optimistic check for callers that showed the user a quantity first; the
+edit form relies on the same column through the mapper's version_id_col.
+
+Every applied batch is appended to stock_movement with one multi-row
+INSERT, in the same transaction as the quantity updates, so the ledger and
+the drug table cannot disagree. Each ledger row carries the quantity after
+the change. take_snapshot() records the quantity of every drug that changed
+since its previous snapshot. Together they answer quantity_at() with at most
+five index lookups, however long the ledger grows.
+
+allocate() dispenses by drug name rather than by batch: it takes stock from
+non-expired batches first-expiry-first-out, for a whole cart in one
+transaction, locking only the batches it takes from (see its docstring).
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from sqlalchemy import case, func, insert, literal, select, update
+
+from models import db, Drug, StockMovement, StockSnapshot
+
+KINDS = ('dispense', 'receive', 'adjust')
+RECENT_MOVEMENTS = 20
+
+Movement = namedtuple('Movement', 'drug_id change expected_version', defaults=(None,))
+
+
+class StockError(ValueError):
+    """A movement that cannot be applied."""
+
+
+class UnknownDrug(StockError):
+    pass
+
+
+class InsufficientStock(StockError):
+    pass
+
+
+class VersionConflict(StockError):
+    pass
+
+
+class Unavailable(InsufficientStock):
+    """Not enough unexpired stock for one or more cart lines."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__('; '.join(
+            f"{s['name']}: {s['requested']} requested, {s['available']} available" for s in shortages
+        ))
+
+
+def movement(kind, drug_id, amount, expected_version=None):
+    """Validate a requested movement and return it with a signed change."""
+    if kind not in KINDS:
+        raise StockError(f'Unknown stock movement: {kind!r}')
+    try:
+        amount = int(amount)
+    except (TypeError, ValueError):
+        raise StockError(f'Invalid amount: {amount!r}')
+    if kind == 'adjust':
+        if amount == 0:
+            raise StockError('An adjustment must change the quantity')
+    elif amount <= 0:
+        raise StockError('Amount must be positive')
+    if expected_version not in (None, ''):
+        try:
+            expected_version = int(expected_version)
+        except (TypeError, ValueError):
+            raise StockError(f'Invalid version: {expected_version!r}')
+    else:
+        expected_version = None
+    return Movement(drug_id, -amount if kind == 'dispense' else amount, expected_version)
+
+
+def _failure(m):
+    row = db.session.query(Drug.name, Drug.quantity, Drug.version).filter(Drug.id == m.drug_id).first()
+    if row is None:
+        return UnknownDrug(f'Drug {m.drug_id} does not exist')
+    if m.expected_version is not None and row.version != m.expected_version:
+        return VersionConflict(f'{row.name} was changed by someone else; reload and try again')
+    return InsufficientStock(f'Only {row.quantity} of {row.name} in stock')
+
+
+def _apply(m):
+    stmt = update(Drug).where(Drug.id == m.drug_id) \
+        .values(quantity=Drug.quantity + m.change, version=Drug.version + 1) \
+        .execution_options(synchronize_session='fetch')
+    if m.change < 0:
+        stmt = stmt.where(Drug.quantity >= -m.change)
+    if m.expected_version is not None:
+        stmt = stmt.where(Drug.version == m.expected_version)
+
+    if db.session.get_bind().dialect.update_returning:
+        row = db.session.execute(stmt.returning(Drug.quantity, Drug.version)).first()
+    else:
+        # MySQL: the updated row stays locked until commit, so the re-read is exact
+        row = None
+        if db.session.execute(stmt).rowcount:
+            row = db.session.query(Drug.quantity, Drug.version).filter(Drug.id == m.drug_id).first()
+    if row is None:
+        raise _failure(m)
+    return tuple(row)
+
+
+def apply_movements(kind, movements, user_id, reason=None):
+    """
+    Apply ``movements`` (Movement tuples of one kind) and append them to the ledger.
+
+    Returns {drug_id: (quantity, version)} after the batch. Raises StockError
+    if any movement cannot be applied; the caller must then roll back, as
+    earlier movements of the batch may already be applied. The caller commits.
+    """
+    now = datetime.utcnow()
+    results = {}
+    ledger = []
+    # A fixed lock order keeps concurrent multi-drug batches from deadlocking
+    for m in sorted(movements, key=lambda m: m.drug_id):
+        quantity, version = _apply(m)
+        results[m.drug_id] = (quantity, version)
+        ledger.append({'drug_id': m.drug_id, 'kind': kind, 'change': m.change,
+                       'quantity_after': quantity, 'reason': reason,
+                       'created_at': now, 'user_id': user_id})
+    if ledger:
+        db.session.execute(insert(StockMovement), ledger)
+    return results
+
+
+def parse_cart(items):
+    """Validate [{'name', 'amount'}] lines; returns {name: amount} with duplicates merged."""
+    if not items:
+        raise StockError('Nothing to dispense')
+    if not isinstance(items, list):
+        raise StockError('Items must be a list of {"name", "amount"} lines')
+    cart = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise StockError('Every line must have a name and an amount')
+        name = item.get('name')
+        if name is not None and not isinstance(name, str):
+            raise StockError(f'Invalid drug name: {name!r}')
+        name = (name or '').strip()
+        if not name:
+            raise StockError('Every line needs a drug name')
+        change = movement('dispense', None, item.get('amount'))
+        cart[name] = cart.get(name, 0) - change.change
+    return cart
+
+
+def _fefo_batches(cart, today):
+    """
+    Lock and return just the batches that cover ``cart``, in FEFO order.
+
+    A running total per name (ix_drug_name_expiry_date_id supplies the
+    order) picks each batch whose earlier batches hold less than the line
+    needs; only those rows are then read FOR UPDATE. Window functions cannot
+    be combined with FOR UPDATE, hence the two statements.
+    """
+    in_stock = (Drug.name.in_(cart), Drug.expiry_date >= today, Drug.quantity > 0)
+    earlier = func.sum(Drug.quantity).over(partition_by=Drug.name,
+                                           order_by=(Drug.expiry_date, Drug.id)) - Drug.quantity
+    ranked = select(Drug.id, Drug.name, earlier.label('earlier')).where(*in_stock).subquery()
+    ids = db.session.execute(
+        select(ranked.c.id).where(ranked.c.earlier < case(cart, value=ranked.c.name))
+    ).scalars().all()
+    if not ids:
+        return []
+    return db.session.query(Drug.id, Drug.name, Drug.quantity, Drug.batch_number, Drug.expiry_date) \
+        .filter(Drug.id.in_(ids), *in_stock) \
+        .order_by(Drug.name, Drug.expiry_date, Drug.id) \
+        .with_for_update().all()
+
+
+def _available(names, today):
+    """{name: unexpired units in stock}, for reporting shortages."""
+    rows = db.session.query(Drug.name, func.sum(Drug.quantity)) \
+        .filter(Drug.name.in_(names), Drug.expiry_date >= today, Drug.quantity > 0) \
+        .group_by(Drug.name)
+    available = dict.fromkeys(names, 0)
+    available.update({name: int(total) for name, total in rows})
+    return available
+
+
+def allocate(cart, user_id, today, reason=None, attempts=2):
+    """
+    Dispense ``cart`` ({name: amount}) first-expiry-first-out across batches.
+
+    Only the batches needed to fill each line are read and row-locked (see
+    _fefo_batches), so batches further down the FEFO order stay free for
+    other dispenses. If a concurrent dispense drained a chosen batch between
+    the two statements, the selection is retried. The takes are applied as
+    guarded movements, so a batch changed by a concurrent transaction on a
+    database without row locks (SQLite) fails the whole cart rather than
+    over-dispensing.
+
+    Returns [{'name', 'amount', 'batches': [{'drug_id', 'batch_number',
+    'expiry_date', 'taken', 'remaining'}]}] in cart order. Raises
+    Unavailable if any line cannot be filled; the caller then rolls back.
+    """
+    for attempt in range(attempts):
+        needed = dict(cart)
+        takes = {name: [] for name in cart}
+        for drug_id, name, quantity, batch_number, expiry_date in _fefo_batches(cart, today):
+            if needed[name] > 0:
+                taken = min(quantity, needed[name])
+                needed[name] -= taken
+                takes[name].append({'drug_id': drug_id, 'batch_number': batch_number,
+                                    'expiry_date': expiry_date, 'taken': taken})
+        if not any(n > 0 for n in needed.values()):
+            break
+        available = _available(list(cart), today)
+        short = [name for name in cart if available[name] < cart[name]]
+        if short or attempt == attempts - 1:
+            raise Unavailable([{'name': name, 'requested': cart[name], 'available': available[name]}
+                               for name in short or [n for n in cart if needed[n] > 0]])
+
+    results = apply_movements('dispense', [
+        Movement(take['drug_id'], -take['taken']) for batch in takes.values() for take in batch
+    ], user_id, reason)
+    for batch in takes.values():
+        for take in batch:
+            take['remaining'] = results[take['drug_id']][0]
+    return [{'name': name, 'amount': cart[name], 'batches': takes[name]} for name in cart]
+
+
+def record_edit(drug, old_quantity, user_id):
+    """Ledger entry for a quantity changed through the edit form (flushed with the drug)."""
+    if drug.quantity != old_quantity:
+        db.session.add(StockMovement(
+            drug_id=drug.id, kind='adjust', change=drug.quantity - old_quantity,
+            quantity_after=drug.quantity, reason='Edited', user_id=user_id
+        ))
+
+
+def recent_movements(drug_id, limit=RECENT_MOVEMENTS):
+    return StockMovement.query.filter(StockMovement.drug_id == drug_id) \
+        .order_by(StockMovement.created_at.desc(), StockMovement.id.desc()).limit(limit).all()
+
+
+def take_snapshot(now=None):
+    """Record the current quantity of each drug whose quantity differs from its last snapshot."""
+    now = now or datetime.utcnow()
+    latest = select(StockSnapshot.quantity) \
+        .where(StockSnapshot.drug_id == Drug.id) \
+        .order_by(StockSnapshot.taken_at.desc(), StockSnapshot.id.desc()) \
+        .limit(1).correlate(Drug).scalar_subquery()
+    changed = select(Drug.id, Drug.quantity, literal(now, StockSnapshot.taken_at.type)) \
+        .where(Drug.quantity.is_distinct_from(latest))
+    result = db.session.execute(
+        insert(StockSnapshot).from_select(['drug_id', 'quantity', 'taken_at'], changed)
+    )
+    return result.rowcount
+
+
+def parse_time(raw):
+    """An ISO 8601 date and time as naive UTC, the ledger's clock; raises ValueError."""
+    # fromisoformat() before Python 3.11 does not read a 'Z' suffix
+    when = datetime.fromisoformat(raw[:-1] + '+00:00' if raw.endswith(('Z', 'z')) else raw)
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return when
+
+
+def quantity_at(drug_id, when):
+    """
+    The drug's quantity at ``when``.
+
+    None for an unknown drug, or for a time before the drug's first record
+    (when it was added; for a deleted drug, its earliest ledger entry).
+    """
+    def latest_before(model, time_column, *columns):
+        return db.session.query(*columns, time_column).filter(
+            model.drug_id == drug_id, time_column <= when
+        ).order_by(time_column.desc(), model.id.desc()).first()
+
+    def earliest_after(model, time_column, *columns):
+        return db.session.query(*columns, time_column).filter(
+            model.drug_id == drug_id, time_column > when
+        ).order_by(time_column, model.id).first()
+
+    # The newest record at or before ``when`` states the quantity directly
+    moved = latest_before(StockMovement, StockMovement.created_at, StockMovement.quantity_after)
+    snapped = latest_before(StockSnapshot, StockSnapshot.taken_at, StockSnapshot.quantity)
+    known = [r for r in (moved, snapped) if r is not None]
+    if known:
+        return max(known, key=lambda r: r[-1])[0]
+
+    # Nothing recorded yet: the drug had not been added, or work back from
+    # the first record after ``when``
+    drug = db.session.query(Drug.quantity, Drug.created_at).filter(Drug.id == drug_id).first()
+    if drug is None or (drug.created_at is not None and when < drug.created_at):
+        return None
+    moved = earliest_after(StockMovement, StockMovement.created_at,
+                           StockMovement.quantity_after, StockMovement.change)
+    snapped = earliest_after(StockSnapshot, StockSnapshot.taken_at, StockSnapshot.quantity)
+    if moved is not None and (snapped is None or moved[-1] <= snapped[-1]):
+        return moved[0] - moved[1]
+    if snapped is not None:
+        return snapped[0]
+    return drug.quantity
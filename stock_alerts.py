@@ -0,0 +1,207 @@
+"""
+Urgent messages for drugs that expire or run low, found incrementally.
+
+The scheduler (scheduler.py) runs scan() every ALERT_SCAN_INTERVAL seconds.
+A drug needs an alert when it still has stock past its expiry date
+('expired'), or has fewer than LOW_STOCK_THRESHOLD units while unexpired
+('low_stock', the same rule as the drug list's status filter). A drug can
+only start to need one in two ways, and each is read as an index range from
+a watermark kept in alert_scan_state:
+
+  * it was added or changed: drugs with updated_at after changed_through,
+    less ALERT_SCAN_LAG seconds for transactions that were still open when
+    the previous scan ran (ix_drug_updated_at_id);
+  * a date passed: drugs with stock expiring on or after expired_before and
+    before today (ix_drug_expiry_date_quantity).
+
+Only the very first scan, which has no watermarks, reads every drug.
+
+drug_alert holds the open alerts, one per (drug, kind). New alerts are
+posted ALERT_BATCH_SIZE drugs at a time, as one urgent message per kind, in
+the same transaction as their drug_alert rows. That primary key is what
+makes a drug read again (the lag window, a retried batch) alert only once,
+and what makes a batch fail instead of posting twice should two schedulers
+ever overlap. A changed drug that no longer meets the condition (restocked,
+relabelled, disposed of) has its alert closed, so crossing the threshold
+again alerts again.
+
+Once every alert a message raised has closed, the message is no longer
+urgent, so the archiver (archive.py) retires it with other old messages.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select, update
+
+import events
+from models import db, AlertScanState, Drug, DrugAlert, Message, User, LOW_STOCK_THRESHOLD, current_date
+from pagination import keyset_condition
+from scheduler import Job
+
+DEFAULT_INTERVAL = 60
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_LAG = 300
+JOB_NAME = 'stock-alerts'
+KINDS = ('expired', 'low_stock')
+TITLES = {
+    'expired': 'Expired stock: {} batch(es) to remove',
+    'low_stock': 'Low stock: {} batch(es) to reorder',
+}
+
+COLUMNS = (Drug.id, Drug.name, Drug.batch_number, Drug.quantity, Drug.expiry_date, Drug.updated_at)
+
+log = logging.getLogger(__name__)
+
+
+def alert_kind(quantity, expiry_date, today):
+    """'expired', 'low_stock' or None for a drug in this state."""
+    if expiry_date < today:
+        return 'expired' if quantity > 0 else None
+    if quantity < LOW_STOCK_THRESHOLD:
+        return 'low_stock'
+    return None
+
+
+def describe(kind, row):
+    name = f'{row.name} (batch {row.batch_number})' if row.batch_number else row.name
+    verb = 'expired' if kind == 'expired' else 'expires'
+    return f'{name}: {row.quantity} left, {verb} {row.expiry_date.isoformat()}'
+
+
+def alert_sender(username=None):
+    """The user alerts are sent as: ``username`` if given, else the first pharmacist."""
+    query = User.query
+    if username:
+        user = query.filter(User.username == username).first()
+    else:
+        user = query.filter(User.role == 'pharmacist').order_by(User.id).first()
+    if user is None:
+        raise ValueError(f'No such user: {username}' if username
+                         else 'No pharmacist to send alerts as; set ALERT_SENDER')
+    return user
+
+
+def post_batch(rows, sender, today, now):
+    """Open and post alerts for ``rows`` that newly need one, close those that no longer do.
+
+    Returns the number of messages posted. The caller commits.
+    """
+    ids = [row.id for row in rows]
+    # (drug_id, kind) -> the message that raised it
+    open_alerts = {(drug_id, kind): message_id for drug_id, kind, message_id in db.session.query(
+        DrugAlert.drug_id, DrugAlert.kind, DrugAlert.message_id).filter(DrugAlert.drug_id.in_(ids))}
+    raised = {kind: [] for kind in KINDS}
+    closed = {kind: [] for kind in KINDS}
+    closed_messages = set()
+    for row in rows:
+        needed = alert_kind(row.quantity, row.expiry_date, today)
+        for kind in KINDS:
+            if (row.id, kind) in open_alerts and kind != needed:
+                closed[kind].append(row.id)
+                closed_messages.add(open_alerts[(row.id, kind)])
+        if needed and (row.id, needed) not in open_alerts:
+            raised[needed].append(row)
+
+    posted = 0
+    for kind in KINDS:
+        if closed[kind]:
+            db.session.execute(delete(DrugAlert).where(DrugAlert.kind == kind,
+                                                       DrugAlert.drug_id.in_(closed[kind])))
+        if not raised[kind]:
+            continue
+        message = Message(title=TITLES[kind].format(len(raised[kind])),
+                          content='\n'.join(describe(kind, row) for row in raised[kind]),
+                          is_urgent=True, sender_id=sender.id, timestamp=now)
+        db.session.add(message)
+        db.session.flush()
+        db.session.execute(insert(DrugAlert), [
+            {'drug_id': row.id, 'kind': kind, 'message_id': message.id, 'raised_at': now}
+            for row in raised[kind]
+        ])
+        events.notify(events.message_event(message.id, message.title, True, message.timestamp,
+                                           sender.username, sender.role))
+        posted += 1
+
+    # A message with no open alert left is an ordinary notice the archiver may retire
+    closed_messages.discard(None)
+    if closed_messages:
+        still_open = select(DrugAlert.message_id).where(DrugAlert.message_id.in_(closed_messages))
+        db.session.execute(update(Message)
+                           .where(Message.id.in_(closed_messages), Message.id.notin_(still_open))
+                           .values(is_urgent=False)
+                           .execution_options(synchronize_session=False))
+    return posted
+
+
+def _batches(query, sort, after, batch_size):
+    """``query`` in keyset batches ordered by ``sort``, starting after the ``after`` key."""
+    while True:
+        page = query
+        if after is not None:
+            page = page.filter(keyset_condition(sort, after))
+        rows = page.order_by(*sort).limit(batch_size).all()
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        after = [getattr(rows[-1], column.key) for column in sort]
+
+
+def scan(sender, today=None, now=None, batch_size=DEFAULT_BATCH_SIZE, lag=DEFAULT_LAG,
+         keep_alive=None):
+    """
+    One incremental pass, committing after each batch.
+
+    ``keep_alive`` is called after every batch; when it returns False (the
+    scheduler lease was lost) the pass stops without moving the watermarks,
+    so the next holder re-reads what is left. Returns {'checked', 'messages'}.
+    """
+    # now is compared with updated_at (UTC); today with expiry dates, on the app's calendar
+    now = now or datetime.utcnow()
+    today = today or current_date()
+    state = db.session.get(AlertScanState, JOB_NAME)
+    if state is None:
+        state = AlertScanState(name=JOB_NAME)
+        db.session.add(state)
+    result = {'checked': 0, 'messages': 0}
+
+    ranges = []
+    if state.expired_before is not None and state.expired_before < today:
+        ranges.append((db.session.query(*COLUMNS).filter(
+            Drug.expiry_date >= state.expired_before, Drug.expiry_date < today, Drug.quantity > 0
+        ), [Drug.expiry_date, Drug.id], None))
+    changed_after = None
+    if state.changed_through is not None:
+        changed_after = [state.changed_through - timedelta(seconds=lag), 0]
+    ranges.append((db.session.query(*COLUMNS).filter(Drug.updated_at.isnot(None)),
+                   [Drug.updated_at, Drug.id], changed_after))
+
+    for query, sort, after in ranges:
+        for rows in _batches(query, sort, after, batch_size):
+            try:
+                result['messages'] += post_batch(rows, sender, today, now)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            result['checked'] += len(rows)
+            if keep_alive is not None and not keep_alive():
+                log.warning('Lost the %s lease; stopping after %d drugs', JOB_NAME, result['checked'])
+                return result
+
+    state = db.session.get(AlertScanState, JOB_NAME) or AlertScanState(name=JOB_NAME)
+    state.changed_through = now
+    state.expired_before = today
+    db.session.add(state)
+    db.session.commit()
+    return result
+
+
+def job(config):
+    """The scheduler job for ``config`` (the app config)."""
+    def run(keep_alive):
+        return scan(alert_sender(config.get('ALERT_SENDER')),
+                    batch_size=config.get('ALERT_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                    lag=config.get('ALERT_SCAN_LAG', DEFAULT_LAG),
+                    keep_alive=keep_alive)
+    return Job(JOB_NAME, config.get('ALERT_SCAN_INTERVAL', DEFAULT_INTERVAL), run)
@@ -7,12 +7,17 @@ import pytest
 
 import tempfile
 from datetime import datetime, timedelta
+from sqlalchemy import event
 
 
 # Import your app and models
-from app import app as flask_app
+from app import create_app
 from app import db
 from models import User, Drug, Message
+from app import drugs_changed
+import search
+import httpcache
+from identity import user_identities
 
 @pytest.fixture(scope='function')
 def app():
@@ -21,13 +26,16 @@ def app():
     
     db_fd, db_path = tempfile.mkstemp()
     
-    flask_app.config.update({
+    flask_app = create_app({
         'TESTING': True,
         'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
         'SQLALCHEMY_TRACK_MODIFICATIONS': False,
         'WTF_CSRF_ENABLED': False,
         'SECRET_KEY': 'test-secret-key',
-        'DEBUG': True
+        'DEBUG': True,
+        # Cheap, inline hashing keeps fixtures fast
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'PASSWORD_HASH_WORKERS': 0
     })
 
     with flask_app.app_context():
@@ -36,6 +44,8 @@ def app():
     yield flask_app
 
     # Cleanup
+    with flask_app.app_context():
+        db.engine.dispose()
     os.close(db_fd)
     os.unlink(db_path)
 
@@ -44,6 +54,20 @@ def client(app):
     """A test client for the app."""
     return app.test_client()
 
+@pytest.fixture
+def query_counter(app):
+    """Collect every SQL statement executed while the test runs."""
+    statements = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
+
 @pytest.fixture
 def init_database(app):
     """Initialize the database with test data."""
@@ -51,6 +75,12 @@ def init_database(app):
         # Clear any existing data
         db.drop_all()
         db.create_all()
+        search.install(db.session.connection())
+        httpcache.install(db.session.connection())
+        db.session.commit()
+        drugs_changed()
+        httpcache.fragments.clear()
+        user_identities.clear()
         
         # Create test users
         doctor = User(username='doctor1', email='doctor@test.com', role='doctor')
@@ -0,0 +1,89 @@
+import pytest, os
+from datetime import datetime, timedelta
+os.environ['TESTING'] = '1'
+from models import Drug, User, db
+
+def login(client):
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+
+def add_drug(name, days):
+    doctor = User.query.filter_by(username='doctor1').first()
+    db.session.add(Drug(name=name, quantity=20, added_by_id=doctor.id,
+                        expiry_date=datetime.now().date() + timedelta(days=days)))
+    db.session.commit()
+
+def test_expiry_alerts_horizon(client, init_database):
+    """Test that ?days= controls how far ahead alerts look."""
+    add_drug('Soon', 10)
+    add_drug('Later', 60)
+    login(client)
+    
+    names = [a['name'] for a in client.get('/api/expiry_alerts').get_json()]
+    assert names == ['Amoxicillin', 'Soon']
+    
+    alerts = client.get('/api/expiry_alerts?days=90').get_json()
+    assert [a['name'] for a in alerts] == ['Amoxicillin', 'Soon', 'Later']
+    assert alerts[0]['days_until_expiry'] == -1
+    assert alerts[2]['days_until_expiry'] == 60
+
+def test_expiry_alerts_pagination(client, init_database):
+    """Test following the Link header through pages of alerts."""
+    for i in range(5):
+        add_drug(f'Batch {i}', i)
+    login(client)
+    
+    names = []
+    url = '/api/expiry_alerts?per_page=2'
+    while url:
+        response = client.get(url)
+        names.extend(a['name'] for a in response.get_json())
+        link = response.headers.get('Link')
+        url = link[link.index('/api'):link.index('>')] if link else None
+    assert names == ['Amoxicillin'] + [f'Batch {i}' for i in range(5)]
+
+def test_expiry_alerts_conditional_get(client, init_database, query_counter):
+    """Test that an unchanged poll returns 304 without querying drugs."""
+    login(client)
+    response = client.get('/api/expiry_alerts')
+    etag = response.headers['ETag']
+    
+    query_counter.clear()
+    response = client.get('/api/expiry_alerts', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert not any('FROM drug' in statement for statement in query_counter)
+    
+    # Adding a drug through the app changes the tag
+    client.post('/add_drug', data={
+        'name': 'Insulin',
+        'quantity': 5,
+        'expiry_date': (datetime.now().date() + timedelta(days=3)).strftime('%Y-%m-%d')
+    })
+    response = client.get('/api/expiry_alerts', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'Insulin' in [a['name'] for a in response.get_json()]
+
+def test_expiry_alerts_follow_other_writers(client, init_database):
+    """Test that a write the worker was not told about still changes the alerts."""
+    login(client)
+    etag = client.get('/api/expiry_alerts').headers['ETag']
+    
+    # As if another worker had added it: no local invalidation
+    add_drug('Elsewhere', 5)
+    response = client.get('/api/expiry_alerts', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'Elsewhere' in [a['name'] for a in response.get_json()]
+
+def test_expiry_alerts_beyond_window(client, init_database):
+    """Test paging a horizon longer than the precomputed window."""
+    add_drug('Later', 60)
+    add_drug('Much later', 200)
+    login(client)
+    
+    response = client.get('/api/expiry_alerts?days=400&per_page=2')
+    assert [a['name'] for a in response.get_json()] == ['Amoxicillin', 'Later']
+    link = response.headers['Link']
+    response = client.get(link[link.index('/api'):link.index('>')])
+    assert [a['name'] for a in response.get_json()] == ['Much later', 'Paracetamol']
@@ -0,0 +1,69 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+import api
+from app import db
+from models import User
+
+@pytest.fixture
+def token(app, init_database):
+    with app.app_context():
+        token = api.create_token(User.query.filter_by(username='nurse1').one(), 'tests')
+        db.session.commit()
+    return token
+
+def get(client, url, token):
+    return client.get(url, headers={'Authorization': f'Bearer {token}'})
+
+def test_token_auth_without_session(client, token):
+    """Test that a bearer token authenticates without setting a session cookie."""
+    response = get(client, '/api/v1/drugs', token)
+    assert response.status_code == 200
+    assert 'Set-Cookie' not in response.headers
+
+def test_bad_token_rejected(client, token):
+    """Test that an unknown token gets a JSON 401 rather than a login redirect."""
+    response = get(client, '/api/v1/drugs', 'wrong')
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'Authentication required'}
+
+def test_token_only_for_api(client, token):
+    """Test that tokens are not honoured by the HTML pages."""
+    assert get(client, '/drugs', token).status_code == 302
+
+def test_sparse_fields_and_filters(client, token):
+    """Test ?fields= selection and the inventory filters."""
+    response = get(client, '/api/v1/drugs?fields=name,status,expiry_date', token)
+    assert response.get_json()['data'] == [
+        {'name': 'Amoxicillin', 'status': 'expired', 'expiry_date': response.get_json()['data'][0]['expiry_date']},
+        {'name': 'Paracetamol', 'status': 'ok', 'expiry_date': response.get_json()['data'][1]['expiry_date']},
+    ]
+    response = get(client, '/api/v1/drugs?fields=name&status=expired', token)
+    assert response.get_json()['data'] == [{'name': 'Amoxicillin'}]
+
+    response = get(client, '/api/v1/drugs?fields=name,secret', token)
+    assert response.status_code == 400
+    assert 'secret' in response.get_json()['error']
+
+    messages = get(client, '/api/v1/messages?urgent=true&fields=title,sender', token).get_json()['data']
+    assert messages == [{'title': 'Urgent: Low Stock', 'sender': 'doctor1'}]
+    assert get(client, '/api/v1/messages?urgent=maybe', token).status_code == 400
+    assert get(client, '/api/v1/messages?sender_id=abc', token).status_code == 400
+
+def test_cursor_pagination(client, token):
+    """Test that pages follow next_cursor until the last one."""
+    seen = []
+    url = '/api/v1/users?per_page=2&fields=username'
+    while url:
+        body = get(client, url, token).get_json()
+        seen.extend(u['username'] for u in body['data'])
+        url = body['links'].get('next')
+    assert sorted(seen) == ['doctor1', 'nurse1', 'pharmacist1']
+
+def test_detail_endpoints(client, token, app):
+    """Test single-resource endpoints and their 404s."""
+    with app.app_context():
+        nurse_id = User.query.filter_by(username='nurse1').one().id
+    assert get(client, f'/api/v1/users/{nurse_id}', token).get_json()['role'] == 'nurse'
+    response = get(client, '/api/v1/drugs/999', token)
+    assert response.status_code == 404
+    assert response.get_json() == {'error': 'Drug 999 not found'}
@@ -0,0 +1,62 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+import subprocess, sys
+from sqlalchemy import create_engine, inspect
+from app import create_app, dispose_engines, db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_import_has_no_side_effects():
+    """Test that importing the module neither builds an app nor touches the database."""
+    env = dict(os.environ, TESTING='0', DATABASE_URL='postgresql://nobody@127.0.0.1:1/none')
+    result = subprocess.run(
+        [sys.executable, '-c', 'import app; assert not hasattr(app, "app")'],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == ''
+
+def test_create_app_leaves_schema_alone(tmp_path):
+    """Test that building an app and serving a page does not create tables."""
+    url = f'sqlite:///{tmp_path}/empty.db'
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': url})
+    assert app.test_client().get('/login').status_code == 200
+    assert app.config['STARTUP_SECONDS'] > 0
+
+    engine = create_engine(url)
+    assert inspect(engine).get_table_names() == []
+    engine.dispose()
+
+def test_migrate_db_command_builds_schema(tmp_path):
+    """Test that the migrate-db command is how the schema gets created."""
+    url = f'sqlite:///{tmp_path}/cli.db'
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': url})
+    result = app.test_cli_runner().invoke(args=['migrate-db'])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        assert {'user', 'drug', 'message'} <= set(inspect(db.engine).get_table_names())
+        dispose_engines(app)
+
+def test_apps_are_independent(tmp_path):
+    """Test that two apps keep their own configuration and engines."""
+    first = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/a.db'})
+    second = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/b.db'})
+    with first.app_context():
+        first_url = str(db.engine.url)
+    with second.app_context():
+        second_url = str(db.engine.url)
+    assert first_url != second_url
+
+def test_dispose_engines_keeps_app_usable(app, init_database):
+    """Test that a worker can query again after dropping inherited connections."""
+    dispose_engines(app)
+    with app.app_context():
+        assert db.session.execute(db.text('SELECT COUNT(*) FROM drug')).scalar() == 2
+
+def test_cold_start_command(app):
+    """Test that the cold-start command reports each startup phase."""
+    result = app.test_cli_runner().invoke(args=['cold-start', '--runs', '1'])
+    assert result.exit_code == 0, result.output
+    for phase in ('import', 'create_app', 'first_request'):
+        assert phase in result.output
@@ -0,0 +1,49 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+from datetime import datetime, timedelta
+from app import db
+from models import ArchivedMessage, Message, User
+import archive
+
+def add_messages(count, days_old, urgent=False):
+    sender = User.query.filter_by(username='nurse1').one()
+    sent = datetime.utcnow() - timedelta(days=days_old)
+    db.session.add_all([
+        Message(title=f'Old notice {n}', content=f'Fridge {n} defrost schedule', is_urgent=urgent,
+                sender_id=sender.id, timestamp=sent + timedelta(minutes=n))
+        for n in range(count)
+    ])
+    db.session.commit()
+
+def test_archive_moves_old_non_urgent_in_batches(init_database):
+    """Test that old messages move in batches and urgent ones stay live."""
+    add_messages(5, days_old=200)
+    add_messages(1, days_old=200, urgent=True)
+
+    assert archive.archive_messages(retention_days=90, batch_size=2, max_batches=1) == 2
+    assert archive.archive_messages(retention_days=90, batch_size=2) == 3
+    assert archive.archive_messages(retention_days=90, batch_size=2) == 0
+
+    assert ArchivedMessage.query.count() == 5
+    live = sorted(m.title for m in Message.query)
+    assert live == ['Meeting Reminder', 'Old notice 0', 'Urgent: Low Stock']
+    archived = ArchivedMessage.query.order_by(ArchivedMessage.timestamp).first()
+    assert (archived.title, archived.content) == ('Old notice 0', 'Fridge 0 defrost schedule')
+
+def test_archive_search_page(client, init_database):
+    """Test searching the archive by text and sender, with cursor paging."""
+    add_messages(3, days_old=200)
+    archive.archive_messages(retention_days=90)
+    client.post('/login', data={'username': 'doctor1', 'password': 'Doctor123!'}, follow_redirects=True)
+
+    response = client.get('/messages/archive?q=FRIDGE 1')
+    assert b'Old notice 1' in response.data
+    assert b'Old notice 2' not in response.data
+
+    response = client.get('/messages/archive?sender=doctor1')
+    assert b'No Archived Messages' in response.data
+
+    response = client.get('/messages/archive?per_page=2')
+    assert b'Old notice 2' in response.data and b'Old notice 0' not in response.data
+    assert b'Older Messages' in response.data
+    assert b'Old notice 0' not in client.get('/messages').data
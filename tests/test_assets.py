@@ -0,0 +1,47 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+import gzip
+import re
+import assets
+
+def stylesheet_url(client):
+    page = client.get('/login').data.decode()
+    return re.search(r'href="(/static/style\.[0-9a-f]{12}\.css)"', page).group(1)
+
+def test_pages_link_fingerprinted_assets(client):
+    """Test that url_for('static') points at the content-hashed file."""
+    with open(os.path.join(client.application.static_folder, 'style.css'), 'rb') as f:
+        expected = assets.fingerprint('style.css', f.read())
+    assert stylesheet_url(client) == f'/static/{expected}'
+
+def test_fingerprinted_assets_are_immutable(client):
+    """Test caching headers, precompressed variants and revalidation."""
+    url = stylesheet_url(client)
+    response = client.get(url)
+    assert response.headers['Cache-Control'] == assets.CACHE_CONTROL
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Content-Type'] == 'text/css; charset=utf-8'
+
+    compressed = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == response.data
+
+    revalidated = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    # The plain name is still served by Flask
+    assert client.get('/static/style.css').data == response.data
+
+def test_build_is_incremental(tmp_path):
+    """Test that rebuilding only adds files for changed content."""
+    source = tmp_path / 'static'
+    (source / 'js').mkdir(parents=True)
+    (source / 'js' / 'app.js').write_text('console.log(1);')
+    target = tmp_path / 'build'
+
+    first = assets.build(str(source), str(target))
+    assert assets.build(str(source), str(target)) == first
+    (source / 'js' / 'app.js').write_text('console.log(2);')
+    second = assets.build(str(source), str(target))
+    assert second['js/app.js'] != first['js/app.js']
+    assert (target / first['js/app.js']).exists()
+    assert (target / (second['js/app.js'] + '.gz')).exists()
@@ -1,6 +1,12 @@
 import pytest,os
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
 os.environ['TESTING'] = '1'
-from models import User,db
+from models import User, Message, db
+from app import load_user
+from werkzeug.security import generate_password_hash
+from passwords import needs_rehash
+import passwords
 
 def test_user_creation(client, init_database):
     """Test user creation and password hashing."""
@@ -57,4 +63,99 @@ def test_password_validation():
     # Test short password
     is_valid, message = User.validate_password_strength('Test1!')
     assert is_valid == False
-    assert '8 characters' in message
\ No newline at end of file
+    assert '8 characters' in message
+
+def test_load_user_uses_identity_cache(app, init_database, query_counter):
+    """Test that repeat lookups identify the user without a database query."""
+    user = User.query.filter_by(username='doctor1').first()
+    load_user(str(user.id))
+    
+    query_counter.clear()
+    cached = load_user(str(user.id))
+    assert cached.id == user.id
+    assert cached.username == 'doctor1'
+    assert cached.role == 'doctor'
+    assert cached.is_authenticated
+    assert query_counter == []
+
+def test_identity_cache_invalidated_on_role_change(app, init_database):
+    """Test that changing a user's role is reflected on the next lookup."""
+    nurse = User.query.filter_by(username='nurse1').first()
+    message = Message.query.filter_by(title='Urgent: Low Stock').first()
+    assert not message.can_delete(load_user(str(nurse.id)))
+    
+    nurse.role = 'pharmacist'
+    db.session.commit()
+    
+    cached = load_user(str(nurse.id))
+    assert cached.role == 'pharmacist'
+    assert message.can_delete(cached)
+
+def test_identity_cache_evicts_on_commit(app, init_database):
+    """Test that a role change is only evicted from the cache once it commits."""
+    nurse = User.query.filter_by(username='nurse1').first()
+    load_user(str(nurse.id))
+    
+    nurse.role = 'pharmacist'
+    db.session.flush()
+    # Other requests cannot see the flushed row yet, so the cached one stays
+    assert load_user(str(nurse.id)).role == 'nurse'
+    db.session.rollback()
+    assert load_user(str(nurse.id)).role == 'nurse'
+    
+    nurse.role = 'pharmacist'
+    db.session.commit()
+    assert load_user(str(nurse.id)).role == 'pharmacist'
+
+def test_login_rehashes_outdated_password(client, app, init_database):
+    """Test that logging in upgrades a hash made with old parameters."""
+    user = User.query.filter_by(username='doctor1').first()
+    user.password_hash = generate_password_hash('Doctor123!', method='pbkdf2:sha256:500')
+    db.session.commit()
+    assert needs_rehash(user.password_hash)
+    
+    response = client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    assert response.status_code == 302
+    assert 'pwhash;dur=' in response.headers['Server-Timing']
+    
+    user = User.query.filter_by(username='doctor1').first()
+    assert user.password_hash.startswith(app.config['PASSWORD_HASH_METHOD'] + '$')
+    assert not needs_rehash(user.password_hash)
+    assert user.check_password('Doctor123!')
+
+def test_password_hashing_in_process_pool(app, init_database, monkeypatch):
+    """Test hashing and verifying through the process pool."""
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 1)
+    try:
+        user = User.query.filter_by(username='nurse1').first()
+        user.set_password('Changed123!')
+        assert user.check_password('Changed123!')
+        assert not user.check_password('Nurse123!')
+    finally:
+        passwords.pool.shutdown()
+
+def test_timed_out_hash_keeps_its_slot(app, init_database, monkeypatch):
+    """Test that a hash that timed out still holds its queue slot until it finishes."""
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 1)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_TIMEOUT', 0.05)
+    pool = passwords.HashingPool()
+    executor = ThreadPoolExecutor(max_workers=1)
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(pool, '_get', lambda workers: (executor, slots))
+    
+    def slow():
+        time.sleep(0.3)
+        return 'done', 0.3
+    
+    try:
+        with pytest.raises(passwords.HashingUnavailable, match='timed out'):
+            pool.run(slow)
+        with pytest.raises(passwords.HashingUnavailable, match='busy'):
+            pool.run(lambda: ('fast', 0.0))
+        time.sleep(0.4)
+        assert pool.run(lambda: ('fast', 0.0)) == 'fast'
+    finally:
+        executor.shutdown()
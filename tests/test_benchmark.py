@@ -0,0 +1,70 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+import copy
+from sqlalchemy import create_engine
+import benchmark
+from app import create_app, db
+from models import Drug
+
+@pytest.fixture
+def bench_app(tmp_path):
+    """A small seeded database driven with cheap password hashing."""
+    url = f'sqlite:///{tmp_path}/bench.db'
+    engine = create_engine(url)
+    benchmark.seed(engine, users=6, drugs=120, messages=150, log=lambda msg: None,
+                   password_method='pbkdf2:sha256:1000')
+    engine.dispose()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': url, 'SECRET_KEY': 'bench',
+                      'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000', 'PASSWORD_HASH_WORKERS': 0})
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+def test_scenarios_cover_every_route(app):
+    """Test that every registered endpoint is benchmarked or explicitly skipped."""
+    assert benchmark.uncovered_endpoints(app) == set()
+
+def test_seed_volumes(bench_app):
+    """Test that seeding inserts the requested volumes."""
+    with bench_app.app_context():
+        assert benchmark.volumes() == {'users': 6, 'drugs': 120, 'messages': 150}
+
+def test_run_records_every_scenario(bench_app):
+    """Test a short run: every scenario succeeds, queries are counted and volumes are restored."""
+    with bench_app.app_context():
+        stock = dict(db.session.query(Drug.id, Drug.quantity))
+    result = benchmark.run(bench_app, iterations=2, concurrency=2, requests_per_worker=3,
+                           log=lambda msg: None)
+
+    assert set(result['routes']) == {s.name for s in benchmark.SCENARIOS}
+    for name, stats in result['routes'].items():
+        assert stats['errors'] == 0, name
+        assert stats['p50_ms'] <= stats['p95_ms'] <= stats['p99_ms']
+    assert result['routes']['drugs']['max_queries'] >= 1
+    assert result['load']['requests'] == 6
+    assert result['load']['errors'] == 0
+    assert result['peak_rss_mb'] > 0
+
+    with bench_app.app_context():
+        assert benchmark.volumes() == result['meta']['volumes']
+        # Dispensed and received stock is put back
+        assert dict(db.session.query(Drug.id, Drug.quantity)) == stock
+    assert benchmark.compare(result, result) == []
+
+def test_compare_flags_regressions():
+    """Test that extra queries, slower percentiles and lower throughput are reported."""
+    route = {'p50_ms': 5.0, 'p95_ms': 10.0, 'p99_ms': 12.0, 'mean_ms': 6.0,
+             'errors': 0, 'queries_per_request': 2.0, 'max_queries': 2}
+    baseline = {'meta': {'volumes': {'drugs': 10}}, 'routes': {'drugs': route},
+                'load': {'p95_ms': 10.0, 'rps': 100.0, 'errors': 0}, 'peak_rss_mb': 100.0}
+
+    current = copy.deepcopy(baseline)
+    current['routes']['drugs']['p95_ms'] = 12.0
+    assert benchmark.compare(baseline, current) == []
+
+    current['routes']['drugs'].update(max_queries=3, p95_ms=30.0)
+    current['load']['rps'] = 50.0
+    problems = benchmark.compare(baseline, current)
+    assert any('queries per request' in p for p in problems)
+    assert any('p95_ms' in p for p in problems)
+    assert any('req/s' in p for p in problems)
@@ -0,0 +1,44 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+import gzip
+import compress
+
+def login(client):
+    client.post('/login', data={'username': 'doctor1', 'password': 'Doctor123!'}, follow_redirects=True)
+
+def test_large_html_is_gzipped(client, init_database):
+    """Test that a page above the threshold is gzipped for clients that accept it."""
+    login(client)
+    plain = client.get('/drugs')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    response = client.get('/drugs', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(response.data) < len(plain.data)
+    assert gzip.decompress(response.data) == plain.data
+
+def test_small_responses_untouched(client, init_database):
+    """Test that bodies under the threshold are sent uncompressed."""
+    login(client)
+    response = client.get('/api/expiry_alerts', headers={'Accept-Encoding': 'gzip'})
+    assert len(response.data) < compress.DEFAULT_MIN_SIZE
+    assert 'Content-Encoding' not in response.headers
+
+def test_etag_survives_compression(client, init_database):
+    """Test that a gzipped page's weak ETag still earns a 304."""
+    login(client)
+    headers = {'Accept-Encoding': 'gzip'}
+    response = client.get('/drugs', headers=headers)
+    etag, weak = response.get_etag()
+    assert weak
+    response = client.get('/drugs', headers={**headers, 'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+def test_brotli_preferred(client, init_database):
+    """Test that brotli wins when installed and accepted."""
+    brotli = pytest.importorskip('brotli')
+    login(client)
+    response = client.get('/drugs', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert b'Drug Inventory' in brotli.decompress(response.data)
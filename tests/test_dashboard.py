@@ -0,0 +1,52 @@
+import pytest, os
+from datetime import datetime, timedelta
+os.environ['TESTING'] = '1'
+from models import Drug, db
+from counters import compute_drug_stats, drug_stats
+
+def test_drug_stats_single_query(app, init_database, query_counter):
+    """Test that all dashboard counters come from one aggregate query."""
+    stats = compute_drug_stats(datetime.now().date())
+    assert stats == {'total_drugs': 2, 'expired_drugs': 1, 'low_stock': 1}
+    assert len(query_counter) == 1
+
+def test_drug_stats_cache_invalidation(client, init_database, query_counter):
+    """Test that cached counters are reused until a drug changes."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    
+    assert drug_stats.get()['total_drugs'] == 2
+    query_counter.clear()
+    assert drug_stats.get()['total_drugs'] == 2
+    assert len(query_counter) == 0
+    
+    client.post('/add_drug', data={
+        'name': 'Ibuprofen',
+        'quantity': 3,
+        'expiry_date': (datetime.now().date() + timedelta(days=30)).strftime('%Y-%m-%d')
+    })
+    stats = drug_stats.get()
+    assert stats['total_drugs'] == 3
+    assert stats['low_stock'] == 2
+
+def test_drug_stats_date_rollover(app, init_database):
+    """Test that the expired count is recomputed when the date changes."""
+    today = datetime.now().date()
+    assert drug_stats.get(today)['expired_drugs'] == 1
+    
+    # Paracetamol expires in a year; a year and a day later it is expired too
+    assert drug_stats.get(today + timedelta(days=366))['expired_drugs'] == 2
+
+def test_dashboard_page(client, init_database):
+    """Test the dashboard renders the inventory counters."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    
+    response = client.get('/dashboard')
+    assert response.status_code == 200
+    assert b'Expired Drugs' in response.data
+    assert b'Urgent: Low Stock' in response.data
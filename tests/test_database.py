@@ -0,0 +1,139 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+from datetime import datetime, timedelta
+from flask import g
+from sqlalchemy.exc import OperationalError
+import database
+from app import create_app, db
+from models import User, Drug
+
+def seed(engine, drug_name):
+    """Create the schema on ``engine`` with one user and one drug."""
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), {
+            'id': 1, 'username': 'doctor1', 'email': 'doctor@test.com', 'role': 'doctor',
+            'password_hash': 'x', 'created_at': datetime.utcnow()
+        })
+        conn.execute(Drug.__table__.insert(), {
+            'name': drug_name, 'quantity': 100, 'price': 1.0, 'batch_number': drug_name.upper(),
+            'expiry_date': datetime.now().date() + timedelta(days=365), 'added_by_id': 1
+        })
+
+@pytest.fixture
+def replica_app(tmp_path):
+    """An app whose primary and replica are separate SQLite files with different drugs."""
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test-secret-key',
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/primary.db',
+        'SQLALCHEMY_REPLICA_URI': f'sqlite:///{tmp_path}/replica.db',
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'PASSWORD_HASH_WORKERS': 0,
+    })
+    with app.app_context():
+        seed(db.engine, 'Primarycillin')
+        seed(database.replica_engine(), 'Replicamol')
+        user = db.session.get(User, 1)
+        user.set_password('Doctor123!')
+        db.session.commit()
+    yield app
+    with app.app_context():
+        for engine in database.all_engines(db):
+            engine.dispose()
+
+def login(client):
+    client.post('/login', data={'username': 'doctor1', 'password': 'Doctor123!'})
+
+def test_read_views_use_replica(replica_app):
+    """Test that the drugs page and expiry API read from the replica."""
+    client = replica_app.test_client()
+    login(client)
+
+    page = client.get('/drugs').data
+    assert b'Replicamol' in page
+    assert b'Primarycillin' not in page
+    alerts = client.get('/api/expiry_alerts?days=400').get_json()
+    assert [a['name'] for a in alerts] == ['Replicamol']
+
+def test_writes_pin_to_primary(replica_app):
+    """Test that a write goes to the primary and the next read follows it there."""
+    client = replica_app.test_client()
+    login(client)
+
+    response = client.post('/add_drug', data={
+        'name': 'Ibuprofen', 'quantity': 50, 'price': 8.75,
+        'expiry_date': (datetime.now().date() + timedelta(days=180)).strftime('%Y-%m-%d'),
+        'batch_number': 'BATCH003', 'supplier': 'Health Plus'
+    }, follow_redirects=True)
+    assert b'Ibuprofen' in response.data
+    assert b'Primarycillin' in response.data
+
+    with replica_app.app_context():
+        assert db.session.query(Drug.id).filter_by(name='Ibuprofen').count() == 1
+        with database.replica_engine().connect() as conn:
+            assert conn.exec_driver_sql(
+                "SELECT COUNT(*) FROM drug WHERE name = 'Ibuprofen'").scalar() == 0
+
+def test_replica_resumes_after_window(replica_app, monkeypatch):
+    """Test that reads go back to the replica once the read-after-write window is off."""
+    monkeypatch.setitem(replica_app.config, 'REPLICA_READ_AFTER_WRITE', 0)
+    client = replica_app.test_client()
+    login(client)
+    client.post('/add_drug', data={
+        'name': 'Ibuprofen', 'quantity': 50, 'price': 8.75,
+        'expiry_date': (datetime.now().date() + timedelta(days=180)).strftime('%Y-%m-%d'),
+        'batch_number': 'BATCH003', 'supplier': 'Health Plus'
+    })
+    assert b'Replicamol' in client.get('/drugs').data
+
+def test_raw_sql_goes_to_primary(replica_app):
+    """Test that text() and bare connections count as writes unless marked read-only."""
+    query = "SELECT name FROM drug"
+    with replica_app.test_request_context():
+        g.replica_reads = True
+        marked = db.text(query).execution_options(read_only=True)
+        assert db.session.execute(marked).scalar() == 'Replicamol'
+        assert db.session.connection(bind_arguments={'read_only': True}).engine is database.replica_engine()
+        assert not g.get('primary_pinned')
+        
+        db.session.execute(db.text("UPDATE drug SET quantity = 7"))
+        assert g.primary_pinned
+        assert db.session.execute(marked).scalar() == 'Primarycillin'
+        db.session.commit()
+    
+    with replica_app.test_request_context():
+        g.replica_reads = True
+        assert db.session.connection().engine is db.engine
+        assert g.primary_pinned
+    
+    with replica_app.app_context():
+        assert db.session.query(Drug.quantity).scalar() == 7
+        with database.replica_engine().connect() as conn:
+            assert conn.exec_driver_sql("SELECT quantity FROM drug").scalar() == 100
+
+def test_engine_options():
+    """Test pool and timeout settings for server databases and SQLite."""
+    config = {'DB_POOL_SIZE': 7, 'DB_MAX_OVERFLOW': 3, 'DB_STATEMENT_TIMEOUT': 1500}
+    options = database.engine_options('postgresql+psycopg2://u@h/db', config)
+    assert options['pool_size'] == 7
+    assert options['max_overflow'] == 3
+    assert options['pool_pre_ping'] is True
+    assert options['connect_args'] == {'options': '-c statement_timeout=1500'}
+
+    options = database.engine_options('sqlite:///:memory:', config)
+    assert 'pool_size' not in options
+    assert 'connect_args' not in options
+
+def test_sqlite_statement_timeout(tmp_path):
+    """Test that a runaway SQLite statement is interrupted."""
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/slow.db',
+                      'DB_STATEMENT_TIMEOUT': 50})
+    runaway = ('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) '
+               'SELECT COUNT(*) FROM n')
+    with app.app_context():
+        with pytest.raises(OperationalError, match='interrupted'):
+            db.session.execute(db.text(runaway))
+        db.session.rollback()
+        assert db.session.execute(db.text('SELECT 1')).scalar() == 1
+        db.engine.dispose()
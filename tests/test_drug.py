@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 os.environ['TESTING'] = '1'
 from app import db
 from models import Drug
+from pagination import encode_cursor
 
 def test_drugs_page_requires_login(client, init_database):
     """Test that drugs page requires authentication."""
@@ -67,4 +68,76 @@ def test_drug_low_stock_detection(app, init_database):
         
         # Amoxicillin has quantity 5, which is low stock
         assert low_stock_drug.quantity < 10
-        assert adequate_stock_drug.quantity >= 10
\ No newline at end of file
+        assert adequate_stock_drug.quantity >= 10
+
+def test_drugs_page_status_filter(client, init_database):
+    """Test filtering the inventory by status computed in SQL."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    
+    response = client.get('/drugs?status=expired')
+    assert response.status_code == 200
+    assert b'Amoxicillin' in response.data
+    assert b'Paracetamol' not in response.data
+    assert b'EXPIRED' in response.data
+    
+    response = client.get('/drugs?supplier=Pharma+Corp')
+    assert b'Paracetamol' in response.data
+    assert b'Amoxicillin' not in response.data
+
+def test_drugs_page_keyset_pagination(client, app, init_database):
+    """Test walking the inventory one page at a time with the next cursor."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    
+    # Amoxicillin sorts before Paracetamol, so each lands on its own page
+    response = client.get('/drugs?per_page=1')
+    assert b'Amoxicillin' in response.data
+    assert b'Paracetamol' not in response.data
+    assert b'Next Page' in response.data
+    
+    with app.app_context():
+        drug = Drug.query.filter_by(name='Amoxicillin').first()
+        cursor = encode_cursor([drug.name, drug.id])
+    
+    response = client.get(f'/drugs?per_page=1&after={cursor}')
+    assert b'Paracetamol' in response.data
+    assert b'Amoxicillin' not in response.data
+    assert b'Next Page' not in response.data
+
+def test_bulk_update_and_delete(client, app, init_database):
+    """Test bulk price/supplier updates and deletes as single statements."""
+    client.post('/login', data={'username': 'pharmacist1', 'password': 'Pharmacist123!'})
+    with app.app_context():
+        ids = [d.id for d in Drug.query.order_by(Drug.id)]
+        versions = [d.version for d in Drug.query.order_by(Drug.id)]
+
+    response = client.post('/drugs/bulk', json={'action': 'update', 'ids': ids, 'supplier': 'Acme'})
+    assert response.get_json() == {'updated': 2}
+    with app.app_context():
+        drugs = Drug.query.order_by(Drug.id).all()
+        assert [d.supplier for d in drugs] == ['Acme', 'Acme']
+        assert [d.version for d in drugs] == [v + 1 for v in versions]
+    assert client.post('/drugs/bulk', json={'action': 'update', 'ids': ids}).status_code == 422
+    for price in ('nan', 'inf', '-1'):
+        assert client.post('/drugs/bulk', json={'action': 'update', 'ids': ids, 'price': price}).status_code == 422
+    for bad in ({'supplier': 5}, {'supplier': ['Acme']}, {'price': True}, {'price': [1]}):
+        assert client.post('/drugs/bulk', json={'action': 'update', 'ids': ids, **bad}).status_code == 422
+    # A string must not be read as a list of one-digit ids
+    for bad_ids in (''.join(map(str, ids)), [True], [str(ids[0])], [1.5]):
+        response = client.post('/drugs/bulk', json={'action': 'delete', 'ids': bad_ids})
+        assert response.status_code == 422
+    with app.app_context():
+        assert Drug.query.count() == 2
+
+    response = client.post('/drugs/bulk', data={'action': 'delete_expired'}, follow_redirects=True)
+    assert b'1 drug(s) deleted.' in response.data
+    assert b'Amoxicillin' not in response.data
+
+    response = client.post('/drugs/bulk', data={'action': 'delete', 'ids': [str(i) for i in ids]})
+    with app.app_context():
+        assert Drug.query.count() == 0
@@ -0,0 +1,100 @@
+import pytest, os, json, time
+os.environ['TESTING'] = '1'
+from models import Message, User, db
+import events
+
+@pytest.fixture
+def hub(app):
+    """A fresh hub with a fast polling listener."""
+    app.config['MESSAGE_POLL_INTERVAL'] = 0.05
+    hub = events.MessageHub()
+    yield hub
+    hub.stop()
+
+def test_hub_fans_out_to_every_subscriber(app, hub):
+    """Test that one published event reaches every subscriber once."""
+    first = hub.subscribe(app)
+    second = hub.subscribe(app)
+    event = events.message_event(1, 'Hello', True, None, 'doctor1', 'doctor')
+    hub.publish(event)
+    
+    assert first.get(timeout=1) == event
+    assert second.get(timeout=1) == event
+    assert first.queue.empty()
+    
+    hub.unsubscribe(second)
+    assert hub.subscriber_count == 1
+
+def test_polling_listener_picks_up_messages_from_other_workers(app, init_database, hub):
+    """Test that a message written straight to the database is pushed."""
+    subscriber = hub.subscribe(app)
+    time.sleep(0.1)
+    
+    nurse = User.query.filter_by(username='nurse1').first()
+    db.session.add(Message(title='Code Blue', content='Ward 3', is_urgent=True, sender_id=nurse.id))
+    db.session.commit()
+    
+    event = subscriber.get(timeout=2)
+    assert event['title'] == 'Code Blue'
+    assert event['is_urgent'] is True
+    assert event['sender'] == 'nurse1'
+
+def test_message_stream_replays_after_last_event_id(client, init_database):
+    """Test that reconnecting with Last-Event-ID replays missed messages."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    
+    response = client.get('/events/messages', headers={'Last-Event-ID': '0'})
+    assert response.mimetype == 'text/event-stream'
+    body = response.response
+    assert next(body) == b'retry: 5000\n\n'
+    
+    first = next(body).decode()
+    assert first.startswith('id: 1\nevent: urgent\n')
+    assert json.loads(first.split('data: ')[1])['title'] == 'Urgent: Low Stock'
+    second = next(body).decode()
+    assert second.startswith('id: 2\nevent: message\n')
+    response.close()
+    events.hub.stop()
+
+def test_pages_poll_unless_streaming(app, client, init_database):
+    """Test that pages only open the message stream when MESSAGE_EVENTS is 'stream'."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    
+    page = client.get('/dashboard').get_data(as_text=True)
+    assert '/events/messages/poll' in page
+    assert 'EventSource(' not in page
+    
+    app.config['MESSAGE_EVENTS'] = 'stream'
+    page = client.get('/dashboard').get_data(as_text=True)
+    assert 'EventSource(' in page
+    assert '/events/messages/poll' not in page
+
+def test_message_poll(client, init_database):
+    """Test that polling starts at the newest message and then returns newer ones."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    # Shows the login flash, which would otherwise rule out a 304
+    client.get('/dashboard')
+    
+    first = client.get('/events/messages/poll').get_json()
+    assert first == {'events': [], 'last_id': 2}
+    
+    response = client.get('/events/messages/poll?after=2')
+    assert response.get_json() == {'events': [], 'last_id': 2}
+    response = client.get('/events/messages/poll?after=2', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    
+    nurse = User.query.filter_by(username='nurse1').first()
+    db.session.add(Message(title='Code Blue', content='Ward 3', is_urgent=True, sender_id=nurse.id))
+    db.session.commit()
+    body = client.get('/events/messages/poll?after=2').get_json()
+    assert [event['title'] for event in body['events']] == ['Code Blue']
+    assert body['last_id'] == 3
@@ -0,0 +1,52 @@
+import pytest, os, csv, io, json
+os.environ['TESTING'] = '1'
+import exporter
+
+def test_export_drugs_csv_with_filters(client, init_database):
+    """Test streaming the inventory as CSV with the listing filters applied."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    
+    response = client.get('/export/drugs')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [row['name'] for row in rows] == ['Amoxicillin', 'Paracetamol']
+    assert rows[0]['status'] == 'expired'
+    
+    response = client.get('/export/drugs?status=expired')
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [row['name'] for row in rows] == ['Amoxicillin']
+
+def test_export_messages_ndjson(client, init_database):
+    """Test streaming messages as NDJSON with sender details."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    
+    response = client.get('/export/messages?format=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [r['title'] for r in records] == ['Meeting Reminder', 'Urgent: Low Stock']
+    assert records[1]['sender'] == 'doctor1'
+    assert records[1]['is_urgent'] is True
+
+def test_export_rejects_unknown_format(client, init_database):
+    """Test that unsupported export formats are rejected."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    assert client.get('/export/drugs?format=xml').status_code == 400
+
+def test_stream_rows_yields_in_chunks(app, init_database):
+    """Test that rows are emitted in chunks rather than one string."""
+    query = exporter.message_export_query()
+    chunks = list(exporter.stream_rows(query, 'csv', chunk_rows=1))
+    # header + one chunk per message
+    assert len(chunks) == 3
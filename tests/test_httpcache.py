@@ -0,0 +1,85 @@
+import pytest, os
+from datetime import datetime, timedelta
+from flask import g
+from sqlalchemy import insert
+os.environ['TESTING'] = '1'
+from models import Drug, User, db
+import httpcache
+
+def login(client):
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    # Consume the "Login successful" flash so pages become cacheable
+    client.get('/dashboard')
+
+def test_table_versions_bumped_by_triggers(app, init_database):
+    """Test that ORM and Core writes both bump the table counter."""
+    before = httpcache.table_versions()['drug'][0]
+    doctor = User.query.filter_by(username='doctor1').first()
+    db.session.execute(insert(Drug.__table__), [{
+        'name': 'Bulk', 'quantity': 1, 'added_by_id': doctor.id,
+        'expiry_date': datetime.now().date()
+    }])
+    db.session.commit()
+    
+    g.pop('table_versions', None)
+    assert httpcache.table_versions()['drug'][0] > before
+
+@pytest.mark.parametrize('url', ['/drugs', '/messages', '/dashboard'])
+def test_unchanged_page_returns_304(client, init_database, query_counter, url):
+    """Test that a repeat GET with the ETag is answered with 304 and no ORM loading."""
+    login(client)
+    # The first visit to /messages moves the read mark, which changes the page
+    client.get(url)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['Last-Modified']
+    etag = response.headers['ETag']
+    
+    query_counter.clear()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    # Only the version stamp, and for message pages the viewer's read mark, are read
+    assert 'table_versions' in query_counter[0]
+    assert len(query_counter) == (1 if url == '/drugs' else 2)
+    assert all('message_read_mark' in q for q in query_counter[1:])
+
+def test_etag_changes_after_write(client, init_database):
+    """Test that editing a drug invalidates the inventory ETag and fragment."""
+    login(client)
+    etag = client.get('/drugs').headers['ETag']
+    
+    drug = Drug.query.filter_by(name='Paracetamol').first()
+    client.post(f'/edit_drug/{drug.id}', data={
+        'name': 'Paracetamol 500mg',
+        'quantity': 100,
+        'expiry_date': drug.expiry_date.strftime('%Y-%m-%d')
+    })
+    client.get('/drugs')  # consumes the "updated" flash
+    
+    response = client.get('/drugs', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Paracetamol 500mg' in response.data
+
+def test_fragment_cache_skips_queries(client, init_database, query_counter):
+    """Test that a repeat render reuses the cached table fragment."""
+    login(client)
+    client.get('/drugs')
+    
+    query_counter.clear()
+    response = client.get('/drugs')
+    assert response.status_code == 200
+    assert b'Paracetamol' in response.data
+    assert not any('FROM drug' in statement for statement in query_counter)
+
+def test_flash_messages_bypass_conditional_get(client, init_database):
+    """Test that a page carrying a flash message is never answered with 304."""
+    login(client)
+    etag = client.get('/messages').headers['ETag']
+    client.post('/add_message', data={'title': 'Hi', 'content': 'There'})
+    response = client.get('/messages', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Message sent successfully' in response.data
@@ -0,0 +1,79 @@
+import pytest, os, io, json
+from datetime import datetime, timedelta
+os.environ['TESTING'] = '1'
+from models import Drug, User, db
+import importer
+
+EXPIRY = (datetime.now().date() + timedelta(days=90)).strftime('%Y-%m-%d')
+
+def test_import_csv_upload_reports_bad_rows(client, init_database):
+    """Test that valid CSV rows are imported and bad rows are reported by line."""
+    client.post('/login', data={
+        'username': 'pharmacist1',
+        'password': 'Pharmacist123!'
+    })
+    
+    csv_data = (
+        'name,description,quantity,price,expiry_date,batch_number,supplier\n'
+        f'Ibuprofen,Anti-inflammatory,50,8.75,{EXPIRY},B100,Health Plus\n'
+        f'Cetirizine,,abc,,{EXPIRY},B101,\n'
+        'Aspirin,,20,,not-a-date,B102,\n'
+        f'Loratadine,,30,,{EXPIRY},B103,Health Plus\n'
+    )
+    response = client.post('/import_drugs', data={
+        'file': (io.BytesIO(csv_data.encode('utf-8')), 'shipment.csv')
+    }, content_type='multipart/form-data', headers={'Accept': 'application/json'})
+    
+    report = response.get_json()
+    assert report['inserted'] == 2
+    assert [e['line'] for e in report['errors']] == [3, 4]
+    assert 'quantity' in report['errors'][0]['error']
+    
+    drug = Drug.query.filter_by(name='Ibuprofen').first()
+    assert drug.quantity == 50
+    assert drug.added_by.username == 'pharmacist1'
+    assert Drug.query.filter_by(name='Cetirizine').first() is None
+
+def test_import_ndjson_in_batches(app, init_database, query_counter):
+    """Test that NDJSON rows are inserted with one statement per batch."""
+    lines = [json.dumps({'name': f'Drug {i}', 'quantity': i, 'expiry_date': EXPIRY}) for i in range(25)]
+    lines.insert(3, '{not json')
+    stream = io.BytesIO('\n'.join(lines).encode('utf-8'))
+    user = User.query.filter_by(username='doctor1').first()
+    
+    query_counter.clear()
+    report = importer.import_drugs(stream, 'ndjson', user.id, batch_size=10)
+    
+    assert report.inserted == 25
+    assert [e['line'] for e in report.errors] == [4]
+    inserts = [s for s in query_counter if s.startswith('INSERT INTO drug')]
+    assert len(inserts) == 3
+    assert Drug.query.count() == 27
+
+def test_import_ndjson_reports_wrong_types(app, init_database):
+    """Test that non-text fields are reported per row instead of aborting the import."""
+    rows = [
+        {'name': 'Before', 'quantity': 1, 'expiry_date': EXPIRY},
+        {'name': ['x'], 'quantity': 1, 'expiry_date': EXPIRY},
+        {'name': 'Odd', 'quantity': 1, 'expiry_date': EXPIRY, 'supplier': {'id': 1}},
+        {'name': 'Late', 'quantity': [1], 'expiry_date': EXPIRY},
+        {'name': 'After', 'quantity': 1, 'expiry_date': EXPIRY},
+    ]
+    stream = io.BytesIO('\n'.join(json.dumps(row) for row in rows).encode('utf-8'))
+    user = User.query.filter_by(username='doctor1').first()
+    
+    report = importer.import_drugs(stream, 'ndjson', user.id)
+    assert report.inserted == 2
+    assert [e['line'] for e in report.errors] == [2, 3, 4]
+    assert 'name' in report.errors[0]['error']
+    assert 'supplier' in report.errors[1]['error']
+
+def test_import_drugs_cli(app, init_database, tmp_path):
+    """Test the import-drugs CLI command."""
+    path = tmp_path / 'drugs.csv'
+    path.write_text(f'name,quantity,expiry_date\nMetformin,40,{EXPIRY}\n')
+    
+    result = app.test_cli_runner().invoke(args=['import-drugs', str(path), '--user', 'doctor1'])
+    assert result.exit_code == 0, result.output
+    assert 'Imported 1 drug(s)' in result.output
+    assert Drug.query.filter_by(name='Metformin').first() is not None
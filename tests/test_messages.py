@@ -58,4 +58,87 @@ def test_message_can_delete_logic(client, init_database):
     assert message.can_delete(pharmacist) == True
     
     # Other users should not be able to delete
-    assert message.can_delete(other_user) == False
\ No newline at end of file
+    assert message.can_delete(other_user) == False
+
+def test_messages_page_query_count_is_constant(client, app, init_database, query_counter, monkeypatch):
+    """Test that senders are eager-loaded instead of one query per sender."""
+    # Measure the real query, not a cached fragment
+    monkeypatch.setitem(app.config, 'FRAGMENT_CACHE_SIZE', 0)
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    
+    client.get('/messages')
+    query_counter.clear()
+    client.get('/messages')
+    baseline = len(query_counter)
+    
+    with app.app_context():
+        for i in range(20):
+            user = User(username=f'sender{i}', email=f'sender{i}@test.com', role='nurse')
+            user.password_hash = 'x'
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Message(title=f'Note {i}', content='Hello', sender_id=user.id))
+        db.session.commit()
+    
+    query_counter.clear()
+    response = client.get('/messages')
+    assert b'sender19' in response.data
+    # Less the one-off raise of the read mark over the new messages
+    assert len([q for q in query_counter if not q.startswith('UPDATE message_read_mark')]) == baseline
+
+def test_messages_page_cursor(client, init_database):
+    """Test paging through messages newest first."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    
+    response = client.get('/messages?per_page=1')
+    assert b'Meeting Reminder' in response.data
+    assert b'Urgent: Low Stock' not in response.data
+    assert b'Older Messages' in response.data
+
+def test_bulk_delete_enforces_can_delete(client, init_database):
+    """Test that bulk delete removes only the selected messages the user may delete."""
+    client.post('/login', data={'username': 'doctor1', 'password': 'Doctor123!'})
+    ids = [m.id for m in Message.query.order_by(Message.id)]
+
+    # A string must not be read as a list of one-digit ids
+    for bad_ids in (''.join(map(str, ids)), [True, True], [str(ids[0])]):
+        assert client.post('/messages/bulk_delete', json={'ids': bad_ids}).status_code == 422
+    assert Message.query.count() == 2
+
+    response = client.post('/messages/bulk_delete', json={'ids': ids})
+    assert response.get_json() == {'deleted': 1, 'skipped': 1}
+    assert [m.title for m in Message.query] == ['Meeting Reminder']
+
+    response = client.post('/messages/bulk_delete', data={'before': 'yesterday'}, follow_redirects=True)
+    assert b'Invalid date' in response.data
+
+def test_bulk_delete_before_date(client, init_database):
+    """Test that a pharmacist can clear out every message older than a date."""
+    client.post('/login', data={'username': 'pharmacist1', 'password': 'Pharmacist123!'})
+    response = client.post('/messages/bulk_delete', data={'before': '2999-01-01'}, follow_redirects=True)
+    assert b'2 message(s) deleted.' in response.data
+    assert Message.query.count() == 0
+
+def test_message_bodies_load_on_demand(client, init_database):
+    """Test that the list leaves bodies out and the body fragment escapes them."""
+    client.post('/login', data={'username': 'doctor1', 'password': 'Doctor123!'})
+    message = Message(title='Script', content='<script>alert(1)</script>\nline two',
+                      sender_id=User.query.filter_by(username='doctor1').one().id)
+    db.session.add(message)
+    db.session.commit()
+
+    page = client.get('/messages').data
+    assert b'Script' in page
+    assert b'alert(1)' not in page
+    assert b'running low' not in page
+
+    body = client.get(f'/messages/{message.id}/body').data
+    assert b'&lt;script&gt;alert(1)&lt;/script&gt;\nline two' in body
+    assert b'<script>' not in body
+    assert client.get('/messages/999/body').status_code == 404
@@ -0,0 +1,95 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+import logging
+import metrics
+from app import create_app, db
+
+def login(client):
+    client.post('/login', data={'username': 'doctor1', 'password': 'Doctor123!'})
+
+def test_request_metrics(client, init_database):
+    """Test that a page view records latency, status, SQL and template timings."""
+    login(client)
+    before = (metrics.request_latency.count('main.drugs', 'GET'),
+              metrics.requests_total.value('main.drugs', 'GET', 200),
+              metrics.template_seconds.count('drugs.html'))
+    statements = metrics.statements_per_request.sum('main.drugs')
+
+    assert client.get('/drugs').status_code == 200
+
+    assert metrics.request_latency.count('main.drugs', 'GET') == before[0] + 1
+    assert metrics.requests_total.value('main.drugs', 'GET', 200) == before[1] + 1
+    assert metrics.template_seconds.count('drugs.html') == before[2] + 1
+    assert metrics.statements_per_request.sum('main.drugs') > statements
+
+def test_metrics_endpoint_format(client, init_database):
+    """Test the Prometheus exposition served by /metrics."""
+    login(client)
+    client.get('/messages')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    body = response.get_data(as_text=True)
+    assert '# TYPE http_request_duration_seconds histogram' in body
+    assert 'http_request_duration_seconds_bucket{endpoint="main.messages",method="GET",le="+Inf"}' in body
+    assert 'http_requests_total{endpoint="main.messages",method="GET",status="200"}' in body
+    assert 'db_statements_per_request_count{endpoint="main.messages"}' in body
+    # Scrapes are not counted themselves
+    assert 'endpoint="metrics"' not in body
+
+def test_metrics_token(client, app, monkeypatch):
+    """Test that METRICS_TOKEN protects the endpoint when set."""
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+    assert client.get('/metrics').status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+
+def test_metrics_need_token_in_production(client, app, monkeypatch):
+    """Test that /metrics is not served without a token outside debug and testing."""
+    monkeypatch.setattr(app, 'testing', False)
+    monkeypatch.setattr(app, 'debug', False)
+    assert client.get('/metrics').status_code == 404
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+    assert client.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+def test_failed_requests_counted(app, client):
+    """Test that a request ending in an unhandled exception is counted as a 500."""
+    def boom():
+        raise RuntimeError('boom')
+    app.add_url_rule('/boom', 'boom', boom)
+    before = metrics.requests_total.value('boom', 'GET', 500)
+    with pytest.raises(RuntimeError):
+        client.get('/boom')
+    assert metrics.requests_total.value('boom', 'GET', 500) == before + 1
+    assert metrics.request_latency.count('boom', 'GET') >= 1
+
+def test_pool_checkout_wait_recorded(app):
+    """Test that pooled checkouts are timed."""
+    before = metrics.pool_wait.count()
+    with app.app_context():
+        db.session.execute(db.text('SELECT 1'))
+        db.session.remove()
+    assert metrics.pool_wait.count() > before
+
+def test_slow_query_log(tmp_path, caplog):
+    """Test that statements over the threshold are logged with their endpoint."""
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/slow.db',
+                      'SLOW_QUERY_THRESHOLD': 1e-9})
+    before = metrics.slow_queries.value('background')
+    with caplog.at_level(logging.WARNING, logger='slow_query'):
+        with app.app_context():
+            db.session.execute(db.text('SELECT 42'))
+            db.engine.dispose()
+    assert metrics.slow_queries.value('background') > before
+    assert any('background: SELECT 42' in record.getMessage() for record in caplog.records)
+
+def test_histogram_buckets_are_cumulative():
+    """Test bucket boundaries and the rendered cumulative counts."""
+    histogram = metrics.Histogram('t_seconds', 'Test.', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, 'a')
+    lines = histogram.render()
+    assert 't_seconds_bucket{route="a",le="0.1"} 2' in lines
+    assert 't_seconds_bucket{route="a",le="1.0"} 3' in lines
+    assert 't_seconds_bucket{route="a",le="+Inf"} 4' in lines
+    assert 't_seconds_count{route="a"} 4' in lines
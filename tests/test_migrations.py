@@ -0,0 +1,61 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+from sqlalchemy import create_engine, inspect, text
+import migrations
+from models import db, Drug, Message
+
+def model_indexes():
+    return {index.name for table in (Drug.__table__, Message.__table__) for index in table.indexes}
+
+def index_names(engine):
+    inspector = inspect(engine)
+    return {index['name'] for table in ('drug', 'message') for index in inspector.get_indexes(table)}
+
+def test_upgrade_fresh_database(tmp_path):
+    """Test that migrations build the full schema on an empty database."""
+    engine = create_engine(f'sqlite:///{tmp_path}/fresh.db')
+    applied = migrations.upgrade(engine, log=lambda msg: None)
+    
+    assert [m.version for m in applied] == [m.version for m in migrations.MIGRATIONS]
+    assert {'user', 'drug', 'message'} <= set(inspect(engine).get_table_names())
+    assert model_indexes() <= index_names(engine)
+    
+    # Running again is a no-op
+    assert migrations.upgrade(engine, log=lambda msg: None) == []
+
+def test_upgrade_legacy_create_all_database(tmp_path):
+    """Test upgrading a database created by the old db.create_all() without indexes."""
+    engine = create_engine(f'sqlite:///{tmp_path}/legacy.db')
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for name in model_indexes():
+            conn.execute(text(f'DROP INDEX {name}'))
+    assert not model_indexes() & index_names(engine)
+    
+    migrations.upgrade(engine, log=lambda msg: None)
+    assert model_indexes() <= index_names(engine)
+    assert migrations.pending_migrations(engine) == []
+
+def test_upgrade_adds_drug_version_column(tmp_path):
+    """Test that migration 6 adds drug.version to a table created before it existed."""
+    engine = create_engine(f'sqlite:///{tmp_path}/legacy.db')
+    db.metadata.tables['user'].create(engine)
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE drug (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, description TEXT, '
+            'quantity INTEGER NOT NULL, price FLOAT, expiry_date DATE NOT NULL, batch_number VARCHAR(50), '
+            'supplier VARCHAR(100), created_at DATETIME, updated_at DATETIME, added_by_id INTEGER NOT NULL)'
+        ))
+        conn.execute(text("INSERT INTO drug (name, quantity, expiry_date, added_by_id) "
+                          "VALUES ('Legacy', 3, '2030-01-01', 1)"))
+
+    migrations.upgrade(engine, log=lambda msg: None)
+    assert 'version' in {c['name'] for c in inspect(engine).get_columns('drug')}
+    assert {'stock_movement', 'stock_snapshot'} <= set(inspect(engine).get_table_names())
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT version FROM drug')).scalar() == 1
+
+def test_migration_versions_unique():
+    """Test that duplicate migration versions are rejected."""
+    with pytest.raises(ValueError):
+        migrations.migration(1, 'duplicate')(lambda conn: None)
@@ -0,0 +1,150 @@
+"""
+Query-plan regression tests.
+
+Each hot route is driven through the test client while its ORM statements
+are captured, then every captured SELECT is run through EXPLAIN. A plan that
+reads a whole table without an index fails the test.
+
+The PostgreSQL variant runs when TEST_POSTGRES_URL points at a scratch
+database; its schema is dropped and recreated.
+"""
+import pytest, os, re
+os.environ['TESTING'] = '1'
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from app import db
+from models import Drug, Message
+from pagination import encode_cursor
+from datetime import timedelta
+
+# Derived tables (anon_N) are scans of an already-limited subquery, not of a table
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?!anon_)(\w+)$')
+POSTGRES_FULL_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+def explain(conn, statement, params):
+    """Return the plan lines for an ORM statement on ``conn``'s database."""
+    if params:
+        statement = statement.params(**params)
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+    if conn.dialect.name == 'sqlite':
+        return [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql)]
+    return [row[0] for row in conn.exec_driver_sql('EXPLAIN ' + sql)]
+
+def route_urls(app):
+    with app.app_context():
+        drug = Drug.query.order_by(Drug.name, Drug.id).first()
+        message = Message.query.order_by(Message.timestamp.desc(), Message.id.desc()).first()
+        drug_cursor = encode_cursor([drug.name, drug.id])
+        message_cursor = encode_cursor([message.timestamp, message.id])
+    return [
+        '/dashboard',
+        '/drugs',
+        f'/drugs?after={drug_cursor}',
+        '/drugs?status=expired',
+        '/drugs?status=low_stock',
+        '/drugs?supplier=Pharma+Corp',
+        '/messages',
+        f'/messages?after={message_cursor}',
+        f'/messages/{message.id}/body',
+        '/messages/archive',
+        '/api/expiry_alerts',
+        '/drugs/search?q=amox',
+        f'/drugs/{drug.id}/stock',
+        f'/api/drugs/{drug.id}/quantity?at=2020-01-01T00:00:00',
+        f'/api/v1/drugs?status=ok&after={drug_cursor}',
+        '/api/v1/messages?fields=title,sender',
+        f'/api/v1/messages?after={message_cursor}',
+        f'/api/v1/users?after={encode_cursor([1])}',
+    ]
+
+@pytest.fixture
+def route_statements(client, app, init_database):
+    """SELECT statements issued by the hot routes, with their parameters."""
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+    urls = route_urls(app)
+    captured = []
+
+    def record(state):
+        if state.is_select:
+            captured.append((state.statement, dict(state.parameters or {})))
+
+    event.listen(Session, 'do_orm_execute', record)
+    try:
+        for url in urls:
+            assert client.get(url).status_code == 200, url
+    finally:
+        event.remove(Session, 'do_orm_execute', record)
+    assert captured
+    return captured
+
+def test_sqlite_plans_use_indexes(app, route_statements):
+    """Test that no hot-route query falls back to a full table scan on SQLite."""
+    with app.app_context():
+        conn = db.session.connection()
+        for statement, params in route_statements:
+            for line in explain(conn, statement, params):
+                assert not SQLITE_FULL_SCAN.match(line), f'{line} in plan for:\n{statement}'
+
+@pytest.mark.skipif(not os.environ.get('TEST_POSTGRES_URL'), reason='TEST_POSTGRES_URL not set')
+def test_postgres_plans_use_indexes(route_statements):
+    """Test the same queries against PostgreSQL with sequential scans discouraged."""
+    engine = create_engine(os.environ['TEST_POSTGRES_URL'])
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    try:
+        with engine.connect() as conn:
+            # Tiny tables always favour a seq scan; make the planner show what indexes it can use
+            conn.exec_driver_sql('SET enable_seqscan = off')
+            for statement, params in route_statements:
+                plan = '\n'.join(explain(conn, statement, params))
+                match = POSTGRES_FULL_SCAN.search(plan)
+                assert not match, f'{match.group(0)} in plan for:\n{statement}\n{plan}'
+    finally:
+        db.metadata.drop_all(engine)
+        engine.dispose()
+
+def test_dispense_uses_fefo_index(client, app, init_database):
+    """Test that the dispensing allocator reads batches through the FEFO index."""
+    client.post('/login', data={'username': 'pharmacist1', 'password': 'Pharmacist123!'})
+    captured = []
+
+    def record(state):
+        if state.is_select:
+            captured.append((state.statement, dict(state.parameters or {})))
+
+    event.listen(Session, 'do_orm_execute', record)
+    try:
+        assert client.post('/dispense', json={'name': 'Paracetamol', 'amount': 1}).status_code == 200
+    finally:
+        event.remove(Session, 'do_orm_execute', record)
+    with app.app_context():
+        conn = db.session.connection()
+        plans = [line for statement, params in captured for line in explain(conn, statement, params)]
+    assert any('ix_drug_name_expiry_date_id' in line for line in plans), plans
+
+def test_alert_scan_reads_ranges(app, init_database):
+    """Test that an incremental alert scan reads drugs by index range, not a table scan."""
+    import stock_alerts
+    sender = stock_alerts.alert_sender()
+    stock_alerts.scan(sender)
+    # Far enough ahead that every drug has expired since the first scan
+    later = max(d.expiry_date for d in Drug.query) + timedelta(days=1)
+    captured = []
+
+    def record(state):
+        if state.is_select:
+            captured.append((state.statement, dict(state.parameters or {})))
+
+    event.listen(Session, 'do_orm_execute', record)
+    try:
+        stock_alerts.scan(sender, today=later)
+    finally:
+        event.remove(Session, 'do_orm_execute', record)
+    conn = db.session.connection()
+    plans = [line for statement, params in captured for line in explain(conn, statement, params)]
+    assert not [line for line in plans if SQLITE_FULL_SCAN.match(line)], plans
+    assert any('ix_drug_updated_at_id' in line for line in plans), plans
+    assert any('ix_drug_expiry_date_quantity' in line for line in plans), plans
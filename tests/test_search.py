@@ -0,0 +1,57 @@
+import pytest, os
+from datetime import datetime, timedelta
+os.environ['TESTING'] = '1'
+from models import Drug, db
+import search
+
+def login(client):
+    client.post('/login', data={
+        'username': 'doctor1',
+        'password': 'Doctor123!'
+    })
+
+def names(results):
+    return [drug.name for drug, status in results]
+
+def test_search_prefix_across_fields(app, init_database):
+    """Test prefix matching on name, description, supplier and batch number."""
+    today = datetime.now().date()
+    assert names(search.search_drugs('parac', today)) == ['Paracetamol']
+    assert names(search.search_drugs('antibio', today)) == ['Amoxicillin']
+    assert names(search.search_drugs('medi suppl', today)) == ['Amoxicillin']
+    assert names(search.search_drugs('batch001', today)) == ['Paracetamol']
+
+def test_search_tolerates_typos(app, init_database):
+    """Test that a misspelled word still finds the drug."""
+    assert names(search.search_drugs('paracetmol', datetime.now().date())) == ['Paracetamol']
+
+def test_search_index_follows_edits(client, init_database):
+    """Test that added, edited and deleted drugs are reflected in search."""
+    login(client)
+    expiry = (datetime.now().date() + timedelta(days=100)).strftime('%Y-%m-%d')
+    client.post('/add_drug', data={'name': 'Ibuprofen', 'quantity': 40, 'expiry_date': expiry})
+    drug = Drug.query.filter_by(name='Ibuprofen').first()
+    assert [r['name'] for r in client.get('/api/drugs/search?q=ibu').get_json()] == ['Ibuprofen']
+    
+    client.post(f'/edit_drug/{drug.id}', data={'name': 'Naproxen', 'quantity': 40, 'expiry_date': expiry})
+    assert client.get('/api/drugs/search?q=ibu').get_json() == []
+    assert [r['name'] for r in client.get('/api/drugs/search?q=naprox').get_json()] == ['Naproxen']
+    
+    client.get(f'/delete_drug/{drug.id}')
+    assert client.get('/api/drugs/search?q=naprox').get_json() == []
+
+def test_search_page(client, init_database):
+    """Test the search results page."""
+    login(client)
+    response = client.get('/drugs/search?q=amox')
+    assert response.status_code == 200
+    assert b'Amoxicillin' in response.data
+    assert b'Paracetamol</strong>' not in response.data
+    assert b'EXPIRED' in response.data
+
+def test_stock_changes_do_not_reindex(app, init_database):
+    """Test that only updates to searched columns re-index a drug."""
+    trigger = db.session.execute(db.text(
+        "SELECT sql FROM sqlite_master WHERE name = 'drug_fts_update'"
+    )).scalar()
+    assert 'AFTER UPDATE OF name, description, supplier, batch_number ON drug' in trigger
@@ -0,0 +1,200 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+import threading
+from datetime import datetime, timedelta
+from app import db
+from models import Drug, StockMovement, StockSnapshot
+import stock
+
+def login(client):
+    client.post('/login', data={'username': 'pharmacist1', 'password': 'Pharmacist123!'})
+
+def drug_id(app, name='Paracetamol'):
+    with app.app_context():
+        return Drug.query.filter_by(name=name).first().id
+
+def test_dispense_and_receive(client, app, init_database):
+    """Test JSON stock movements update the quantity and append to the ledger."""
+    login(client)
+    paracetamol = drug_id(app)
+    response = client.post(f'/drugs/{paracetamol}/stock', json={'action': 'dispense', 'amount': 30})
+    assert response.status_code == 200
+    assert response.get_json()['quantity'] == 70
+    response = client.post(f'/drugs/{paracetamol}/stock', json={'action': 'receive', 'amount': 5,
+                                                              'reason': 'Delivery'})
+    assert response.get_json()['quantity'] == 75
+
+    with app.app_context():
+        movements = StockMovement.query.order_by(StockMovement.id).all()
+        assert [(m.kind, m.change, m.quantity_after) for m in movements] == \
+            [('dispense', -30, 70), ('receive', 5, 75)]
+        assert movements[1].reason == 'Delivery'
+        assert db.session.get(Drug, paracetamol).quantity == 75
+
+def test_dispense_cannot_go_negative(client, app, init_database):
+    """Test that dispensing more than is in stock changes nothing."""
+    login(client)
+    amoxicillin = drug_id(app, 'Amoxicillin')
+    response = client.post(f'/drugs/{amoxicillin}/stock', json={'action': 'dispense', 'amount': 6})
+    assert response.status_code == 422
+    assert 'Only 5' in response.get_json()['error']
+    with app.app_context():
+        assert db.session.get(Drug, amoxicillin).quantity == 5
+        assert StockMovement.query.count() == 0
+
+def test_stale_version_rejected(client, app, init_database):
+    """Test the optimistic version check on movements and on the edit form."""
+    login(client)
+    paracetamol = drug_id(app)
+    with app.app_context():
+        version = db.session.get(Drug, paracetamol).version
+    client.post(f'/drugs/{paracetamol}/stock', json={'action': 'receive', 'amount': 1})
+
+    response = client.post(f'/drugs/{paracetamol}/stock',
+                           json={'action': 'dispense', 'amount': 1, 'version': version})
+    assert response.status_code == 409
+    response = client.post(f'/drugs/{paracetamol}/stock',
+                           json={'action': 'receive', 'amount': 1, 'version': 'abc'})
+    assert response.status_code == 422
+
+    response = client.post(f'/edit_drug/{paracetamol}', data={
+        'version': version, 'name': 'Paracetamol', 'quantity': 500, 'price': 5.99,
+        'expiry_date': (datetime.now().date() + timedelta(days=365)).strftime('%Y-%m-%d'),
+    }, follow_redirects=True)
+    assert b'changed by someone else' in response.data
+    with app.app_context():
+        assert db.session.get(Drug, paracetamol).quantity == 101
+
+def test_edit_records_quantity_change(client, app, init_database):
+    """Test that a quantity typed into the edit form is recorded as an adjustment."""
+    login(client)
+    paracetamol = drug_id(app)
+    client.post(f'/edit_drug/{paracetamol}', data={
+        'name': 'Paracetamol', 'quantity': 90, 'price': 5.99,
+        'expiry_date': (datetime.now().date() + timedelta(days=365)).strftime('%Y-%m-%d'),
+    })
+    with app.app_context():
+        movement = StockMovement.query.one()
+        assert (movement.kind, movement.change, movement.quantity_after) == ('adjust', -10, 90)
+
+def test_concurrent_dispenses_do_not_lose_updates(app, init_database):
+    """Test that parallel dispenses all land."""
+    paracetamol = drug_id(app)
+
+    def dispense():
+        for _ in range(10):
+            with app.app_context():
+                stock.apply_movements('dispense', [stock.movement('dispense', paracetamol, 1)], None)
+                db.session.commit()
+
+    threads = [threading.Thread(target=dispense) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with app.app_context():
+        assert db.session.get(Drug, paracetamol).quantity == 70
+        assert StockMovement.query.count() == 30
+
+def test_quantity_at(app, init_database):
+    """Test point-in-time quantities from movements and snapshots."""
+    paracetamol = drug_id(app)
+    with app.app_context():
+        start = datetime.utcnow()
+        db.session.get(Drug, paracetamol).created_at = start - timedelta(hours=4)
+        db.session.commit()
+        assert stock.take_snapshot(now=start - timedelta(hours=2)) == 2
+        # Nothing changed since, so nothing new to record
+        assert stock.take_snapshot(now=start - timedelta(hours=1)) == 0
+        stock.apply_movements('dispense', [stock.movement('dispense', paracetamol, 40)], None)
+        db.session.commit()
+        assert stock.take_snapshot() == 1
+        db.session.commit()
+
+        assert stock.quantity_at(paracetamol, start - timedelta(hours=3)) == 100
+        assert stock.quantity_at(paracetamol, start - timedelta(minutes=30)) == 100
+        assert stock.quantity_at(paracetamol, datetime.utcnow() + timedelta(minutes=1)) == 60
+        assert StockSnapshot.query.filter_by(drug_id=paracetamol).count() == 2
+        assert stock.quantity_at(999, start) is None
+        # Before the drug was added
+        assert stock.quantity_at(paracetamol, start - timedelta(hours=5)) is None
+
+def test_quantity_api_reads_time_zones(client, app, init_database):
+    """Test that an offset or Z timestamp is read as UTC instead of failing."""
+    login(client)
+    paracetamol = drug_id(app)
+    for at in ('2999-01-01T00:00:00+00:00', '2999-01-01T00:00:00Z', '2999-01-01T02:00:00+02:00'):
+        response = client.get(f'/api/drugs/{paracetamol}/quantity', query_string={'at': at})
+        assert response.get_json() == {'drug_id': paracetamol, 'at': '2999-01-01T00:00:00', 'quantity': 100}
+    response = client.get(f'/drugs/{paracetamol}/stock', query_string={'at': '2999-01-01T00:00:00Z'})
+    assert response.status_code == 200
+    assert client.get(f'/api/drugs/{paracetamol}/quantity?at=soon').status_code == 400
+
+def test_stock_page(client, app, init_database):
+    """Test the stock page form flow and history table."""
+    login(client)
+    paracetamol = drug_id(app)
+    response = client.post(f'/drugs/{paracetamol}/stock', data={
+        'action': 'dispense', 'amount': '3', 'reason': 'Ward 4'
+    }, follow_redirects=True)
+    assert b'Stock updated: 97 in stock.' in response.data
+    assert b'Ward 4' in response.data
+
+    response = client.post(f'/drugs/{paracetamol}/stock', data={'action': 'dispense', 'amount': '-1'},
+                           follow_redirects=True)
+    assert b'Amount must be positive' in response.data
+
+def add_batch(app, name, quantity, days, batch_number):
+    with app.app_context():
+        drug = Drug(name=name, quantity=quantity, price=1.0, batch_number=batch_number,
+                    expiry_date=datetime.now().date() + timedelta(days=days), added_by_id=1)
+        db.session.add(drug)
+        db.session.commit()
+        return drug.id
+
+def test_dispense_allocates_first_expiry_first_out(client, app, init_database):
+    """Test that a cart takes stock from the earliest-expiring unexpired batches."""
+    login(client)
+    paracetamol = drug_id(app)
+    soon = add_batch(app, 'Paracetamol', 20, 30, 'PARA-SOON')
+    add_batch(app, 'Paracetamol', 50, -1, 'PARA-EXPIRED')
+    add_batch(app, 'Amoxicillin', 8, 10, 'AMOX-NEW')
+
+    response = client.post('/dispense', json={'items': [
+        {'name': 'Paracetamol', 'amount': 25}, {'name': 'Amoxicillin', 'amount': 3},
+    ], 'reason': 'Rx 42'})
+    assert response.status_code == 200
+    allocations = response.get_json()['allocations']
+    assert [(t['batch_number'], t['taken'], t['remaining']) for t in allocations[0]['batches']] == \
+        [('PARA-SOON', 20, 0), ('BATCH001', 5, 95)]
+    assert [(t['batch_number'], t['taken']) for t in allocations[1]['batches']] == [('AMOX-NEW', 3)]
+
+    with app.app_context():
+        assert db.session.get(Drug, soon).quantity == 0
+        assert db.session.get(Drug, paracetamol).quantity == 95
+        assert Drug.query.filter_by(batch_number='PARA-EXPIRED').one().quantity == 50
+        assert StockMovement.query.filter_by(kind='dispense', reason='Rx 42').count() == 3
+        # Only the batches a line takes from are read and locked
+        batches = stock._fefo_batches({'Paracetamol': 50}, datetime.now().date())
+        assert [b.batch_number for b in batches] == ['BATCH001']
+
+def test_dispense_cart_is_all_or_nothing(client, app, init_database):
+    """Test that one short line fails the whole cart and changes nothing."""
+    login(client)
+    response = client.post('/dispense', json={'items': [
+        {'name': 'Paracetamol', 'amount': 10}, {'name': 'Amoxicillin', 'amount': 1},
+    ]})
+    assert response.status_code == 409
+    # The only Amoxicillin batch has expired
+    assert response.get_json()['shortages'] == [{'name': 'Amoxicillin', 'requested': 1, 'available': 0}]
+    with app.app_context():
+        assert Drug.query.filter_by(name='Paracetamol').one().quantity == 100
+        assert StockMovement.query.count() == 0
+
+    assert client.post('/dispense', json={'items': [{'name': 'Paracetamol', 'amount': 0}]}).status_code == 422
+    for bad in ({'name': 5, 'amount': 1}, {'items': ['Paracetamol']}, {'items': 'Paracetamol'}):
+        assert client.post('/dispense', json=bad).status_code == 422
+    response = client.post('/dispense', data={'name': ['Paracetamol', ''], 'amount': ['4', '']},
+                           follow_redirects=True)
+    assert b'Dispensed successfully!' in response.data
+    assert b'BATCH001' in response.data
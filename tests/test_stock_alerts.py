@@ -0,0 +1,89 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+from datetime import datetime, timedelta
+from app import db
+from models import Drug, DrugAlert, Message, User
+import archive
+import scheduler
+import stock
+import stock_alerts
+
+def alert_messages():
+    return Message.query.filter(Message.title.like('%batch(es)%')).order_by(Message.id).all()
+
+def scan(**kwargs):
+    return stock_alerts.scan(stock_alerts.alert_sender(), **kwargs)
+
+def test_scan_posts_each_alert_once(init_database):
+    """Test that the first scan alerts the expired drug and later scans do not repeat it."""
+    assert scan() == {'checked': 2, 'messages': 1}
+    [message] = alert_messages()
+    assert message.is_urgent
+    assert message.sender.role == 'pharmacist'
+    assert message.title == 'Expired stock: 1 batch(es) to remove'
+    assert message.content.startswith('Amoxicillin (batch BATCH002): 5 left, expired')
+
+    # The lag window re-reads both drugs, but nothing new is posted
+    assert scan()['messages'] == 0
+    assert len(alert_messages()) == 1
+
+def test_low_stock_closes_and_reopens(init_database):
+    """Test that a restocked drug's alert closes, so running low again alerts again."""
+    scan()
+    paracetamol = Drug.query.filter_by(name='Paracetamol').one()
+    user_id = paracetamol.added_by_id
+
+    def move(kind, amount):
+        stock.apply_movements(kind, [stock.movement(kind, paracetamol.id, amount)], user_id)
+        db.session.commit()
+
+    move('dispense', 95)
+    assert scan()['messages'] == 1
+    assert alert_messages()[-1].title == 'Low stock: 1 batch(es) to reorder'
+    move('receive', 50)
+    scan()
+    assert db.session.get(DrugAlert, (paracetamol.id, 'low_stock')) is None
+    move('dispense', 50)
+    assert scan()['messages'] == 1
+    assert len(alert_messages()) == 3
+
+def test_expiry_found_without_change(init_database):
+    """Test that a drug expiring by date alone is found by the expiry range, not a rescan."""
+    now = datetime.utcnow()
+    scan(now=now)
+    later = datetime.now().date() + timedelta(days=400)
+    # No lag: only drugs changed after the previous scan count as changed
+    assert scan(today=later, now=now + timedelta(days=400), lag=0) == {'checked': 1, 'messages': 1}
+    assert 'Paracetamol' in alert_messages()[-1].content
+
+def test_closed_alerts_are_archived(init_database):
+    """Test that an alert message stays urgent while open and is archived once closed."""
+    scan()
+    later = datetime.utcnow() + timedelta(days=365)
+    archive.archive_messages(now=later)
+    [message] = alert_messages()
+    assert message.is_urgent
+
+    # Disposing of the expired stock closes the alert
+    amoxicillin = Drug.query.filter_by(name='Amoxicillin').one()
+    stock.apply_movements('adjust', [stock.movement('adjust', amoxicillin.id, -5)], amoxicillin.added_by_id)
+    db.session.commit()
+    scan()
+    db.session.expire_all()
+    assert not db.session.get(Message, message.id).is_urgent
+    archive.archive_messages(now=later)
+    assert alert_messages() == []
+
+def test_lease_has_one_holder(init_database):
+    """Test that only one scheduler holds a job lease until it expires or is released."""
+    now = datetime.utcnow()
+    assert scheduler.acquire('job', 'a', ttl=60, now=now)
+    assert not scheduler.acquire('job', 'b', ttl=60, now=now)
+    assert scheduler.acquire('job', 'a', ttl=60, now=now + timedelta(seconds=30))
+    assert not scheduler.acquire('job', 'b', ttl=60, now=now + timedelta(seconds=60))
+    assert scheduler.acquire('job', 'b', ttl=60, now=now + timedelta(seconds=91))
+
+    job = scheduler.Job('job', 60, lambda keep_alive: 'ran')
+    assert scheduler.run_once(job, 'a') is None
+    scheduler.release('job', 'b')
+    assert scheduler.run_once(job, 'a') == 'ran'
@@ -0,0 +1,49 @@
+import pytest, os
+os.environ['TESTING'] = '1'
+from flask import g
+from app import db
+from models import Message, MessageReadMark, User
+import unread
+
+def login(client, username='doctor1', password='Doctor123!'):
+    client.post('/login', data={'username': username, 'password': password}, follow_redirects=True)
+
+def forget_mark():
+    # init_database keeps one app context, so g outlives each test request
+    g.pop('last_seen_message_id', None)
+
+def test_unread_badge_and_highlight(client, init_database):
+    """Test that the dashboard counts messages from others and /messages highlights them once."""
+    login(client)
+    response = client.get('/dashboard')
+    # Only the nurse's Meeting Reminder is unread for the doctor
+    assert b'Unread Messages' in response.data
+    assert unread.unread_count(User.query.filter_by(username='doctor1').one().id) == 1
+    forget_mark()
+
+    response = client.get('/messages')
+    assert response.data.count(b'class="badge"') == 1
+    forget_mark()
+
+    response = client.get('/messages')
+    assert b'class="badge"' not in response.data
+    forget_mark()
+    doctor = User.query.filter_by(username='doctor1').one()
+    assert unread.unread_count(doctor.id) == 0
+
+def test_mark_only_moves_forward(init_database):
+    """Test that an older message id never lowers the read mark."""
+    nurse = User.query.filter_by(username='nurse1').one()
+    newest = db.session.query(db.func.max(Message.id)).scalar()
+    unread.mark_seen(nurse.id, newest)
+    unread.mark_seen(nurse.id, newest - 1)
+    assert db.session.get(MessageReadMark, nurse.id).last_seen_message_id == newest
+
+def test_unread_count_is_capped(init_database):
+    """Test that the unread count stops at the cap."""
+    nurse = User.query.filter_by(username='nurse1').one()
+    db.session.add_all([Message(title=f'Notice {n}', content='x', sender_id=nurse.id) for n in range(5)])
+    db.session.commit()
+    doctor = User.query.filter_by(username='doctor1').one()
+    assert unread.unread_count(doctor.id, limit=3) == 3
+    assert unread.unread_count(doctor.id) == 6
@@ -0,0 +1,65 @@
+"""
+Unread messages, tracked with one high-water mark per user.
+
+message_read_mark holds the newest message id each user has seen. A message
+is unread for a user when its id is above that mark and someone else sent
+it, so there is no row per user per message. The unread count is a primary-
+key range scan of message above the mark, capped at MAX_COUNTED rows so
+the badge costs the same after a year away as after a minute.
+
+The mark only moves forward (when the newest page of /messages is shown),
+and it is written on its own connection, outside the request's routed
+session. Marking messages seen therefore does not pin the browser to the
+primary, and it does not bump the user or message table versions that the
+page caches key on (see httpcache.py).
+"""
+from datetime import datetime
+
+from flask import g, has_request_context
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Message, MessageReadMark
+
+MAX_COUNTED = 99
+
+
+def last_seen(user_id):
+    """The newest message id ``user_id`` has seen (0 if none), read at most once per request."""
+    cached = g.get('last_seen_message_id') if has_request_context() else None
+    if cached is not None and cached[0] == user_id:
+        return cached[1]
+    mark = db.session.query(MessageReadMark.last_seen_message_id) \
+        .filter(MessageReadMark.user_id == user_id).scalar() or 0
+    if has_request_context():
+        g.last_seen_message_id = (user_id, mark)
+    return mark
+
+
+def unread_count(user_id, limit=MAX_COUNTED + 1):
+    """Messages from others above the user's mark, counting at most ``limit``."""
+    unread = select(Message.id).where(Message.id > last_seen(user_id),
+                                      Message.sender_id != user_id).limit(limit).subquery()
+    return db.session.query(func.count()).select_from(unread).scalar()
+
+
+def mark_seen(user_id, message_id):
+    """Raise the user's mark to ``message_id``; a lower id (an older tab) is ignored."""
+    raise_mark = update(MessageReadMark) \
+        .where(MessageReadMark.user_id == user_id, MessageReadMark.last_seen_message_id < message_id) \
+        .values(last_seen_message_id=message_id, seen_at=datetime.utcnow())
+    with db.engine.begin() as conn:
+        if conn.execute(raise_mark).rowcount:
+            return
+        exists = conn.execute(select(MessageReadMark.user_id)
+                              .where(MessageReadMark.user_id == user_id)).first()
+        if exists:
+            return
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(MessageReadMark).values(
+                    user_id=user_id, last_seen_message_id=message_id, seen_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # Another request created the row first
+            conn.execute(raise_mark)